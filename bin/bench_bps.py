@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import bps_synth
+
+try:
+    import lsst.pipe.base.graph
+except ImportError:
+    # Without the LSST stack quanta are saved using the stand-ins.
+    graphModule = types.ModuleType("lsst.pipe.base.graph")
+    graphModule.QuantumGraph = bps_synth.SynthQuantumGraph
+    graphModule.QuantumGraphTaskNodes = bps_synth.SynthTaskNodes
+    for name in ("lsst", "lsst.pipe", "lsst.pipe.base"):
+        sys.modules.setdefault(name, types.ModuleType(name))
+    sys.modules["lsst.pipe.base.graph"] = graphModule
+
+from bps_funcs import create_science_graph, create_workflow_graph
+from bps_metrics import max_rss
+
+try:
+    from daxgen import Daxgen
+except ImportError:
+    Daxgen = None
+
+
+def measure(results, stage, func, *args, **kwargs):
+    """Run a single stage recording its wall time, CPU time and memory
+
+    Memory is recorded as the peak of the Python heap while the stage runs
+    (traced with tracemalloc, unless memory is False) and as the resident
+    set size high-water mark of the process and of its children after the
+    stage, with the growth of the process' mark during the stage.  Stages
+    of all sizes run in the same process, so only the growth is specific
+    to a stage.
+
+    Parameters
+    ----------
+    results : `list`
+        List the stage's record is appended to
+    stage : `str`
+        Name of the stage
+    func : callable
+        Function implementing the stage
+
+    Returns
+    -------
+    result
+        Value returned by func
+    """
+    memory = kwargs.pop('memory', True)
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    rss = max_rss()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = func(*args, **kwargs)
+    record = {'stage': stage,
+              'wall': time.perf_counter() - wall,
+              'cpu': time.process_time() - cpu,
+              'peak': None}
+    if memory:
+        record['peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    record['max_rss'] = max_rss()
+    record['max_rss_growth'] = record['max_rss'] - rss
+    record['children_max_rss'] = max_rss(children=True)
+    results.append(record)
+    logging.info("%s: wall=%.3fs cpu=%.3fs peak=%s max_rss=%d (+%d)", stage, record['wall'], record['cpu'],
+                 record['peak'], record['max_rss'], record['max_rss_growth'])
+    return result
+
+
+def run_size(args, nquanta):
+    """Run all stages for a synthetic graph of a given size
+
+    Parameters
+    ----------
+    args : `Namespace`
+        Command line arguments
+    nquanta : `int`
+        Approximate number of quanta
+
+    Returns
+    -------
+    report : `dict`
+        Size of the generated graph and records of all stages
+    """
+    memory = not args.no_memory
+    results = []
+    qgraph = measure(results, 'generate', bps_synth.generate_qgraph, nquanta,
+                     detectors=args.detectors, filters=args.filters, depth=args.depth, memory=memory)
+    report = {'requested': nquanta,
+              'quanta': sum(len(nodes.quanta) for nodes in qgraph),
+              'stages': results}
+
+    sciGraph, qgnodes = measure(results, 'create_science_graph', create_science_graph, qgraph,
+                                cluster_size=args.cluster_size, jobs=args.jobs, memory=memory)
+    report['nodes'] = sciGraph.number_of_nodes()
+    report['edges'] = sciGraph.number_of_edges()
+    del qgraph
+
+    outdir = tempfile.mkdtemp(prefix="bench_bps_", dir=args.workdir)
+    try:
+        os.mkdir(os.path.join(outdir, 'input'))
+        if args.archive is None:
+            activator, actargs = 'pipetask', '-b butler.yaml run --skip-init-writes --qgraph {qlfn}'
+        else:
+            activator, actargs = 'run_quantum.py', '{qlfn} {qkey} pipetask -b butler.yaml run --skip-init-writes'
+        wfArgs = argparse.Namespace(outdir=outdir, archive=args.archive, jobs=args.jobs, activator=activator,
+                                    actargs=actargs)
+        measure(results, 'create_workflow_graph', create_workflow_graph, wfArgs, sciGraph, qgnodes,
+                memory=memory)
+        del qgnodes
+
+        if Daxgen is None:
+            logging.warning("Pegasus is not available, skipping DAX stages")
+        else:
+            # only building the DAX generator is measured, not the conversion
+            nxGraph = sciGraph.to_networkx()
+            measure(results, 'daxgen_init', Daxgen, graph=nxGraph, memory=memory)
+            del nxGraph
+            gen = measure(results, 'daxgen_init_trusted', Daxgen, graph=sciGraph, trusted=True, validate=True,
+                          memory=memory)
+            measure(results, 'write_dax', gen.write_dax, os.path.join(outdir, 'bench.dax'), memory=memory)
+            measure(results, 'write_dax_stream', gen.write_dax_stream, os.path.join(outdir, 'bench_stream.dax'),
+                    memory=memory)
+            measure(results, 'write_rc', gen.write_rc, os.path.join(outdir, 'bench_rc.txt'), memory=memory)
+    finally:
+        shutil.rmtree(outdir)
+    return report
+
+
+def parse_args(argv=None):
+    """Parse command line, and test for required arguments
+
+    Parameters
+    ----------
+    argv : `list`
+        List of strings containing the command-line arguments.
+
+    Returns
+    -------
+    args : `Namespace`
+        Command-line arguments converted into an object with attributes.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Benchmark submission stages on synthetic QuantumGraphs")
+    parser.add_argument("-n", "--sizes", action="store", dest="sizes", type=int, nargs='+', required=False,
+                        help="Approximate numbers of quanta of benchmarked graphs",
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--detectors", action="store", dest="detectors", type=int, required=False,
+                        help="Number of detectors per visit", default=16)
+    parser.add_argument("--filters", action="store", dest="filters", type=int, required=False,
+                        help="Number of filters", default=3)
+    parser.add_argument("--depth", action="store", dest="depth", type=int, required=False,
+                        help="Average number of visits per patch", default=15)
+    parser.add_argument("--cluster_size", action="store", dest="cluster_size", type=int, required=False,
+                        help="Maximum number of quanta per job", default=None)
+    parser.add_argument("--quantum_archive", action="store", dest="archive", required=False,
+                        help="Save quanta into a single archive with this name", default=None)
+    parser.add_argument("-j", "--jobs", action="store", dest="jobs", type=int, required=False,
+                        help="Number of processes used to build the science graph and save quanta", default=1)
+    parser.add_argument("--workdir", action="store", dest="workdir", required=False,
+                        help="Directory for temporary outputs", default=None)
+    parser.add_argument("--no_memory", action="store_true", dest="no_memory", required=False,
+                        help="If set, does not trace the Python heap (tracing slows down all stages), "
+                             "RSS is recorded anyway")
+    parser.add_argument("-o", "--output", action="store", dest="output", required=False,
+                        help="JSON file to save results to", default=None)
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose", required=False,
+                        help="Set logging to info level")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Program entry point.
+
+    Parameters
+    ----------
+    argv : `list`
+        List of strings containing command line arguments.
+    """
+    args = parse_args(argv)
+
+    logging.basicConfig(format="%(levelname)s::%(asctime)s::%(message)s", datefmt="%m/%d/%Y %H:%M:%S")
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    reports = []
+    print("%10s %10s %10s  %-24s %10s %10s %12s %12s %12s" % ("quanta", "nodes", "edges", "stage", "wall[s]",
+                                                             "cpu[s]", "heap[MiB]", "maxrss[MiB]",
+                                                             "+rss[MiB]"))
+    for nquanta in args.sizes:
+        report = run_size(args, nquanta)
+        reports.append(report)
+        for record in report['stages']:
+            peak = "%.1f" % (record['peak'] / 2**20) if record['peak'] is not None else "-"
+            print("%10d %10d %10d  %-24s %10.3f %10.3f %12s %12.1f %12.1f" % (
+                report['quanta'], report['nodes'], report['edges'], record['stage'], record['wall'],
+                record['cpu'], peak, record['max_rss'] / 2**20, record['max_rss_growth'] / 2**20))
+        sys.stdout.flush()
+
+    if args.output is not None:
+        with open(args.output, "w") as outfile:
+            json.dump(reports, outfile, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -5,16 +5,24 @@ import argparse
 import os
 import sys
 import re
-import pickle
 
 from bps_draw import draw_networkx_dot
-from bps_funcs import create_science_graph, create_workflow_graph, create_all_schemas
+from bps_funcs import create_science_graph, create_workflow_graph, create_all_schemas, assign_exec_args, \
+    select_subgraph, prune_existing, assign_resources
+from bps_cache import BuildCache, file_digest, options_digest
+from bps_metrics import StageMetrics, file_size
+from bps_graphfile import read_graph, write_graph
+from bps_qgraph import iter_qgraph, dataid_predicate
+from bps_registry import RegistryLookup, registry_db_path
+from bps_resources import ResourceModel
 from daxgen import Daxgen
 
-def read_qgraph(qgraph_filename):
-    with open(qgraph_filename, 'rb') as pickleFile:
-        qgraph = pickle.load(pickleFile)
-    return qgraph
+# Default activators and their args, quanta in an archive are extracted by
+# run_quantum.py, which appends --qgraph with the extracted quantum itself
+ACTIVATOR = "pipetask"
+ACTARGS = "-b {butler} -i {incol} -o {outcol} run --skip-init-writes --qgraph {qlfn}"
+ARCHIVE_ACTIVATOR = "run_quantum.py"
+ARCHIVE_ACTARGS = "{qlfn} {qkey} pipetask -b {butler} -i {incol} -o {outcol} run --skip-init-writes"
 
 def parse_args(argv=None):
     """Parse command line, and test for required arguments
@@ -40,17 +48,39 @@ def parse_args(argv=None):
     required.add_argument("-o", "--output_collection", action="store", dest="outcol", required=True,
                           help="Butler output collection name")
     required.add_argument("--qgraph", action="store", dest="qgraph", required=True,
-                          help="Pipeline qgraph pickle file")
+                          help="Pipeline qgraph pickle file or qgraph stream (see make_qgraph_stream.py)")
     parser.add_argument("-x", "--activator", action="store", dest="activator", required=False,
-                        help="Activator executable name (no path)",
-                        default="pipetask")
+                        help="Activator executable name (no path), defaults to %s (%s with "
+                             "--quantum_archive)" % (ACTIVATOR, ARCHIVE_ACTIVATOR),
+                        default=None)
     parser.add_argument("-a", "--actargs", action="store", type=str, dest="actargs", required=False,
-                        help="Activator args with special keys as {key}",
-                        default="-b {butler} -i {incol} -o {outcol} run --skip-init-writes --qgraph {qlfn}")
+                        help="Activator args with special keys as {key}, defaults to '%s' ('%s' with "
+                             "--quantum_archive)" % (ACTARGS, ARCHIVE_ACTARGS),
+                        default=None)
     parser.add_argument("--outdir", action="store", dest="outdir", required=False,
                         help="output directory for internal files", default=".")
+    parser.add_argument("--select_labels", action="store", dest="select_labels", required=False,
+                        help="Comma separated labels of tasks to include (others are not loaded "
+                             "if --without_ancestors)",
+                        default=None)
+    parser.add_argument("--select_dataid", action="store", dest="select_dataid", required=False,
+                        help="Include only quanta with outputs matching key=value pairs, e.g., 'patch=69'",
+                        default=None)
+    parser.add_argument("--select_nodes", action="store", dest="select_nodes", required=False,
+                        help="Comma separated ids of task nodes to include: DAX job ids of the workflow "
+                             "made with the same clustering and without selection or --skip_existing, "
+                             "which renumber nodes",
+                        default=None)
+    parser.add_argument("--without_ancestors", action="store_false", dest="with_ancestors", required=False,
+                        help="If set, selected quanta come without the quanta producing their inputs "
+                             "(by default included, recursively)")
+    parser.add_argument("--skip_existing", action="store_true", dest="skip_existing", required=False,
+                        help="If set, leaves out quanta whose outputs all exist in the output collection "
+                             "(looked up in the butler registry)")
     parser.add_argument("--drawdir", action="store", dest="drawdir", required=False,
                         help="output directory for dot files", default=None)
+    parser.add_argument("--draw_summary", action="store_true", dest="draw_summary", required=False,
+                        help="If set, dot files show tasks collapsed by label and datasets by dataset type")
     parser.add_argument("--dryrun", action="store_true", dest="dryrun", required=False,
                         help="If set, creates all files, but does not actually submit")
     parser.add_argument("-d", "--debug", action="store_true", dest="debug", required=False,
@@ -66,7 +96,83 @@ def parse_args(argv=None):
     parser.add_argument('--schema_args', action="store", dest="schargs", type=str, required=False,
                         help='Command line to create schemas with special keys as {key}',
                         default="pipetask -b {butler} -i {incol} -o {outcol} run --init-only --qgraph {qlfn}")
-    return parser.parse_args(argv)
+    parser.add_argument("--cluster_size", action="store", dest="cluster_size", type=int, required=False,
+                        help="Maximum number of quanta of the same task executed by a single job",
+                        default=None)
+    parser.add_argument("--cluster_runtime", action="store", dest="cluster_runtime", type=float,
+                        required=False, help="Target runtime (in seconds) of a single job",
+                        default=None)
+    parser.add_argument("--quantum_runtime", action="store", dest="quantum_runtime", type=float,
+                        required=False, help="Estimated runtime (in seconds) of a single quantum "
+                                             "(if not given by the resource model)",
+                        default=60.0)
+    parser.add_argument("--resources", action="store", dest="resources", required=False,
+                        help="YAML or CSV file with memory (MB), cores and runtime (seconds) of quanta "
+                             "by task label, used for job profiles and clustering by runtime "
+                             "(see bps_resources.py)",
+                        default=None)
+    parser.add_argument("--quantum_archive", action="store", dest="archive", required=False,
+                        help="Name of a single archive (saved in outdir/input) holding all quanta "
+                             "instead of one pickle file per quantum, read in place by jobs (outdir must "
+                             "be on the shared file system).  Activator args get the absolute path of "
+                             "the archive as {qlfn} and the quantum key as {qkey}, and must not "
+                             "include --qgraph (e.g., -x run_quantum.py -a '{qlfn} {qkey} pipetask ... run')",
+                        default=None)
+    parser.add_argument("-j", "--jobs", action="store", dest="jobs", type=int, required=False,
+                        help="Number of processes used to build the science graph and save quanta",
+                        default=1)
+    parser.add_argument("--schema_jobs", action="store", dest="schema_jobs", type=int, required=False,
+                        help="Number of concurrent init-only runs creating schemas, all writing to the "
+                             "registry (runs failing on a locked registry are retried)",
+                        default=2)
+    parser.add_argument("--schema_cache", action="store", dest="schema_cache", required=False,
+                        help="File recording tasks with already created schemas "
+                             "(defaults to bps_schema_cache.json next to the butler yaml file)",
+                        default=None)
+    parser.add_argument("--incremental", action="store_true", dest="incremental", required=False,
+                        help="If set, regenerates only outputs whose inputs changed since the previous run "
+                             "in the same outdir")
+    parser.add_argument("--metrics", action="store", dest="metrics", required=False,
+                        help="JSON file with per-stage metrics (defaults to <dax>_metrics.json in outdir)",
+                        default=None)
+    parser.add_argument("--profile_stage", action="store", dest="profile_stage", required=False,
+                        help="Name of a stage (e.g., science_graph, save_quanta, write_dax) to profile "
+                             "with cProfile, statistics are saved in outdir",
+                        default=None)
+    parser.add_argument("--stream_dax", action="store_true", dest="stream_dax", required=False,
+                        help="If set, writes the DAX incrementally instead of building it in memory")
+    parser.add_argument("--validate_graph", action="store_true", dest="validate_graph", required=False,
+                        help="If set, checks node types of the workflow graph before writing the DAX")
+    parser.add_argument("--reduce_dependencies", action="store_true", dest="reduce_dependencies", required=False,
+                        help="If set, omits job dependencies implied by other ones from the DAX")
+    parser.add_argument("--prioritize", action="store_true", dest="prioritize", required=False,
+                        help="If set, jobs get DAGMan priorities by the longest (by runtime if known) "
+                             "chain of jobs depending on them")
+    parser.add_argument("--log_mode", action="store", dest="log_mode", required=False,
+                        choices=["files", "kickstart", "bundle"],
+                        help="Where output of jobs goes: own .out/.err files staged by Pegasus, "
+                             "kickstart records only, or log bundles in outdir/logs with an index "
+                             "(see show_job_log.py)",
+                        default="files")
+    parser.add_argument("--log_bundle", action="store", dest="log_bundle", required=False,
+                        help="Log bundle per task label ('label') or number of bundles",
+                        default="label")
+    parser.add_argument("--partition", action="store", dest="partition", required=False,
+                        help="If set, writes a hierarchical workflow with a sub-DAX per partition, "
+                             "either 'label' (partition per task label) or number of balanced partitions",
+                        default=None)
+    args = parser.parse_args(argv)
+    if args.archive is None:
+        args.activator = args.activator or ACTIVATOR
+        args.actargs = args.actargs or ACTARGS
+    else:
+        args.activator = args.activator or ARCHIVE_ACTIVATOR
+        if args.actargs is None:
+            args.actargs = ARCHIVE_ACTARGS
+        elif "--qgraph" in args.actargs.split() or "{qkey}" not in args.actargs:
+            parser.error("with --quantum_archive activator args take the archive and quantum key "
+                         "({qlfn} {qkey}) instead of --qgraph")
+    return args
 
 
 def main(argv):
@@ -89,35 +195,159 @@ def main(argv):
     # Get basename of input QuantumGraph to use in output filenames
     basename = os.path.basename(os.path.splitext(args.qgraph)[0])
 
-    # Read quantum graph
-    qGraph = read_qgraph(args.qgraph)
-
-    # Create science graph
-    demoGraph, qgnodes = create_science_graph(qGraph)
-    if args.drawdir is not None:
-        draw_networkx_dot(demoGraph, os.path.join(args.drawdir, 'draw', "%s_sci.dot" % basename))
-
+    wfFilename = os.path.join(args.outdir, "%s_wf.bpsg" % basename)
+    daxFilename = os.path.join(args.outdir, args.dax)
+    rcFilename = os.path.join(args.outdir, args.catalog)
 
     # Fill in variables for activator command line from args
-    #   qlfn is filled in on a per activator basis later
-    args.actargs = args.actargs.format(**vars(args),qlfn='{qlfn}')
+    #   qlfn and qkey are filled in on a per activator basis later
+    args.actargs = args.actargs.format(**vars(args),qlfn='{qlfn}',qkey='{qkey}')
     logging.info("actargs = '%s'", args.actargs)
 
-    # Create workflow graph
-    create_workflow_graph(args, demoGraph, qgnodes)
-    with open(os.path.join(args.outdir, "%s_wf.pickle" % basename), "wb") as pickleFile:
-        pickle.dump(demoGraph, pickleFile)
+    profileFilename = None
+    if args.profile_stage is not None:
+        profileFilename = os.path.join(args.outdir, "%s_%s.prof" % (basename, args.profile_stage))
+    metrics = StageMetrics(args.profile_stage, profileFilename)
+
+    # Keys of the stages are content hashes of everything the stage depends
+    # on (per-task configs are part of the qgraph)
+    cache = None
+    if args.incremental:
+        cache = BuildCache(os.path.join(args.outdir, "%s_build.json" % basename))
+        # registry changes are tracked by its modification time
+        registryTime = os.path.getmtime(registry_db_path(args.butler)) if args.skip_existing else None
+        graphKey = options_digest(file_digest(args.qgraph), args.cluster_size, args.cluster_runtime,
+                                  args.quantum_runtime, args.archive, args.outdir, args.select_labels,
+                                  args.select_dataid, args.select_nodes, args.with_ancestors,
+                                  args.skip_existing, registryTime,
+                                  file_digest(args.resources) if args.resources else None)
+        wfKey = options_digest(graphKey, args.activator, args.actargs)
+        daxKey = options_digest(wfKey, args.stream_dax, args.partition, args.reduce_dependencies, args.prioritize,
+                                args.log_mode, args.log_bundle, daxFilename, rcFilename)
+
+    qgnodes = None
+    if cache is not None and cache.fresh('graph', graphKey):
+        logging.info("reusing workflow graph %s", wfFilename)
+        with metrics.stage('load_workflow_graph') as stage:
+            demoGraph = read_graph(wfFilename)
+            stage['counts'].update(nodes=demoGraph.number_of_nodes(), bytes_read=file_size(wfFilename))
+        if not cache.fresh('workflow', wfKey):
+            with metrics.stage('save_workflow_graph') as stage:
+                assign_exec_args(args, demoGraph)
+                write_graph(demoGraph, wfFilename)
+                stage['counts'].update(files_written=1, bytes_written=file_size(wfFilename))
+    else:
+        if cache is not None:
+            cache.invalidate('graph')
+            cache.save()
+
+        # Create science graph from the (selected) task nodes of the quantum
+        # graph, read one at a time
+        labels = args.select_labels.split(',') if args.select_labels else None
+        predicate = dataid_predicate(args.select_dataid) if args.select_dataid else None
+        nodes = [int(node) for node in args.select_nodes.split(',')] if args.select_nodes else None
+        # Selection by node id or with ancestors needs the whole science graph
+        selectLater = nodes is not None or \
+            (args.with_ancestors and (labels is not None or predicate is not None))
+        model = ResourceModel.from_file(args.resources) if args.resources else None
+        if model is not None:
+            runtimeEstimate = model.runtime_estimate(args.quantum_runtime)
+        else:
+            def runtimeEstimate(taskDef, quantum):
+                return args.quantum_runtime
+        with metrics.stage('science_graph') as stage:
+            demoGraph, qgnodes = create_science_graph(iter_qgraph(args.qgraph, None if selectLater else labels,
+                                                                  None if selectLater else predicate),
+                                                      cluster_size=args.cluster_size,
+                                                      cluster_runtime=args.cluster_runtime,
+                                                      runtime_estimate=runtimeEstimate,
+                                                      jobs=args.jobs)
+            stage['counts'].update(nodes=demoGraph.number_of_nodes(), edges=demoGraph.number_of_edges(),
+                                   tasks=len(qgnodes), bytes_read=file_size(args.qgraph),
+                                   quanta=sum(len(qgnode.quanta) for qgnode in qgnodes.values()))
+        if selectLater:
+            with metrics.stage('select_subgraph') as stage:
+                demoGraph, qgnodes = select_subgraph(demoGraph, qgnodes, labels, predicate, nodes,
+                                                     ancestors=args.with_ancestors)
+                stage['counts'].update(nodes=demoGraph.number_of_nodes(), tasks=len(qgnodes))
+        if args.skip_existing:
+            with metrics.stage('skip_existing') as stage:
+                with RegistryLookup(registry_db_path(args.butler)) as registry:
+                    ntasks = len(qgnodes)
+                    demoGraph, qgnodes = prune_existing(demoGraph, qgnodes,
+                                                        lambda dsKeys: registry.existing(dsKeys, args.outcol))
+                stage['counts'].update(nodes=demoGraph.number_of_nodes(), tasks=len(qgnodes),
+                                       skipped=ntasks - len(qgnodes))
+        if model is not None:
+            with metrics.stage('assign_resources') as stage:
+                stage['counts']['tasks'] = assign_resources(demoGraph, qgnodes, model)
+        if args.drawdir is not None:
+            with metrics.stage('draw_science_graph'):
+                draw_networkx_dot(demoGraph, os.path.join(args.drawdir, 'draw', "%s_sci.dot" % basename),
+                                  summary=args.draw_summary)
+
+        # Create workflow graph, unchanged quantum files are left in place
+        digests = dict(cache.files) if cache is not None else None
+        with metrics.stage('workflow_graph') as stage:
+            stage['counts'].update(create_workflow_graph(args, demoGraph, qgnodes, digests, metrics))
+            stage['counts'].update(nodes=demoGraph.number_of_nodes(), edges=demoGraph.number_of_edges())
+        with metrics.stage('save_workflow_graph') as stage:
+            write_graph(demoGraph, wfFilename)
+            stage['counts'].update(files_written=1, bytes_written=file_size(wfFilename))
+
+        if cache is not None:
+            quantumFiles = [demoGraph.node[nodename]['pfn'] for nodename in demoGraph
+                            if demoGraph.node[nodename].get('data_type') == 'quantum']
+            # quantum files of the previous run no longer in the workflow
+            # (e.g., after re-clustering or re-selection) are removed
+            for name in set(cache.files) - set(quantumFiles):
+                if os.path.exists(name):
+                    os.remove(name)
+            cache.files = {name: digests[name] for name in quantumFiles if name in digests}
+            cache.update('graph', graphKey, [wfFilename] + quantumFiles)
+    if cache is not None:
+        cache.update('workflow', wfKey, [wfFilename])
+        cache.save()
     if args.drawdir is not None:
-        draw_networkx_dot(demoGraph, os.path.join(args.drawdir, 'draw', "%s_wf.dot" % basename))
+        with metrics.stage('draw_workflow_graph'):
+            draw_networkx_dot(demoGraph, os.path.join(args.drawdir, 'draw', "%s_wf.dot" % basename),
+                              summary=args.draw_summary)
 
     # create schemas
     if args.create_schemas:
-        create_all_schemas(args, demoGraph, qgnodes)
+        with metrics.stage('create_schemas') as stage:
+            stage['counts']['schemas'] = create_all_schemas(args, demoGraph, qgnodes)
 
     # Create Pegasus DAX and replica catalog
-    gen = Daxgen(graph=demoGraph)
-    gen.write_dax(os.path.join(args.outdir, args.dax))
-    gen.write_rc(os.path.join(args.outdir, args.catalog))
+    if cache is not None and cache.fresh('dax', daxKey):
+        logging.info("reusing %s and %s", daxFilename, rcFilename)
+    else:
+        with metrics.stage('write_dax') as stage:
+            gen = Daxgen(graph=demoGraph, trusted=True, validate=args.validate_graph)
+            if args.prioritize:
+                gen.prioritize()
+            gen.set_log_mode(args.log_mode, args.log_bundle, os.path.abspath(os.path.join(args.outdir, 'logs')))
+            daxFilenames = [daxFilename]
+            if args.partition is not None:
+                daxFilenames += gen.write_dax_hierarchy(daxFilename, partition=args.partition,
+                                                        reduce=args.reduce_dependencies)
+            elif args.stream_dax:
+                gen.write_dax_stream(daxFilename, reduce=args.reduce_dependencies)
+            else:
+                gen.write_dax(daxFilename, reduce=args.reduce_dependencies)
+            stage['counts'].update(jobs=len(gen.tasks), files=len(gen.files), files_written=len(daxFilenames),
+                                   bytes_written=sum(file_size(name) for name in daxFilenames))
+        with metrics.stage('write_rc') as stage:
+            gen.write_rc(rcFilename)
+            stage['counts'].update(files_written=1, bytes_written=file_size(rcFilename))
+        if cache is not None:
+            cache.update('dax', daxKey, daxFilenames + [rcFilename])
+            cache.save()
+
+    metricsFilename = args.metrics
+    if metricsFilename is None:
+        metricsFilename = os.path.splitext(daxFilename)[0] + "_metrics.json"
+    metrics.write(metricsFilename)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -2,95 +2,89 @@
 
 import logging
 import argparse
+import multiprocessing
+import os
 import sys
-import pickle
 
+from bps_archive import QuantumArchive, is_quantum_archive
+from bps_draw import draw_qgraph_html
+from bps_qgraph import GRAPH_KEY, read_qgraph
 
-def read_qgraph(qgraph_filename):
-    with open(qgraph_filename, 'rb') as pickleFile:
-        qgraph = pickle.load(pickleFile)
-    return qgraph
 
+def find_inputs(paths):
+    """Expand input paths into quantum graphs to draw
 
-def draw_qgraph(qgraph, outfile):
-    logging.info("creating explicit science graph")
+    Parameters
+    ----------
+    paths : `list` of `str`
+        Qgraph pickle files, quantum archives, or directories containing
+        any of them
 
-    tcnt = 0
-    drcnt = 0
-    qcnt = 0
+    Returns
+    -------
+    inputs : `list` of `tuple`
+        Filename and archive key (None for pickle files) of every qgraph
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+            filenames = [name for name in filenames if os.path.isfile(name) and
+                         (name.endswith('.pickle') or is_quantum_archive(name))]
+        else:
+            filenames = [path]
+        for filename in filenames:
+            if is_quantum_archive(filename):
+                with QuantumArchive(filename) as archive:
+                    keys = sorted(archive.keys())
+                # qgraph streams are drawn as a whole
+                if GRAPH_KEY in keys:
+                    inputs.append((filename, None))
+                else:
+                    inputs.extend((filename, key) for key in keys)
+            else:
+                inputs.append((filename, None))
+    return inputs
 
-    mapId = {}
-    jobs = {}
-    qgnodes = {}
 
-    with open(outfile, "w") as ofh:
-        ofh.write("digraph Q {\n")
-        ofh.write('\tedge [color="invis"];\n')
-        for taskId, nodes in enumerate(qgraph):
-            tcnt += 1
-            tnodeName = '.'.join(nodes.taskDef.taskName.split('.')[-2:])
+def output_name(outdir, filename, key):
+    """Make name of the dot file for a qgraph
 
-            ofh.write('task%d [shape=none, margin=0, label=<\n' % (tcnt))
-            ofh.write('<table border="0" cellborder="1" cellspacing="0" cellpadding="4">\n')
-            ofh.write('<TR><TD><b>TD</b></TD><TD colspan="%d">%s</TD></TR>\n' % (len(nodes.quanta), tnodeName))
+    Pickle files are drawn to <basename>.dot, quanta in archives to
+    <archive basename>_<key>.dot.
+    """
+    name = os.path.basename(filename)
+    if key is not None:
+        name = "%s_%s" % (os.path.splitext(name)[0], key)
+    return os.path.join(outdir, "%s.dot" % name)
 
-            # write quantum headers
-            ofh.write('<TR><TD><b>Q</b></TD>')
-            colcnt = 0
-            for qId in range(1, len(nodes.quanta)+1):
-                qcnt += 1
-                colcnt += 1
-                if colcnt % 2 == 0:
-                    ofh.write('<TD><b>Q%02d</b></TD>' % qcnt)
-                else:
-                    ofh.write('<TD BGcolor="lightgrey"><b>Q%02d</b></TD>' % qcnt)
-            ofh.write('</TR>\n')
-
-            # write quantum inputs
-            ofh.write('<TR><TD><b>IN</b></TD>')
-            colcnt = 0
-            for qId, quantum in enumerate(nodes.quanta):
-                dr_ids = []
-                for dsRefs in quantum.predictedInputs.values():
-                    for dsRef in dsRefs:
-                        dsName = "%s+%s" % (dsRef.datasetType.name, dsRef.dataId)
-                        if dsName not in mapId:
-                            drcnt += 1
-                            mapId[dsName] = drcnt
-                        dr_ids.append('dr%03d' % mapId[dsName])
-                colcnt += 1
-                if colcnt % 2 == 0:
-                    ofh.write('<TD>%s</TD>' % ','.join(dr_ids))
-                else:
-                    ofh.write('<TD BGcolor="lightgrey">%s</TD>' % ', '.join(dr_ids))
-            ofh.write("</TR>\n")
-
-            # write quantum outputs
-            ofh.write('<TR><TD><b>OUT</b></TD>')
-            colcnt = 0
-            for qId, quantum in enumerate(nodes.quanta):
-                dr_ids = []
-                for dsRefs in quantum.outputs.values():
-                    for dsRef in dsRefs:
-                        dsName = "%s+%s" % (dsRef.datasetType.name, dsRef.dataId)
-                        if dsName not in mapId:
-                            drcnt += 1
-                            mapId[dsName] = drcnt
-                        dr_ids.append('dr%03d' % mapId[dsName])
-                colcnt += 1
-                if colcnt % 2 == 0:
-                    ofh.write('<TD>%s</TD>' % ','.join(dr_ids))
-                else:
-                    ofh.write('<TD BGcolor="lightgrey">%s</TD>' % ', '.join(dr_ids))
-            ofh.write("</TR>\n")
-            ofh.write('</table>>];\n')
 
-        # add invisible edges so force vertical
-        for i in range(1, tcnt):
-            ofh.write("task%d -> task%d;" % (i, i+1))
-        ofh.write("}\n")
+# archives opened by the current (worker) process
+_archives = {}
 
-    logging.info("tasks=%d dataset refs=%d", tcnt, drcnt)
+
+def draw_one(job):
+    """Draw a single qgraph (pool worker)
+
+    Parameters
+    ----------
+    job : `tuple`
+        Filename, archive key, output filename, and limits of table
+        columns and tables per file
+
+    Returns
+    -------
+    outfiles : `list` of `str`
+        Names of the written dot files
+    """
+    filename, key, outfile, maxColumns, maxTables = job
+    if key is None:
+        qgraph = read_qgraph(filename)
+    else:
+        if filename not in _archives:
+            _archives[filename] = QuantumArchive(filename)
+        qgraph = _archives[filename].load(key)
+    return draw_qgraph_html(qgraph, outfile, maxColumns, maxTables)
 
 
 def parse_args(argv=None):
@@ -110,15 +104,27 @@ def parse_args(argv=None):
         argv = sys.argv[1:]
     parser = argparse.ArgumentParser()
     required = parser.add_argument_group('required arguments')
-    required.add_argument("-o", "--output_file", action="store", dest="outfile", required=True,
-                          help="Output filename for dot file")
-    required.add_argument("--qgraph", action="store", dest="qgraph", required=True,
-                          help="Pipeline qgraph pickle file")
+    required.add_argument("--qgraph", action="store", dest="qgraph", required=True, nargs="+",
+                          help="Pipeline qgraph pickle files, quantum archives, or directories with them")
+    parser.add_argument("-o", "--output_file", action="store", dest="outfile", required=False,
+                        help="Output filename for dot file (single qgraph)", default=None)
+    parser.add_argument("--outdir", action="store", dest="outdir", required=False,
+                        help="Output directory for dot files named after the qgraphs", default=None)
+    parser.add_argument("-j", "--jobs", action="store", dest="jobs", required=False, type=int,
+                        help="Number of processes drawing qgraphs in parallel", default=1)
+    parser.add_argument("--max_columns", action="store", dest="max_columns", required=False, type=int,
+                        help="Maximum number of quanta per table, larger tasks are split", default=None)
+    parser.add_argument("--max_tables", action="store", dest="max_tables", required=False, type=int,
+                        help="Maximum number of tables per dot file, the rest go to numbered files",
+                        default=None)
     parser.add_argument("-d", "--debug", action="store_true", dest="debug", required=False,
                         help="Set logging to debug level")
     parser.add_argument("-v", "--verbose", action="store_true", dest="verbose", required=False,
                         help="Set logging to info level")
-    return parser.parse_args(argv)
+    args = parser.parse_args(argv)
+    if args.outfile is None and args.outdir is None:
+        parser.error("either --output_file or --outdir is required")
+    return args
 
 
 def main(argv):
@@ -138,11 +144,27 @@ def main(argv):
     elif args.verbose:
         logging.getLogger().setLevel(logging.INFO)
 
-    # Read quantum graph
-    qGraph = read_qgraph(args.qgraph)
-
-    # Create science graph
-    draw_qgraph(qGraph, args.outfile)
+    inputs = find_inputs(args.qgraph)
+    if args.outfile is not None:
+        if len(inputs) != 1:
+            raise ValueError("--output_file requires a single qgraph, got %d (use --outdir)" % len(inputs))
+        outfiles = [args.outfile]
+    else:
+        outfiles = [output_name(args.outdir, filename, key) for filename, key in inputs]
+    jobs = [(filename, key, outfile, args.max_columns, args.max_tables)
+            for (filename, key), outfile in zip(inputs, outfiles)]
+
+    # Draw all qgraphs in this process or in a pool of workers
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        try:
+            results = list(pool.imap_unordered(draw_one, jobs, chunksize=16))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [draw_one(job) for job in jobs]
+    logging.info("drawn %d qgraphs to %d files", len(jobs), sum(len(files) for files in results))
 
 
 if __name__ == "__main__":
@@ -1,17 +1,94 @@
 #!/usr/bin/env python
 
-import sys
+import argparse
 import pickle
-import networkx
 
-print(sys.argv[1])
-wffile = sys.argv[1]
+from bps_graphfile import MappedGraph
 
-with open(wffile, 'rb') as infile:
-    wfgraph = pickle.load(infile)
+BOOLEANS = {'True': True, 'true': True, 'False': False, 'false': False}
 
-print(wfgraph)
-print(networkx.number_of_nodes(wfgraph))
 
-for node in wfgraph.nodes(data=True): 
-    print(node)
+def create_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', type=str,
+                        help='Workflow graph (.bpsg or pickle)')
+    parser.add_argument('-n', '--node', type=int, action='append', default=[],
+                        help='Dump only given node (with its neighbors), may be repeated')
+    parser.add_argument('-w', '--where', type=str, action='append', default=[],
+                        help='Dump only nodes with attribute KEY=VALUE, may be repeated')
+    parser.add_argument('-c', '--count', action='store_true',
+                        help='Print only number of (matching) nodes')
+    return parser
+
+
+def parse_where(conditions, kinds=None):
+    """Convert KEY=VALUE conditions to attribute values.
+
+    Values are converted by the kind of the attribute's column (see
+    `bps_graphfile`): 'True'/'False' for bool columns, integers for int
+    columns, strings are left as they are.  Values of attributes without
+    a known kind which are integers or booleans are converted too.
+    """
+    attrs = {}
+    for condition in conditions:
+        key, value = condition.split('=', 1)
+        kind = kinds.get(key) if kinds is not None else None
+        if kind == 'str':
+            pass
+        elif kind == 'bool' or (kind is None and value in BOOLEANS):
+            try:
+                value = BOOLEANS[value]
+            except KeyError:
+                raise ValueError("Attribute %s is boolean, not %r" % (key, value))
+        else:
+            try:
+                value = int(value)
+            except ValueError:
+                if kind == 'int':
+                    raise ValueError("Attribute %s is an integer, not %r" % (key, value))
+        attrs[key] = value
+    return attrs
+
+
+if __name__ == '__main__':
+    parser = create_parser()
+    args = parser.parse_args()
+
+    print(args.filename)
+    if args.filename.endswith('.bpsg'):
+        # Columnar graphs are queried in place, only the nodes asked for are
+        # read.
+        wfgraph = MappedGraph(args.filename)
+    else:
+        with open(args.filename, 'rb') as infile:
+            wfgraph = pickle.load(infile)
+
+    print(wfgraph)
+    print(wfgraph.number_of_nodes())
+
+    if args.node:
+        nodes = args.node
+    elif args.where:
+        try:
+            attrs = parse_where(args.where, getattr(wfgraph, 'kinds', None))
+        except ValueError as exc:
+            parser.error(str(exc))
+        if hasattr(wfgraph, 'select'):
+            nodes = wfgraph.select(**attrs)
+        else:
+            nodes = [node for node in wfgraph
+                     if all(wfgraph.node[node].get(key) == value for key, value in attrs.items())]
+    else:
+        nodes = wfgraph
+
+    if args.count:
+        print(len(nodes))
+    else:
+        for node in nodes:
+            print((node, dict(wfgraph.node[node])))
+            if args.node:
+                print('  predecessors:', list(wfgraph.predecessors(node)))
+                print('  successors:', list(wfgraph.successors(node)))
+
+    if hasattr(wfgraph, 'close'):
+        wfgraph.close()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+
+from bps_logs import append_record
+
+
+def parse_args(argv=None):
+    """Parse command line, and test for required arguments
+
+    Parameters
+    ----------
+    argv : `list`
+        List of strings containing the command-line arguments.
+
+    Returns
+    -------
+    args : `Namespace`
+        Command-line arguments converted into an object with attributes.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Run the given command and append its output (stdout and stderr) to a log bundle "
+                    "(see show_job_log.py)")
+    parser.add_argument("bundle", help="Log bundle (<bundle>.log and <bundle>.idx)")
+    parser.add_argument("job", help="Id of the job in the index of the bundle")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run (e.g., pipetask ... run)")
+    parser.add_argument("-d", "--debug", action="store_true", dest="debug", required=False,
+                        help="Set logging to debug level")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Program entry point.
+
+    Parameters
+    ----------
+    argv : `list`
+        List of strings containing command line arguments.
+    """
+    args = parse_args(argv)
+
+    logging.basicConfig(format="%(levelname)s::%(asctime)s::%(message)s", datefmt="%m/%d/%Y %H:%M:%S")
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    logging.debug("cmdline = %s", args.command)
+    # output goes to a local file first, so the bundle is locked only while
+    # the output of a finished job is appended
+    with tempfile.TemporaryFile() as output:
+        start = time.time()
+        returncode = subprocess.run(args.command, stdout=output, stderr=subprocess.STDOUT).returncode
+        end = time.time()
+        offset = append_record(args.bundle, args.job, output, returncode, start, end)
+    # summary goes to the job's own stdout (e.g., captured by kickstart)
+    print("job %s rc=%d log=%s.log offset=%d" % (args.job, returncode, args.bundle, offset))
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
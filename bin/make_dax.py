@@ -12,6 +12,23 @@ def create_parser():
                         help='DAX file')
     parser.add_argument('-c', '--catalog', type=str, default='rc.txt',
                         help='Replica catalog')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Write DAX incrementally')
+    parser.add_argument('-r', '--reduce', action='store_true',
+                        help='Omit job dependencies implied by other ones')
+    parser.add_argument('-p', '--partition', type=str, default=None,
+                        help='Write hierarchical workflow partitioned by task '
+                             'label (\'label\') or into a number of partitions')
+    parser.add_argument('-P', '--prioritize', action='store_true',
+                        help='Set job priorities by the longest chain of jobs '
+                             'depending on them')
+    parser.add_argument('-l', '--log_mode', type=str, default='files',
+                        choices=['files', 'kickstart', 'bundle'],
+                        help='Where output of jobs goes (see Daxgen.set_log_mode)')
+    parser.add_argument('--log_bundle', type=str, default='label',
+                        help='Log bundle per task label (\'label\') or number of bundles')
+    parser.add_argument('--log_dir', type=str, default='logs',
+                        help='Directory with log bundles, as seen by the jobs')
     return parser
 
 
@@ -19,8 +36,16 @@ if __name__ == '__main__':
     parser = create_parser()
     args = parser.parse_args()
 
-    gen = Daxgen()
-    gen.read(args.filename)
+    with Daxgen() as gen:
+        gen.read(args.filename)
+        if args.prioritize:
+            gen.prioritize()
+        gen.set_log_mode(args.log_mode, args.log_bundle, args.log_dir)
 
-    gen.write_dax(args.output)
-    gen.write_rc(args.catalog)
+        if args.partition is not None:
+            gen.write_dax_hierarchy(args.output, partition=args.partition, reduce=args.reduce)
+        elif args.stream:
+            gen.write_dax_stream(args.output, reduce=args.reduce)
+        else:
+            gen.write_dax(args.output, reduce=args.reduce)
+        gen.write_rc(args.catalog)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import sys
+
+from bps_qgraph import convert_qgraph, dataid_predicate
+
+
+def parse_args(argv=None):
+    """Parse command line, and test for required arguments
+
+    Parameters
+    ----------
+    argv : `list`
+        List of strings containing the command-line arguments.
+
+    Returns
+    -------
+    args : `Namespace`
+        Command-line arguments converted into an object with attributes.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Convert pickled QuantumGraph to a stream of task nodes "
+                                                 "which can be loaded a task at a time.  The pickle is "
+                                                 "loaded once, task nodes are released as they are saved")
+    required = parser.add_argument_group('required arguments')
+    required.add_argument("--qgraph", action="store", dest="qgraph", required=True,
+                          help="Pipeline qgraph pickle file")
+    required.add_argument("-o", "--output_file", action="store", dest="outfile", required=True,
+                          help="Output filename for qgraph stream")
+    parser.add_argument("--select_labels", action="store", dest="select_labels", required=False,
+                        help="Comma separated labels of tasks to include", default=None)
+    parser.add_argument("--select_dataid", action="store", dest="select_dataid", required=False,
+                        help="Include only quanta with outputs matching key=value pairs, e.g., 'patch=69'",
+                        default=None)
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose", required=False,
+                        help="Set logging to info level")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    logging.basicConfig(format="%(levelname)s::%(asctime)s::%(message)s", datefmt="%m/%d/%Y %H:%M:%S")
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    labels = args.select_labels.split(',') if args.select_labels else None
+    predicate = dataid_predicate(args.select_dataid) if args.select_dataid else None
+    count = convert_qgraph(args.qgraph, args.outfile, labels, predicate)
+    logging.info("saved %d task nodes in %s", count, args.outfile)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
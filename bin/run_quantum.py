@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import os
+import sys
+import subprocess
+import tempfile
+
+from bps_archive import QuantumArchive
+
+
+def parse_args(argv=None):
+    """Parse command line, and test for required arguments
+
+    Parameters
+    ----------
+    argv : `list`
+        List of strings containing the command-line arguments.
+
+    Returns
+    -------
+    args : `Namespace`
+        Command-line arguments converted into an object with attributes.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Extract a single quantum from a quantum archive and run the given command "
+                    "with '--qgraph <extracted file>' appended to it")
+    parser.add_argument("archive", help="Quantum archive file")
+    parser.add_argument("key", help="Key of the quantum in the archive")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run (e.g., pipetask ... run)")
+    parser.add_argument("-d", "--debug", action="store_true", dest="debug", required=False,
+                        help="Set logging to debug level")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Program entry point.
+
+    Parameters
+    ----------
+    argv : `list`
+        List of strings containing command line arguments.
+    """
+    args = parse_args(argv)
+
+    logging.basicConfig(format="%(levelname)s::%(asctime)s::%(message)s", datefmt="%m/%d/%Y %H:%M:%S")
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    with QuantumArchive(args.archive) as archive, \
+            tempfile.NamedTemporaryFile(prefix="quantum%s_" % args.key, suffix=".pickle", dir=os.getcwd()) as qfile:
+        qfile.write(archive.read(args.key))
+        qfile.flush()
+        cmdline = args.command + ["--qgraph", qfile.name]
+        logging.debug("cmdline = %s", cmdline)
+        return subprocess.run(cmdline).returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+import time
+
+from bps_logs import read_index, read_record
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="List jobs in a log bundle (see log_bundle.py) or print their output")
+    parser.add_argument('bundle', type=str,
+                        help='Log bundle (<bundle>.log, <bundle>.idx, or <bundle>)')
+    parser.add_argument('jobs', type=str, nargs='*',
+                        help='Ids of jobs to print output of (every attempt), '
+                             'all jobs are listed if none given')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = create_parser()
+    args = parser.parse_args()
+
+    records = read_index(args.bundle)
+    if not args.jobs:
+        for record in records:
+            print("%s\trc=%d\tstart=%s\twall=%.1fs\tbytes=%d" % (
+                record['job'], record['returncode'],
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record['start'])),
+                record['end'] - record['start'], record['length']))
+        sys.exit(0)
+
+    missing = set(args.jobs) - {record['job'] for record in records}
+    if missing:
+        parser.error("jobs not in the bundle: %s" % ', '.join(sorted(missing)))
+    wanted = set(args.jobs)
+    out = sys.stdout.buffer
+    for record in records:
+        if record['job'] in wanted:
+            out.write(read_record(args.bundle, record))
+    out.flush()
@@ -0,0 +1,154 @@
+"""Single file archive of per-quantum payloads.
+
+The archive is a sequence of payloads followed by a pickled index mapping
+quantum keys to (offset, length) pairs and a fixed size footer::
+
+    MAGIC | payload | payload | ... | index | index offset | MAGIC
+
+Readers map the file into memory so that loading a single quantum touches
+only the bytes of its payload (and the index).
+"""
+
+import mmap
+import pickle
+import struct
+
+MAGIC = b"BPSQAR01"
+_FOOTER = struct.Struct("<Q")
+
+
+class QuantumArchiveWriter(object):
+    """Writer of a quantum archive.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the archive file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {}
+        self._file = open(filename, "wb")
+        self._file.write(MAGIC)
+
+    def add(self, key, data):
+        """Append a payload to the archive.
+
+        Parameters
+        ----------
+        key : `str`
+            Key identifying the quantum.
+        data : `bytes`
+            Serialized quantum.
+
+        Raises
+        ------
+        `ValueError`
+            If the key is already in the archive.
+        """
+        if key in self.index:
+            raise ValueError("Duplicate quantum key '{0}'.".format(key))
+        self.index[key] = (self._file.tell(), len(data))
+        self._file.write(data)
+
+    def close(self):
+        """Write the index and close the archive."""
+        if self._file is None:
+            return
+        offset = self._file.tell()
+        pickle.dump(self.index, self._file)
+        self._file.write(_FOOTER.pack(offset))
+        self._file.write(MAGIC)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class QuantumArchive(object):
+    """Memory mapped reader of a quantum archive.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the archive file.
+
+    Raises
+    ------
+    `ValueError`
+        If the file is not a quantum archive.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._map)
+        tail = _FOOTER.size + len(MAGIC)
+        if size < len(MAGIC) + tail or self._map[:len(MAGIC)] != MAGIC \
+                or self._map[size - len(MAGIC):] != MAGIC:
+            self._map.close()
+            raise ValueError("'{0}' is not a quantum archive.".format(filename))
+        offset, = _FOOTER.unpack(self._map[size - tail:size - len(MAGIC)])
+        self.index = pickle.loads(self._map[offset:size - tail])
+
+    def keys(self):
+        """Return keys of the quanta stored in the archive."""
+        return self.index.keys()
+
+    def read(self, key):
+        """Return the serialized quantum.
+
+        Parameters
+        ----------
+        key : `str`
+            Key identifying the quantum.
+
+        Returns
+        -------
+        data : `bytes`
+            Serialized quantum.
+        """
+        offset, length = self.index[key]
+        return self._map[offset:offset + length]
+
+    def load(self, key):
+        """Return the unpickled quantum.
+
+        Parameters
+        ----------
+        key : `str`
+            Key identifying the quantum.
+        """
+        return pickle.loads(self.read(key))
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_quantum_archive(filename):
+    """Check if a file starts like a quantum archive.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the file.
+
+    Returns
+    -------
+    `bool`
+        True if the file starts with the archive's magic bytes.
+    """
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
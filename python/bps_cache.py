@@ -0,0 +1,119 @@
+"""Build cache allowing demo_bps.py to regenerate only what changed.
+
+The cache is a JSON manifest with two parts:
+
+- stages: key (content hash of all inputs) and output files of every stage
+  completed by the previous run,
+- files: content hash of every quantum file written by the previous run.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+
+def file_digest(filename, blocksize=1 << 20):
+    """Compute content hash of a file.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the file.
+    blocksize : `int`, optional
+        Number of bytes read at once.
+
+    Returns
+    -------
+    digest : `str`
+        SHA-256 hex digest of file's content.
+    """
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def options_digest(*parts):
+    """Compute hash of JSON serializable values (e.g., options, digests).
+
+    Returns
+    -------
+    digest : `str`
+        SHA-256 hex digest of values' canonical JSON representation.
+    """
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class BuildCache(object):
+    """Manifest of outputs of the previous run.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the manifest file, it does not need to exist.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stages = {}
+        self.files = {}
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                data = json.load(f)
+            self.stages = data.get("stages", {})
+            self.files = data.get("files", {})
+
+    def fresh(self, stage, key):
+        """Check if outputs of a stage can be reused.
+
+        Parameters
+        ----------
+        stage : `str`
+            Name of the stage.
+        key : `str`
+            Hash of all inputs of the stage.
+
+        Returns
+        -------
+        fresh : `bool`
+            True if the stage was completed with the same key and all its
+            outputs are in place.
+        """
+        record = self.stages.get(stage)
+        if record is None or record["key"] != key:
+            return False
+        missing = [name for name in record["outputs"] if not os.path.exists(name)]
+        if missing:
+            logging.info("stage %s: %d outputs missing (e.g., %s)", stage, len(missing), missing[0])
+            return False
+        return True
+
+    def update(self, stage, key, outputs=()):
+        """Record a completed stage.
+
+        Parameters
+        ----------
+        stage : `str`
+            Name of the stage.
+        key : `str`
+            Hash of all inputs of the stage.
+        outputs : iterable of `str`, optional
+            Files written by the stage.
+        """
+        self.stages[stage] = {"key": key, "outputs": list(outputs)}
+
+    def invalidate(self, stage):
+        """Forget a stage (e.g., before its outputs get overwritten).
+        """
+        self.stages.pop(stage, None)
+
+    def save(self):
+        """Write the manifest.
+        """
+        tmpname = self.filename + ".tmp"
+        with open(tmpname, "w") as f:
+            json.dump({"stages": self.stages, "files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmpname, self.filename)
@@ -6,100 +6,282 @@ import os
 import sys
 import re
 
-import networkx
+# drawing attributes of nodes by node_type (0 - file, 1 - task)
+NODE_STYLES = {
+    0: {'shape': 'box', 'style': 'rounded'},
+    1: {'shape': 'box', 'fillcolor': 'gray', 'style': 'filled,bold'},
+}
 
-def draw_networkx_dot(graph, outname):
+def pretty_dataset_label(uniqName):
+    newName = re.sub(r": ", "=", uniqName)
+    newName = re.sub(r"\+", "\n", newName)
+    newName = re.sub(r",", "\n", newName)
+    newName = re.sub(r"[\{\}]", "", newName)
+    return newName
+
+def dataset_label(dsKey):
+    """Make display label of a dataset node
+
+    Parameters
+    ----------
+    dsKey : `tuple`
+        Dataset type name and dataId as stored in the science graph
+
+    Returns
+    -------
+    label : `str`
+        Multi-line label with dataset type name and dataId values
+    """
+    name, dataId = dsKey
+    if isinstance(dataId, frozenset):
+        dataId = dict(sorted(dataId, key=lambda item: item[0]))
+    return pretty_dataset_label("%s+%s" % (name, dataId))
+
+def dot_quote(value):
+    """Quote value as dot ID
+
+    Parameters
+    ----------
+    value :
+        Value of a node name or attribute
+
+    Returns
+    -------
+    quoted : `str`
+        Double-quoted string with quotes and newlines escaped
+    """
+    value = str(value).replace('"', '\\"').replace('\n', '\\n')
+    return '"%s"' % value
+
+def dot_attrs(attrs):
+    """Format attribute list of a dot node or edge
+
+    Parameters
+    ----------
+    attrs : `dict`
+        Attributes, the ones set to None are skipped
+
+    Returns
+    -------
+    attrList : `str`
+        Attribute list including the brackets or empty string
+    """
+    items = ["%s=%s" % (key, dot_quote(value)) for key, value in attrs.items() if value is not None]
+    return " [%s]" % ", ".join(items) if items else ""
+
+def _node_items(graph):
+    """Iterate over nodes of networkx digraph or CompactGraph
+
+    Yields
+    ------
+    node :
+        Node id
+    nodename : `str`
+        Node name used in the drawing
+    attrs : `dict`
+        Node attributes
+    """
+    nodeName = getattr(graph, 'node_name', str)
+    for node in graph:
+        yield node, nodeName(node), graph.node[node]
+
+def draw_networkx_dot(graph, outname, summary=False):
     """Saves drawing of expanded graph to file
 
+    Dot text is written as the graph is walked, no layout is computed.
+
     Parameters
     ----------
-    graph : 
-        NetworkX digraph
+    graph :
+        NetworkX digraph or CompactGraph
     outname : `str`
         Output filename for drawn graph
+    summary : `bool`, optional
+        If True, collapses the graph (see `draw_summary_dot`)
     """
+    if summary:
+        draw_summary_dot(graph, outname)
+        return
 
-    pos = networkx.nx_agraph.graphviz_layout(graph)
-    networkx.draw(graph, pos=pos)
-    networkx.drawing.nx_pydot.write_dot(graph, outname)
+    nodeName = getattr(graph, 'node_name', str)
+    with open(outname, "w") as ofh:
+        ofh.write("strict digraph {\n")
+        for node, nodename, attrs in _node_items(graph):
+            attrs = dict(attrs)
+            for key, value in NODE_STYLES.get(attrs.get('node_type'), {}).items():
+                attrs.setdefault(key, value)
+            # dataset labels are only made when drawing
+            dsKey = attrs.pop('dataset_key', None)
+            if 'label' not in attrs:
+                if dsKey is not None:
+                    attrs['label'] = dataset_label(dsKey)
+                elif 'lfn' in attrs:
+                    attrs['label'] = attrs['lfn']
+            ofh.write("%s%s;\n" % (dot_quote(nodename), dot_attrs(attrs)))
+        for u, v in graph.edges():
+            ofh.write("%s -> %s;\n" % (dot_quote(nodeName(u)), dot_quote(nodeName(v))))
+        ofh.write("}\n")
 
+def _summary_group(attrs):
+    """Return group a node is collapsed into in summary drawings
 
-def draw_qgraph_html(qgraph, outfile):
-    logging.info("creating explicit science graph")
+    Tasks are grouped by label (or executable name), datasets by dataset
+    type, and other files by data type (e.g., quanta).
+    """
+    if attrs.get('node_type') == 1:
+        return 1, attrs.get('label', attrs.get('exec_name', 'task'))
+    dsKey = attrs.get('dataset_key')
+    if dsKey is not None:
+        return 0, dsKey[0]
+    return 0, attrs.get('data_type', 'file')
 
-    tcnt = 0
-    drcnt = 0
+def draw_summary_dot(graph, outname):
+    """Saves collapsed drawing of a graph to file
+
+    Task nodes are collapsed by task label and file nodes by dataset type,
+    nodes and edges are labeled with number of collapsed ones.
+
+    Parameters
+    ----------
+    graph :
+        NetworkX digraph or CompactGraph
+    outname : `str`
+        Output filename for drawn graph
+    """
+    groups = {}
+    nodeGroup = {}
+    for node, nodename, attrs in _node_items(graph):
+        group = _summary_group(attrs)
+        nodeGroup[node] = group
+        counts = groups.setdefault(group, [0, 0])
+        counts[0] += 1
+        counts[1] += attrs.get('quanta_count', 1)
+    edges = {}
+    for u, v in graph.edges():
+        key = (nodeGroup[u], nodeGroup[v])
+        edges[key] = edges.get(key, 0) + 1
+
+    groupIds = {group: "g%d" % i for i, group in enumerate(groups)}
+    with open(outname, "w") as ofh:
+        ofh.write("strict digraph {\n")
+        for group, (count, quanta) in groups.items():
+            nodeType, name = group
+            attrs = dict(NODE_STYLES.get(nodeType, {}))
+            if nodeType == 1:
+                desc = "%d quanta" % quanta
+                if quanta != count:
+                    desc += " in %d jobs" % count
+            else:
+                desc = "%d files" % count
+            attrs['label'] = "%s\n%s" % (name, desc)
+            ofh.write("%s%s;\n" % (groupIds[group], dot_attrs(attrs)))
+        for (u, v), count in edges.items():
+            ofh.write("%s -> %s%s;\n" % (groupIds[u], groupIds[v], dot_attrs({'label': count})))
+        ofh.write("}\n")
+    logging.info("summary of %d nodes drawn as %d groups", len(nodeGroup), len(groups))
+
+
+def _qgraph_row(ofh, name, quanta, mapId, refs):
+    """Write table row listing dataset refs of quanta
+
+    Returns
+    -------
+    drcnt : `int`
+        Number of dataset refs seen so far
+    """
+    ofh.write('<TR><TD><b>%s</b></TD>' % name)
+    colcnt = 0
+    for quantum in quanta:
+        dr_ids = []
+        for dsRefs in refs(quantum).values():
+            for dsRef in dsRefs:
+                dsName = "%s+%s" % (dsRef.datasetType.name, dsRef.dataId)
+                if dsName not in mapId:
+                    mapId[dsName] = len(mapId) + 1
+                dr_ids.append('dr%03d' % mapId[dsName])
+        colcnt += 1
+        if colcnt % 2 == 0:
+            ofh.write('<TD>%s</TD>' % ','.join(dr_ids))
+        else:
+            ofh.write('<TD BGcolor="lightgrey">%s</TD>' % ', '.join(dr_ids))
+    ofh.write("</TR>\n")
+    return len(mapId)
+
+def draw_qgraph_html(qgraph, outfile, maxColumns=None, maxTables=None):
+    """Saves drawing of quantum graph as tables of quanta per task
+
+    Parameters
+    ----------
+    qgraph : `QuantumGraph`
+        Quantum graph to draw
+    outfile : `str`
+        Output filename for dot file
+    maxColumns : `int`, optional
+        Maximum number of quanta per table, tasks with more quanta are
+        split into several tables
+    maxTables : `int`, optional
+        Maximum number of tables per dot file, further tables go to files
+        named <outfile root>_<page>.dot
+
+    Returns
+    -------
+    outfiles : `list` of `str`
+        Names of the written dot files
+    """
+    # split tasks into tables of at most maxColumns quanta
+    tables = []
     qcnt = 0
+    tcnt = 0
+    for nodes in qgraph:
+        tcnt += 1
+        tnodeName = '.'.join(nodes.taskDef.taskName.split('.')[-2:])
+        quanta = list(nodes.quanta)
+        step = maxColumns if maxColumns else max(1, len(quanta))
+        starts = range(0, max(1, len(quanta)), step)
+        for part, start in enumerate(starts):
+            title = tnodeName
+            if len(starts) > 1:
+                title = "%s (%d/%d)" % (tnodeName, part + 1, len(starts))
+            tables.append((title, quanta[start:start + step], qcnt + start))
+        qcnt += len(quanta)
+
+    pages = [tables]
+    if maxTables and len(tables) > maxTables:
+        pages = [tables[i:i + maxTables] for i in range(0, len(tables), maxTables)]
+    root, ext = os.path.splitext(outfile)
 
     mapId = {}
-    jobs = {}
-    qgnodes = {}
-
-    with open(outfile, "w") as ofh:
-        ofh.write("digraph Q {\n")
-        ofh.write('\tedge [color="invis"];\n')
-        for taskId, nodes in enumerate(qgraph):
-            tcnt += 1
-            tnodeName = '.'.join(nodes.taskDef.taskName.split('.')[-2:])
-
-            ofh.write('task%d [shape=none, margin=0, label=<\n' % (tcnt))
-            ofh.write('<table border="0" cellborder="1" cellspacing="0" cellpadding="4">\n')
-            ofh.write('<TR><TD><b>TD</b></TD><TD colspan="%d">%s</TD></TR>\n' % (len(nodes.quanta), tnodeName))
-
-            # write quantum headers
-            ofh.write('<TR><TD><b>Q</b></TD>')
-            colcnt = 0
-            for qId in range(1, len(nodes.quanta)+1):
-                qcnt += 1
-                colcnt += 1
-                if colcnt % 2 == 0:
-                    ofh.write('<TD><b>Q%02d</b></TD>' % qcnt)
-                else:
-                    ofh.write('<TD BGcolor="lightgrey"><b>Q%02d</b></TD>' % qcnt)
-            ofh.write('</TR>\n')
-
-            # write quantum inputs
-            ofh.write('<TR><TD><b>IN</b></TD>')
-            colcnt = 0
-            for qId, quantum in enumerate(nodes.quanta):
-                dr_ids = []
-                for dsRefs in quantum.predictedInputs.values():
-                    for dsRef in dsRefs:
-                        dsName = "%s+%s" % (dsRef.datasetType.name, dsRef.dataId)
-                        if dsName not in mapId:
-                            drcnt += 1
-                            mapId[dsName] = drcnt
-                        dr_ids.append('dr%03d' % mapId[dsName])
-                colcnt += 1
-                if colcnt % 2 == 0:
-                    ofh.write('<TD>%s</TD>' % ','.join(dr_ids))
-                else:
-                    ofh.write('<TD BGcolor="lightgrey">%s</TD>' % ', '.join(dr_ids))
-            ofh.write("</TR>\n")
-
-            # write quantum outputs
-            ofh.write('<TR><TD><b>OUT</b></TD>')
-            colcnt = 0
-            for qId, quantum in enumerate(nodes.quanta):
-                dr_ids = []
-                for dsRefs in quantum.outputs.values():
-                    for dsRef in dsRefs:
-                        dsName = "%s+%s" % (dsRef.datasetType.name, dsRef.dataId)
-                        if dsName not in mapId:
-                            drcnt += 1
-                            mapId[dsName] = drcnt
-                        dr_ids.append('dr%03d' % mapId[dsName])
-                colcnt += 1
-                if colcnt % 2 == 0:
-                    ofh.write('<TD>%s</TD>' % ','.join(dr_ids))
-                else:
-                    ofh.write('<TD BGcolor="lightgrey">%s</TD>' % ', '.join(dr_ids))
-            ofh.write("</TR>\n")
-            ofh.write('</table>>];\n')
-
-        # add invisible edges so force vertical
-        for i in range(1, tcnt):
-            ofh.write("task%d -> task%d;" % (i, i+1))
-        ofh.write("}\n")
+    drcnt = 0
+    outfiles = []
+    for pageNum, page in enumerate(pages):
+        pageFile = outfile if len(pages) == 1 else "%s_%03d%s" % (root, pageNum, ext)
+        with open(pageFile, "w") as ofh:
+            ofh.write("digraph Q {\n")
+            ofh.write('\tedge [color="invis"];\n')
+            for tableNum, (title, quanta, firstQ) in enumerate(page, 1):
+                ofh.write('task%d [shape=none, margin=0, label=<\n' % (tableNum))
+                ofh.write('<table border="0" cellborder="1" cellspacing="0" cellpadding="4">\n')
+                ofh.write('<TR><TD><b>TD</b></TD><TD colspan="%d">%s</TD></TR>\n' % (len(quanta), title))
+
+                # write quantum headers
+                ofh.write('<TR><TD><b>Q</b></TD>')
+                for colcnt in range(1, len(quanta)+1):
+                    if colcnt % 2 == 0:
+                        ofh.write('<TD><b>Q%02d</b></TD>' % (firstQ + colcnt))
+                    else:
+                        ofh.write('<TD BGcolor="lightgrey"><b>Q%02d</b></TD>' % (firstQ + colcnt))
+                ofh.write('</TR>\n')
+
+                # write quantum inputs and outputs
+                drcnt = _qgraph_row(ofh, "IN", quanta, mapId, lambda quantum: quantum.predictedInputs)
+                drcnt = _qgraph_row(ofh, "OUT", quanta, mapId, lambda quantum: quantum.outputs)
+                ofh.write('</table>>];\n')
+
+            # add invisible edges so force vertical
+            for i in range(1, len(page)):
+                ofh.write("task%d -> task%d;" % (i, i+1))
+            ofh.write("}\n")
+        outfiles.append(pageFile)
 
-    logging.info("tasks=%d dataset refs=%d", tcnt, drcnt)
+    logging.info("tasks=%d dataset refs=%d tables=%d files=%d", tcnt, drcnt, len(tables), len(outfiles))
+    return outfiles
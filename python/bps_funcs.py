@@ -4,76 +4,288 @@ import logging
 import argparse
 import os
 import sys
-import re
 import pickle
-import networkx
 import subprocess
 import shlex
+import tempfile
+import multiprocessing
+import hashlib
+import io
+import json
+import time
+from array import array
 
 from lsst.pipe.base.graph import QuantumGraph
 
-try:
-    from lsst.pipe.base.graph import QuantumGraphTaskNodes
-except ImportError:
-    from lsst.pipe.base.graph import QuantumGraphNodes
+from bps_qgraph import read_qgraph, make_single_qgnode, label_matches, quantum_matches, task_label
+from bps_graph import CompactGraph
+from bps_archive import QuantumArchive, QuantumArchiveWriter
+from bps_metrics import StageMetrics
 
-from daxgen import Daxgen
+# Error output of init-only runs failing because another run holds the lock
+# of the (SQLite) registry, such runs are retried
+REGISTRY_LOCKED = (b"database is locked", b"database table is locked")
+SCHEMA_RETRIES = 5
+SCHEMA_RETRY_DELAY = 1.0
 
 
-def read_qgraph(qgraph_filename):
-    with open(qgraph_filename, 'rb') as pickleFile:
-        qgraph = pickle.load(pickleFile)
-    return qgraph
-
-def make_single_qgnode(taskDef, quanta):
-    try:
-        qnode = QuantumGraphTaskNodes(taskDef, quanta)
-    except NameError:
-        qnode = QuantumGraphNodes(taskDef, quanta)
-    return qnode
-
-def save_single_qgnode(qgnode, outFilename):
-    """Save single quantum to file
+def serialize_qgnode(qgnode):
+    """Serialize single quantum as a pickled QuantumGraph
 
     Parameters
     ----------
     qgnode : QuantumGraph Node
-        Single quantum to save
-    outFilename : `str`
-        Name of the output file
+        Single quantum to serialize
+
+    Returns
+    -------
+    data : `bytes`
+        Pickled QuantumGraph containing only the given node
     """
     qgraph2 = QuantumGraph()
     qgraph2.append(qgnode)
-    with open(outFilename, "wb") as pickleFile:
-        pickle.dump(qgraph2, pickleFile)
+    return pickle.dumps(qgraph2)
+
+# QuantumGraph nodes shared with forked worker processes by save_qgnodes
+_workerQgnodes = None
+
+def _save_qgnode_worker(task):
+    nodename, outFilename, oldDigest = task
+    data = serialize_qgnode(_workerQgnodes[nodename])
+    if outFilename is None:
+        return data, None
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == oldDigest and os.path.exists(outFilename):
+        # leave unchanged file in place
+        return 0, digest
+    # a run killed while writing leaves no truncated file matching the digest
+    tmpFilename = outFilename + ".tmp"
+    with open(tmpFilename, "wb") as pickleFile:
+        pickleFile.write(data)
+    os.replace(tmpFilename, outFilename)
+    return len(data), digest
+
+def save_qgnodes(qgnodes, saves, jobs=1, archive=None, digests=None):
+    """Save many single quanta, optionally using a pool of processes
+
+    Workers are forked so they share qgnodes with the parent instead of
+    receiving pickled copies; files are written with the same bytes and in
+    the same order as when saving serially.
+
+    Parameters
+    ----------
+    qgnodes : `dict`
+        Single quantum QuantumGraph nodes keyed by task node name
+    saves : `list`
+        Pairs of task node id and either output filename or, if archive
+        is given, key of the quantum in the archive
+    jobs : `int`, optional
+        Number of worker processes
+    archive : `QuantumArchiveWriter`, optional
+        Archive receiving the quanta instead of separate files
+    digests : `dict`, optional
+        Content hashes of previously written files keyed by filename,
+        existing files with unchanged content are not rewritten; updated
+        with hashes of the saved files (with archive, with the hash of all
+        keys and quanta keyed by the archive's filename, the archive is
+        written anyway)
 
-def pretty_dataset_label(uniqName):
-    newName = re.sub(r": ", "=", uniqName)
-    newName = re.sub(r"\+", "\n", newName)
-    newName = re.sub(r",", "\n", newName)
-    newName = re.sub(r"[\{\}]", "", newName)
-    return newName
+    Returns
+    -------
+    nfiles : `int`
+        Number of quanta written (unchanged files are not counted)
+    nbytes : `int`
+        Number of bytes written
+    """
+    global _workerQgnodes
+    _workerQgnodes = qgnodes
+    if archive is not None:
+        tasks = [(nodename, None, None) for nodename, target in saves]
+    else:
+        tasks = [(nodename, target, digests.get(target) if digests is not None else None)
+                 for nodename, target in saves]
+    nfiles = 0
+    nbytes = 0
+    archiveDigest = hashlib.sha256()
+    pool = None
+    try:
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.get_context('fork').Pool(jobs)
+            results = pool.imap(_save_qgnode_worker, tasks, chunksize=max(1, len(tasks) // (jobs * 16)))
+        else:
+            results = map(_save_qgnode_worker, tasks)
+        for (nodename, target), (result, digest) in zip(saves, results):
+            if archive is not None:
+                archive.add(target, result)
+                archiveDigest.update(b"%s\0%d\0" % (target.encode(), len(result)))
+                archiveDigest.update(result)
+                nfiles += 1
+                nbytes += len(result)
+            else:
+                nfiles += 1 if result > 0 else 0
+                nbytes += result
+                if digests is not None:
+                    digests[target] = digest
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _workerQgnodes = None
+    if archive is not None and digests is not None:
+        digests[archive.filename] = archiveDigest.hexdigest()
+    return nfiles, nbytes
+
+def dataset_key(dsRef):
+    """Return key identifying a dataset in the science graph
+
+    Parameters
+    ----------
+    dsRef : DatasetRef
+        Reference to the dataset
 
-def create_science_graph(qgraph):
+    Returns
+    -------
+    key : `tuple`
+        Interned dataset type name and (hashable) dataId
+    """
+    dataId = dsRef.dataId
+    try:
+        hash(dataId)
+    except TypeError:
+        dataId = frozenset(dataId.items())
+    return (sys.intern(dsRef.datasetType.name), dataId)
+
+def cluster_quanta(taskDef, quanta, size=None, runtime=None, estimate=None):
+    """Split quanta of a single task into clusters executed by one job
+
+    Parameters
+    ----------
+    taskDef : TaskDef
+        Task definition shared by all quanta
+    quanta : `list`
+        Quanta of the task
+    size : `int`, optional
+        Maximum number of quanta in a cluster
+    runtime : `float`, optional
+        Target runtime (in seconds) of a cluster
+    estimate : callable, optional
+        Function taking taskDef and quantum and returning estimated runtime
+        of the quantum in seconds, required if runtime is given
+
+    Yields
+    ------
+    cluster : `list`
+        Quanta in a single cluster (one quantum per cluster if neither size
+        nor runtime is given)
+    """
+    if size is None and runtime is None:
+        for quantum in quanta:
+            yield [quantum]
+        return
+    if runtime is not None and estimate is None:
+        raise ValueError("Clustering by runtime requires a runtime estimate")
+
+    cluster = []
+    total = 0.0
+    for quantum in quanta:
+        cost = estimate(taskDef, quantum) if runtime is not None else 0.0
+        if cluster and ((size is not None and len(cluster) >= size) or
+                        (runtime is not None and total + cost > runtime)):
+            yield cluster
+            cluster = []
+            total = 0.0
+        cluster.append(quantum)
+        total += cost
+    if cluster:
+        yield cluster
+
+# Clusters of quanta shared with forked worker processes by create_science_graph
+_workerClusters = None
+
+def _science_chunk(bounds):
+    """Find datasets used and produced by quanta of a range of clusters
+
+    Parameters
+    ----------
+    bounds : `tuple`
+        First and one past the last index of clusters in _workerClusters
+
+    Returns
+    -------
+    dsKeys : `list`
+        Dataset keys (see `dataset_key`) in the order of first use
+    keyCounts : `list`
+        For every cluster, number of dsKeys used by it and the clusters
+        before it
+    edges : `list`
+        For every cluster, list of (inputs, outputs) per quantum, as
+        indexes into dsKeys in the order of DatasetRefs in the quantum
+    """
+    dsKeys = []
+    localId = {}
+    keyCounts = []
+    edges = []
+    for quanta in _workerClusters[bounds[0]:bounds[1]]:
+        clusterEdges = []
+        for quantum in quanta:
+            #logging.debug("dir=%s",dir(quantum))
+            logging.debug('actualInputs=%s', quantum.actualInputs)
+            logging.debug('id=%s',quantum.id)
+            logging.debug('run=%s',quantum.run)
+            logging.debug('task=%s',quantum.task)
+            quantumEdges = []
+            for refs in (quantum.predictedInputs, quantum.outputs):
+                indexes = []
+                for dsRefs in refs.values():
+                    for dsRef in dsRefs:
+                        #actualConsumers', 'components', 'dataId', 'datasetType', 'detach', 'id', 'isComposite', 'predictedConsumers', 'producer', 'run']
+                        dsKey = dataset_key(dsRef)
+                        index = localId.get(dsKey)
+                        if index is None:
+                            index = localId[dsKey] = len(dsKeys)
+                            dsKeys.append(dsKey)
+                        indexes.append(index)
+                quantumEdges.append(indexes)
+            clusterEdges.append(quantumEdges)
+        keyCounts.append(len(dsKeys))
+        edges.append(clusterEdges)
+    return dsKeys, keyCounts, edges
+
+def create_science_graph(qgraph, cluster_size=None, cluster_runtime=None, runtime_estimate=None, jobs=1):
     """Create expanded graph from the QuantumGraph that has explicit dependencies
     and has individual nodes for each input/output dataset
 
+    Datasets of quanta are found by forked worker processes, each for a
+    shard of the clusters of quanta, and merged in the order of the
+    clusters, so node ids are the same whatever the number of processes.
+
     Parameters
     ----------
     qgraph : QuantumGraph
         QuantumGraph for the pipeline (as generated by the QuantumGraph Generator)
+    cluster_size : `int`, optional
+        Maximum number of quanta of the same task grouped into a single task node
+    cluster_runtime : `float`, optional
+        Target runtime (in seconds) of a single task node
+    runtime_estimate : callable, optional
+        Function taking taskDef and quantum and returning estimated runtime
+        of the quantum in seconds (used with cluster_runtime)
+    jobs : `int`, optional
+        Number of worker processes
+
+    Returns
+    -------
+    sciGraph : `CompactGraph`
+        Science Graph with integer node ids
+    qgnodes : `dict`
+        Single quantum QuantumGraph nodes keyed by task node id
     """
+    global _workerClusters
     logging.info("creating explicit science graph")
 
-    sciGraph = networkx.DiGraph()
-    ncnt = 0
-    tcnt = 0
-    dcnt = 0
-
-    mapId = {}
-    jobs = {}
-    qgnodes = {}
-
+    # Clusters (task nodes) in the order of the QuantumGraph
+    tasks = []
+    clusters = []
     for taskId, nodes in enumerate(qgraph):
         logging.debug(taskId)
         taskDef = nodes.taskDef
@@ -82,53 +294,273 @@ def create_science_graph(qgraph):
         logging.debug("taskClass=%s", taskDef.taskClass)
         logging.debug("taskName=%s", taskDef.taskName)
         logging.debug("label=%s",taskDef.label)
-        for qId, quantum in enumerate(nodes.quanta):
-            #logging.debug("dir=%s",dir(quantum))
-            logging.debug('actualInputs=%s', quantum.actualInputs)
-            logging.debug('id=%s',quantum.id)
-            logging.debug('run=%s',quantum.run)
-            logging.debug('task=%s',quantum.task)
-            ncnt += 1
-            tcnt += 1
-            #tnodeName = "task%d (%s)" % (ncnt, taskDef.taskName)
-            tnodeName = "%06d" % (ncnt)
-            sciGraph.add_node(tnodeName, node_type=1, task_def_id=taskId, shape='box', fillcolor='gray',
-                              style='"filled,bold"', label='.'.join(taskDef.taskName.split('.')[-2:]))
-            quanta2 = [quantum]
-            qgnodes[tnodeName] = make_single_qgnode(taskDef, quanta2)
-
-            # Make nodes for inputs
-            for dsRefs in quantum.predictedInputs.values():
-                for dsRef in dsRefs:
-                    #actualConsumers', 'components', 'dataId', 'datasetType', 'detach', 'id', 'isComposite', 'predictedConsumers', 'producer', 'run']
-                    dsName = "%s+%s" % (dsRef.datasetType.name, dsRef.dataId)
-                    if dsName not in mapId:
-                        ncnt += 1
+        taskLabel = '.'.join(taskDef.taskName.split('.')[-2:])
+        for quanta in cluster_quanta(taskDef, nodes.quanta, cluster_size, cluster_runtime, runtime_estimate):
+            tasks.append((taskId, taskDef, taskLabel, task_label(taskDef)))
+            clusters.append(quanta)
+
+    # Node attributes and edges are collected as columns, the graph is
+    # made of them at once
+    nodeType = []
+    taskDefIds = []
+    quantaCounts = []
+    labels = []
+    taskLabels = []
+    dsKeyColumn = []
+    src = array('l')
+    dst = array('l')
+    ncnt = 0
+    dcnt = 0
+    qcnt = 0
+
+    mapId = {}
+    qgnodes = {}
+
+    _workerClusters = clusters
+    chunkSize = max(1, len(clusters) // (jobs * 16))
+    shards = [(start, min(start + chunkSize, len(clusters))) for start in range(0, len(clusters), chunkSize)]
+    pool = None
+    try:
+        if jobs > 1 and len(shards) > 1:
+            pool = multiprocessing.get_context('fork').Pool(jobs)
+            results = pool.imap(_science_chunk, shards)
+        else:
+            results = map(_science_chunk, shards)
+
+        # Merge shards in order, assigning ids as a single pass would: the
+        # task node first, then datasets in the order of their first use
+        for (start, stop), (dsKeys, keyCounts, edges) in zip(shards, results):
+            globalId = []
+            for clusterIndex, keyCount, clusterEdges in zip(range(start, stop), keyCounts, edges):
+                taskId, taskDef, taskLabel, label = tasks[clusterIndex]
+                quanta = clusters[clusterIndex]
+                tnodeName = ncnt
+                ncnt += 1
+                nodeType.append(1)
+                taskDefIds.append(taskId)
+                quantaCounts.append(len(quanta))
+                labels.append(taskLabel)
+                taskLabels.append(label)
+                dsKeyColumn.append(None)
+                qgnodes[tnodeName] = make_single_qgnode(taskDef, quanta)
+                for dsKey in dsKeys[len(globalId):keyCount]:
+                    fnodeName = mapId.get(dsKey)
+                    if fnodeName is None:
                         dcnt += 1
-                        mapId[dsName] = ncnt
-                    fnodeName = "%06d" % mapId[dsName]
-                    fnodeDesc = pretty_dataset_label(dsName)
-                    sciGraph.add_node(fnodeName, node_type=0, label=fnodeDesc, shape='box', style='rounded')
-                    sciGraph.add_edge(fnodeName, tnodeName)
-
-            # Make nodes for outputs
-            for dsRefs in quantum.outputs.values():
-                for dsRef in dsRefs:
-                    dsName = "%s+%s" % (dsRef.datasetType.name, dsRef.dataId)
-                    if dsName not in mapId:
+                        fnodeName = ncnt
                         ncnt += 1
-                        dcnt += 1
-                        mapId[dsName] = ncnt
-                    fnodeName = "%06d" % mapId[dsName]
-                    fnodeDesc = pretty_dataset_label(dsName)
-                    sciGraph.add_node(fnodeName, node_type=0, label=fnodeDesc, shape='box', style='rounded')
-                    sciGraph.add_edge(tnodeName, fnodeName)
+                        mapId[dsKey] = fnodeName
+                        nodeType.append(0)
+                        taskDefIds.append(None)
+                        quantaCounts.append(None)
+                        labels.append(None)
+                        taskLabels.append(None)
+                        dsKeyColumn.append(dsKey)
+                    globalId.append(fnodeName)
+                for inputs, outputs in clusterEdges:
+                    qcnt += 1
+                    src.extend([globalId[index] for index in inputs])
+                    dst.extend([tnodeName] * len(inputs))
+                    src.extend([tnodeName] * len(outputs))
+                    dst.extend([globalId[index] for index in outputs])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _workerClusters = None
 
-    logging.info("tasks=%d files=%d", tcnt, dcnt)
+    sciGraph = CompactGraph.from_columns({'node_type': nodeType, 'task_def_id': taskDefIds,
+                                          'quanta_count': quantaCounts, 'label': labels,
+                                          'task_label': taskLabels, 'dataset_key': dsKeyColumn}, src, dst)
+    logging.info("tasks=%d quanta=%d files=%d", len(clusters), qcnt, dcnt)
 
     return sciGraph, qgnodes
 
-def create_workflow_graph(args, sciGraph, qgnodes):
+def select_subgraph(sciGraph, qgnodes, labels=None, dataIdPredicate=None, nodes=None, ancestors=True):
+    """Select quanta of a science graph, optionally with their ancestors
+
+    Parameters
+    ----------
+    sciGraph : `CompactGraph`
+        Science graph
+    qgnodes : `dict`
+        QuantumGraph nodes keyed by task node
+    labels : container of `str`, optional
+        Select task nodes with these labels (either task labels or the
+        short task names used as node labels)
+    dataIdPredicate : callable, optional
+        Select task nodes with any quantum matching (see
+        `bps_qgraph.quantum_matches`)
+    nodes : iterable of `int`, optional
+        Select these task nodes.  Ids are the ones of the science graph
+        as built (and the workflow graph made of it), so they depend on
+        clustering of quanta and on any earlier selection or pruning
+        (e.g., `prune_existing`), which renumber nodes
+    ancestors : `bool`, optional
+        If True, task nodes producing inputs of the selected ones are
+        included, recursively
+
+    Returns
+    -------
+    sciGraph : `CompactGraph`
+        Science graph made of the selected task nodes and their input and
+        output file nodes (renumbered)
+    qgnodes : `dict`
+        QuantumGraph nodes keyed by (new) task node
+    """
+    selected = set()
+    for nodename in qgnodes:
+        if labels is not None and not label_matches(qgnodes[nodename].taskDef, labels):
+            continue
+        if dataIdPredicate is not None and \
+                not any(quantum_matches(quantum, dataIdPredicate) for quantum in qgnodes[nodename].quanta):
+            continue
+        selected.add(nodename)
+    if nodes is not None:
+        nodes = set(nodes)
+        unknown = nodes - set(qgnodes)
+        if unknown:
+            raise ValueError("Not task nodes: %s" % sorted(unknown))
+        selected &= nodes
+    logging.info("selected task nodes=%d", len(selected))
+
+    # Walk up from the selected task nodes to producers of their inputs
+    if ancestors:
+        pending = list(selected)
+        while pending:
+            nodename = pending.pop()
+            for fnodeName in sciGraph.predecessors(nodename):
+                for parent in sciGraph.predecessors(fnodeName):
+                    if parent not in selected:
+                        selected.add(parent)
+                        pending.append(parent)
+        logging.info("task nodes with ancestors=%d", len(selected))
+
+    keep = set(selected)
+    for nodename in selected:
+        keep.update(sciGraph.predecessors(nodename))
+        keep.update(sciGraph.successors(nodename))
+    subGraph, mapping = sciGraph.subgraph(keep)
+    subQgnodes = {mapping[nodename]: qgnodes[nodename] for nodename in sorted(selected)}
+    return subGraph, subQgnodes
+
+def prune_existing(sciGraph, qgnodes, existing):
+    """Remove task nodes whose outputs all exist already
+
+    Parameters
+    ----------
+    sciGraph : `CompactGraph`
+        Science graph
+    qgnodes : `dict`
+        QuantumGraph nodes keyed by task node
+    existing : callable
+        Function taking a list of dataset keys (see `dataset_key`) and
+        returning the set of those already existing, called once with the
+        outputs of all task nodes
+
+    Returns
+    -------
+    sciGraph : `CompactGraph`
+        Science graph without the removed task nodes (renumbered), their
+        outputs needed by remaining task nodes are kept as inputs without
+        a producer, other files used only by them are removed
+    qgnodes : `dict`
+        QuantumGraph nodes keyed by (new) task node
+    """
+    outputs = {}
+    for nodename in qgnodes:
+        for fnodeName in sciGraph.successors(nodename):
+            outputs[sciGraph.node[fnodeName]['dataset_key']] = fnodeName
+    found = existing(list(outputs))
+
+    removed = set()
+    for nodename in qgnodes:
+        dsKeys = [sciGraph.node[fnodeName]['dataset_key'] for fnodeName in sciGraph.successors(nodename)]
+        if dsKeys and all(dsKey in found for dsKey in dsKeys):
+            removed.add(nodename)
+    logging.info("task nodes with existing outputs=%d of %d", len(removed), len(qgnodes))
+    if not removed:
+        return sciGraph, qgnodes
+
+    keep = set(qgnodes) - removed
+    for nodename in list(keep):
+        keep.update(sciGraph.predecessors(nodename))
+        keep.update(sciGraph.successors(nodename))
+    subGraph, mapping = sciGraph.subgraph(keep)
+    subQgnodes = {mapping[nodename]: qgnode for nodename, qgnode in qgnodes.items() if nodename not in removed}
+    return subGraph, subQgnodes
+
+def assign_resources(sciGraph, qgnodes, model):
+    """Set resource requirements of every task node from a resource model
+
+    Parameters
+    ----------
+    sciGraph : `CompactGraph`
+        Science graph
+    qgnodes : `dict`
+        QuantumGraph nodes keyed by task node
+    model : `ResourceModel`
+        Resource requirements of quanta by task label
+
+    Returns
+    -------
+    count : `int`
+        Number of task nodes with any resource requirement
+    """
+    attrNames = {'memory': 'request_memory', 'cpus': 'request_cpus', 'runtime': 'runtime'}
+    count = 0
+    for nodename, qgnode in qgnodes.items():
+        resources = model.cluster_resources(qgnode.taskDef, qgnode.quanta)
+        for key, value in resources.items():
+            sciGraph.node[nodename][attrNames[key]] = value
+        if resources:
+            count += 1
+    return count
+
+def load_qgnode(sciGraph, nodename):
+    """Load single quantum of a task node back from its quantum file
+
+    Parameters
+    ----------
+    sciGraph : `CompactGraph`
+        Workflow graph for the pipeline
+    nodename : `int`
+        Task node id
+
+    Returns
+    -------
+    qgnode : QuantumGraph Node
+        Single quantum node saved for the task
+    """
+    for pnodename in sciGraph.predecessors(nodename):
+        pnode = sciGraph.node[pnodename]
+        if pnode['data_type'] == 'quantum':
+            if pnode.get('archive', False):
+                with QuantumArchive(pnode['pfn']) as archive:
+                    qgraph = archive.load(sciGraph.node[nodename]['qkey'])
+            else:
+                with open(pnode['pfn'], 'rb') as pickleFile:
+                    qgraph = pickle.load(pickleFile)
+            return qgraph[0]
+    raise ValueError("No quantum file for task node %s" % sciGraph.node_name(nodename))
+
+def assign_exec_args(args, sciGraph):
+    """Set activator name and arguments of every task in the workflow graph
+
+    Parameters
+    ----------
+    args :
+        Command line arguments
+    sciGraph : `CompactGraph`
+        Workflow graph for the pipeline
+    """
+    for nodename in sciGraph.nodes():
+        node = sciGraph.node[nodename]
+        if node['node_type'] == 1:
+            node['exec_name'] = args.activator
+            node['exec_args'] = args.actargs.format(qlfn=node['qlfn'], qkey=node['qkey'])
+
+def create_workflow_graph(args, sciGraph, qgnodes, digests=None, metrics=None):
     """Create workflow graph from the Science Graph that has information
     needed for WMS (e.g., filenames, command line arguments, etc)
 
@@ -136,67 +568,270 @@ def create_workflow_graph(args, sciGraph, qgnodes):
     ----------
     args :
         Command line arguments
-    sciGraph : `networkx.DiGraph`
+    sciGraph : `CompactGraph`
         Science Graph for the pipeline
-    taskDefs : `dict`
-        Dictionary of taskDefs
+    qgnodes : `dict`
+        Single quantum QuantumGraph nodes keyed by task node id
+    digests : `dict`, optional
+        Content hashes of previously written quantum files (see
+        `save_qgnodes`), an archive is written to a temporary file
+        replacing the archive only if its content changed
+    metrics : `StageMetrics`, optional
+        Collector recording saving of quanta as a separate stage
+
+    Returns
+    -------
+    stats : `dict`
+        Numbers of quanta, quanta written and bytes written
     """
     # modifying graph in place
 
     logging.info("creating workflow graph")
-    ncnt = networkx.number_of_nodes(sciGraph)
+    ncnt = sciGraph.number_of_nodes()
     qcnt = 0
     nodelist = list(sciGraph.nodes())
+
+    # all quanta go into a single archive instead of one file per quantum,
+    # jobs read it in place on the shared file system (by its absolute path)
+    # instead of Pegasus staging it for every job
+    archive = None
+    if args.archive is not None:
+        aNodeName = ncnt
+        ncnt += 1
+        aFileName = os.path.abspath(os.path.join(args.outdir, 'input', args.archive))
+        alfn = os.path.basename(aFileName)
+        sciGraph.add_node(aNodeName, node_type=0, lfn=alfn, label=alfn, pfn=aFileName,
+                          ignore=True, data_type="quantum", archive=True)
+        archive = QuantumArchiveWriter(aFileName + ".tmp")
+
+    # quanta are written after all file names are assigned so that writing
+    # can be done in parallel without affecting the graph
+    saves = []
     for nodename in nodelist:
         node = sciGraph.node[nodename]
         if node['node_type'] == 0:   # data/file
-            node['lfn'] = nodename
+            node['lfn'] = sciGraph.node_name(nodename)
             node['ignore'] = True
             node['data_type'] = "science"
         elif node['node_type'] == 1: # task  
-
-            # add quantum pickle input data node
-            ncnt += 1
             qcnt += 1
-            qNodeName = "%06d" % ncnt
-            qlfn = "quantum%s.pickle" % nodename
-            if args.outdir is not None:
-                qFileName = os.path.join(args.outdir, 'input', qlfn)
+            qkey = sciGraph.node_name(nodename)
+            if archive is not None:
+                saves.append((nodename, qkey))
+                sciGraph.add_edge(aNodeName, nodename)
+                qlfn = aFileName
+            else:
+                # add quantum pickle input data node
+                qNodeName = ncnt
+                ncnt += 1
+                qlfn = "quantum%s.pickle" % qkey
+                if args.outdir is not None:
+                    qFileName = os.path.join(args.outdir, 'input', qlfn)
 
-            lfn=os.path.basename(qFileName)
-            sciGraph.add_node(qNodeName, node_type=0, lfn=lfn, label=lfn, pfn=qFileName,
-                              ignore=False, data_type="quantum", shape='box', style='rounded')
-            save_single_qgnode(qgnodes[nodename], qFileName)
-            sciGraph.add_edge(qNodeName, nodename)
+                lfn=os.path.basename(qFileName)
+                sciGraph.add_node(qNodeName, node_type=0, lfn=lfn, label=lfn, pfn=qFileName,
+                                  ignore=False, data_type="quantum")
+                saves.append((nodename, qFileName))
+                sciGraph.add_edge(qNodeName, nodename)
 
-            node['exec_name'] = args.activator
-            node['exec_args'] = args.actargs.format(qlfn=qlfn)
+            node['qlfn'] = qlfn
+            node['qkey'] = qkey
         else:
             raise ValueError("Invalid node_type (%s)" % node['node_type'])
+    assign_exec_args(args, sciGraph)
+
+    if metrics is None:
+        metrics = StageMetrics()
+    logging.info("saving %d quanta (jobs=%d)", qcnt, args.jobs)
+    with metrics.stage('save_quanta') as stage:
+        try:
+            nfiles, nbytes = save_qgnodes(qgnodes, saves, args.jobs, archive, digests)
+        except BaseException:
+            if archive is not None:
+                archive.close()
+                os.remove(archive.filename)
+            raise
+        if archive is not None:
+            archive.close()
+            digest = digests.pop(archive.filename) if digests is not None else None
+            if digest is not None and digest == digests.get(aFileName) and os.path.exists(aFileName):
+                # leave unchanged archive in place
+                os.remove(archive.filename)
+                nfiles = nbytes = 0
+            else:
+                os.replace(archive.filename, aFileName)
+                if digests is not None:
+                    digests[aFileName] = digest
+        stage['counts'].update(quanta_written=nfiles, bytes_written=nbytes)
+    return {'quanta': qcnt, 'quanta_written': nfiles, 'bytes_written': nbytes}
+
+def run_schema_cmdlines(cmdlines, jobs=1, onSuccess=None, retries=SCHEMA_RETRIES, delay=SCHEMA_RETRY_DELAY):
+    """Run schema creation command lines concurrently
+
+    At most jobs command lines run at the same time.  Concurrent runs write
+    to the same registry, a run failing because the (SQLite) registry is
+    locked (see `REGISTRY_LOCKED`) is retried after a delay doubling with
+    every attempt.  Any other failure terminates the ones still running and
+    no new ones are started.
+
+    Parameters
+    ----------
+    cmdlines : `list`
+        Pairs of a key and a command line
+    jobs : `int`, optional
+        Maximum number of concurrently running command lines
+    onSuccess : callable, optional
+        Function called with the key of every successful command line
+    retries : `int`, optional
+        Maximum number of retries of a command line
+    delay : `float`, optional
+        Delay (in seconds) before the first retry
+
+    Raises
+    ------
+    `subprocess.CalledProcessError`
+        If any of the command lines fails, or is still failing because of
+        a locked registry after all retries
+    """
+    # pending entries: key, command line, attempt, and earliest start time
+    pending = [(key, cmdline, 0, 0.0) for key, cmdline in cmdlines]
+    running = []
+    try:
+        while pending or running:
+            now = time.time()
+            for item in [item for item in pending if item[3] <= now]:
+                if len(running) >= max(1, jobs):
+                    break
+                pending.remove(item)
+                key, cmdline, attempt, start = item
+                logging.info("schema creation cmdline = %s", cmdline)
+                # stderr is kept to tell a locked registry from other failures
+                errors = tempfile.TemporaryFile()
+                running.append((key, cmdline, attempt, errors,
+                                subprocess.Popen(shlex.split(cmdline), stderr=errors)))
+            for item in list(running):
+                key, cmdline, attempt, errors, proc = item
+                returncode = proc.poll()
+                if returncode is None:
+                    continue
+                running.remove(item)
+                errors.seek(0)
+                output = errors.read()
+                errors.close()
+                sys.stderr.buffer.write(output)
+                sys.stderr.flush()
+                if returncode != 0:
+                    if any(message in output for message in REGISTRY_LOCKED) and attempt < retries:
+                        logging.warning("registry locked, retrying schema creation cmdline = %s", cmdline)
+                        pending.append((key, cmdline, attempt + 1, time.time() + delay * 2 ** attempt))
+                        continue
+                    raise subprocess.CalledProcessError(returncode, cmdline, stderr=output)
+                if onSuccess is not None:
+                    onSuccess(key)
+            if running or pending:
+                time.sleep(0.1)
+    finally:
+        for key, cmdline, attempt, errors, proc in running:
+            logging.info("terminating schema creation cmdline = %s", cmdline)
+            proc.terminate()
+            proc.wait()
+            errors.close()
+
+def schema_cache_key(args, taskDef):
+    """Compute key identifying schemas created for a task
+
+    Parameters
+    ----------
+    args :
+        Command line arguments (butler, collections and schema command line
+        are part of the key)
+    taskDef : TaskDef
+        Definition of the task
 
-def create_one_schema(cmdline):
-    logging.info("schema creation cmdline = %s", cmdline)
-    subprocess.run(shlex.split(cmdline), check=True)
+    Returns
+    -------
+    key : `str`
+        Hex digest of the task label, class, config and butler/collections
+    """
+    config = io.StringIO()
+    taskDef.config.saveToStream(config)
+    parts = [taskDef.label, taskDef.taskName, config.getvalue(),
+             os.path.abspath(args.butler), args.incol, args.outcol, args.schargs]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
 
 def create_all_schemas(args, sciGraph, qgnodes):
+    """Create schemas running an init-only activator once for every task
+
+    Schema creation for tasks whose key (see `schema_cache_key`) is found
+    in the schema cache is skipped.
+
+    Parameters
+    ----------
+    args :
+        Command line arguments
+    sciGraph : `CompactGraph`
+        Workflow graph for the pipeline
+    qgnodes : `dict` or None
+        Single quantum QuantumGraph nodes keyed by task node id, if None
+        they are loaded back from the quantum files
+
+    Returns
+    -------
+    count : `int`
+        Number of init-only runs
+    """
     # Fill in variables for activator command line from args
     #   qlfn is filled in on a per activator basis later
-    args.schargs = args.schargs.format(**vars(args),qlfn='{qlfn}')
+    args.schargs = args.schargs.format(**vars(args),qlfn='{qlfn}',qkey='{qkey}')
     logging.info("schargs = '%s'", args.schargs)
 
+    cacheFilename = args.schema_cache
+    if cacheFilename is None:
+        cacheFilename = os.path.join(os.path.dirname(os.path.abspath(args.butler)), "bps_schema_cache.json")
+    cache = {}
+    if os.path.exists(cacheFilename):
+        with open(cacheFilename, "r") as cacheFile:
+            cache = json.load(cacheFile)
+
     logging.info("creating schemas")
     schema_done = {}
-    nodelist = list(sciGraph.nodes())
-    for nodename in nodelist:
-        node = sciGraph.node[nodename]
-        if node['node_type'] == 1: # task  
-            logging.debug("node = %s", node)
-            if node['label'] not in schema_done:
-                parents = list(sciGraph.predecessors(nodename))
-                logging.debug("parents = %s", parents)
-                for pnodename in parents:
-                    pnode = sciGraph.node[pnodename]
-                    logging.debug("pnode = %s", pnode)
-                    if pnode['data_type'] == 'quantum':
-                        create_one_schema(args.schargs.format(qlfn=pnode['pfn']))
-                schema_done[node['label']] = True
+    cmdlines = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        nodelist = list(sciGraph.nodes())
+        for nodename in nodelist:
+            node = sciGraph.node[nodename]
+            if node['node_type'] == 1: # task  
+                logging.debug("node = %s", node)
+                if node['task_def_id'] not in schema_done:
+                    schema_done[node['task_def_id']] = True
+                    qgnode = qgnodes.get(nodename) if qgnodes is not None else None
+                    if qgnode is None:
+                        qgnode = load_qgnode(sciGraph, nodename)
+                    taskDef = qgnode.taskDef
+                    key = schema_cache_key(args, taskDef)
+                    if key in cache:
+                        logging.info("schemas for %s already created", taskDef.label)
+                        continue
+                    parents = list(sciGraph.predecessors(nodename))
+                    logging.debug("parents = %s", parents)
+                    for pnodename in parents:
+                        pnode = sciGraph.node[pnodename]
+                        logging.debug("pnode = %s", pnode)
+                        if pnode['data_type'] == 'quantum':
+                            qkey = sciGraph.node_name(nodename)
+                            qlfn = pnode['pfn']
+                            if pnode.get('archive', False):
+                                # init-only run needs a regular QuantumGraph file
+                                qlfn = os.path.join(tmpdir, "quantum%s.pickle" % qkey)
+                                with QuantumArchive(pnode['pfn']) as archive, open(qlfn, "wb") as qfile:
+                                    qfile.write(archive.read(qkey))
+                            cmdlines.append(((key, taskDef.label), args.schargs.format(qlfn=qlfn, qkey=qkey)))
+
+        def onSuccess(item):
+            key, label = item
+            cache[key] = label
+            with open(cacheFilename, "w") as cacheFile:
+                json.dump(cache, cacheFile, indent=1, sort_keys=True)
+
+        run_schema_cmdlines(cmdlines, args.schema_jobs, onSuccess)
+    return len(cmdlines)
@@ -0,0 +1,373 @@
+"""Compact directed graph used to represent science and workflow graphs.
+
+Nodes are consecutive integers starting from 0.  Node attributes are kept
+in columns (one per attribute name) instead of a dictionary per node and
+edges are kept in two flat arrays which are turned into compressed sparse
+row (CSR) adjacency on the first query.  The class implements the subset of
+the `networkx.DiGraph` API used by the BPS stages (``node[...]``,
+``nodes()``, ``predecessors()``, ``successors()``, ...), and can be exported
+to `networkx.DiGraph` for drawing and debugging.
+"""
+
+from array import array
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+# Format used to turn integer node ids into names (e.g., logical file names).
+NODE_NAME_FORMAT = "%06d"
+
+
+class CompactGraph(object):
+    """Directed graph with integer node ids and columnar node attributes.
+
+    Attribute values equal to None are treated as missing, i.e., setting an
+    attribute to None removes it from the node.
+    """
+
+    def __init__(self):
+        self._node_type = array('b')
+        self._columns = {}
+        self._src = array('l')
+        self._dst = array('l')
+        self._adj = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_adj'] = None
+        return state
+
+    def __len__(self):
+        return len(self._node_type)
+
+    def __iter__(self):
+        return iter(range(len(self._node_type)))
+
+    def __contains__(self, node):
+        return isinstance(node, int) and 0 <= node < len(self._node_type)
+
+    @property
+    def node(self):
+        """Node attributes, ``graph.node[node]`` acts as a dictionary."""
+        return _NodeAccessor(self)
+
+    def node_name(self, node):
+        """Return name of the node.
+
+        Parameters
+        ----------
+        node : `int`
+            Node id.
+
+        Returns
+        -------
+        name : `str`
+            Node id formatted with `NODE_NAME_FORMAT`.
+        """
+        return NODE_NAME_FORMAT % node
+
+    def number_of_nodes(self):
+        return len(self._node_type)
+
+    def number_of_edges(self):
+        out_ptr, _, _, _ = self._adjacency()
+        return out_ptr[-1]
+
+    def add_node(self, node, **attrs):
+        """Add a node or update attributes of an existing one.
+
+        Parameters
+        ----------
+        node : `int`
+            Node id, new nodes must be numbered consecutively.
+        **attrs
+            Node attributes.
+
+        Raises
+        ------
+        `ValueError`
+            If the id of a new node is not the next consecutive one.
+        """
+        count = len(self._node_type)
+        if node == count:
+            self._node_type.append(-1)
+            for column in self._columns.values():
+                column.append(None)
+            self._adj = None
+        elif not 0 <= node < count:
+            raise ValueError("Expected node id %d, got %s" % (count, node))
+        if attrs:
+            self.node[node].update(attrs)
+
+    def add_edge(self, u, v):
+        """Add an edge between existing nodes.
+
+        Raises
+        ------
+        `KeyError`
+            If any of the nodes does not exist.
+        """
+        for node in (u, v):
+            if node not in self:
+                raise KeyError(node)
+        self._src.append(u)
+        self._dst.append(v)
+        self._adj = None
+
+    def nodes(self, data=False):
+        """Iterate over nodes, optionally with their attributes.
+        """
+        if data:
+            return ((node, dict(self.node[node])) for node in self)
+        return iter(self)
+
+    def edges(self):
+        """Iterate over edges as (source, target) pairs.
+        """
+        out_ptr, out_idx, _, _ = self._adjacency()
+        for u in range(len(self._node_type)):
+            for i in range(out_ptr[u], out_ptr[u + 1]):
+                yield u, out_idx[i]
+
+    def successors(self, node):
+        out_ptr, out_idx, _, _ = self._adjacency()
+        return iter(out_idx[out_ptr[node]:out_ptr[node + 1]])
+
+    def predecessors(self, node):
+        _, _, in_ptr, in_idx = self._adjacency()
+        return iter(in_idx[in_ptr[node]:in_ptr[node + 1]])
+
+    def out_degree(self, node):
+        out_ptr, _, _, _ = self._adjacency()
+        return out_ptr[node + 1] - out_ptr[node]
+
+    def in_degree(self, node):
+        _, _, in_ptr, _ = self._adjacency()
+        return in_ptr[node + 1] - in_ptr[node]
+
+    def copy(self):
+        """Return an independent copy of the graph.
+        """
+        graph = CompactGraph()
+        graph._node_type = array('b', self._node_type)
+        graph._columns = {key: list(column) for key, column in self._columns.items()}
+        graph._src = array('l', self._src)
+        graph._dst = array('l', self._dst)
+        return graph
+
+    def subgraph(self, nodes):
+        """Return graph induced by a subset of nodes.
+
+        Parameters
+        ----------
+        nodes : iterable of `int`
+            Nodes to keep.
+
+        Returns
+        -------
+        graph : `CompactGraph`
+            New graph with the nodes renumbered consecutively, keeping
+            their order, their attributes, and the edges between them.
+        mapping : `dict`
+            New node ids keyed by the old ones.
+        """
+        nodes = sorted(set(nodes))
+        mapping = {old: new for new, old in enumerate(nodes)}
+        graph = CompactGraph()
+        graph._node_type = array('b', [self._node_type[node] for node in nodes])
+        graph._columns = {key: [column[node] for node in nodes] for key, column in self._columns.items()}
+        for u, v in zip(self._src, self._dst):
+            if u in mapping and v in mapping:
+                graph._src.append(mapping[u])
+                graph._dst.append(mapping[v])
+        return graph, mapping
+
+    def columns(self):
+        """Return node attributes as columns.
+
+        Returns
+        -------
+        columns : `dict`
+            Lists of attribute values (None if missing) indexed by node id,
+            keyed by attribute name, including 'node_type'.
+        """
+        columns = {'node_type': [None if value < 0 else value for value in self._node_type]}
+        columns.update(self._columns)
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns, src, dst):
+        """Create a graph from attribute columns and edges.
+
+        Parameters
+        ----------
+        columns : `dict`
+            Lists of attribute values as returned by `columns`.
+        src, dst : sequence of `int`
+            Sources and targets of the edges.
+
+        Returns
+        -------
+        graph : `CompactGraph`
+            New graph.
+        """
+        graph = cls()
+        graph._node_type = array('b', [-1 if value is None else value
+                                       for value in columns.get('node_type', [])])
+        graph._columns = {key: list(column) for key, column in columns.items() if key != 'node_type'}
+        graph._src = array('l', src)
+        graph._dst = array('l', dst)
+        return graph
+
+    def adjacency(self):
+        """Return CSR representation of the edges.
+
+        Returns
+        -------
+        out_ptr, out_idx, in_ptr, in_idx : `array`
+            Successors of node ``i`` are ``out_idx[out_ptr[i]:out_ptr[i + 1]]``,
+            predecessors are ``in_idx[in_ptr[i]:in_ptr[i + 1]]``.
+        """
+        return self._adjacency()
+
+    def to_networkx(self):
+        """Export the graph to networkx.
+
+        Returns
+        -------
+        graph : `networkx.DiGraph`
+            Graph with nodes named with `node_name` and the same attributes.
+        """
+        import networkx
+
+        graph = networkx.DiGraph()
+        for node in self:
+            graph.add_node(self.node_name(node), **self.node[node])
+        for u, v in self.edges():
+            graph.add_edge(self.node_name(u), self.node_name(v))
+        return graph
+
+    def _adjacency(self):
+        """Return (building it if needed) CSR representation of the edges.
+        """
+        if self._adj is None:
+            count = len(self._node_type)
+            out_ptr, out_idx = _make_csr(count, self._src, self._dst)
+            in_ptr, in_idx = _make_csr(count, self._dst, self._src)
+            self._adj = (out_ptr, out_idx, in_ptr, in_idx)
+        return self._adj
+
+
+class _NodeAccessor(object):
+    """Provides ``graph.node[node]`` access to node attributes.
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        if node not in self._graph:
+            raise KeyError(node)
+        return _NodeAttrs(self._graph, node)
+
+    def __iter__(self):
+        return iter(self._graph)
+
+    def __len__(self):
+        return len(self._graph)
+
+
+class _NodeAttrs(MutableMapping):
+    """Dictionary-like view of attributes of a single node.
+    """
+
+    def __init__(self, graph, node):
+        self._graph = graph
+        self._node = node
+
+    def __getitem__(self, key):
+        if key == 'node_type':
+            value = self._graph._node_type[self._node]
+            if value < 0:
+                raise KeyError(key)
+            return value
+        column = self._graph._columns.get(key)
+        value = column[self._node] if column is not None else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == 'node_type':
+            self._graph._node_type[self._node] = -1 if value is None else value
+            return
+        column = self._graph._columns.get(key)
+        if column is None:
+            if value is None:
+                return
+            column = [None] * len(self._graph)
+            self._graph._columns[key] = column
+        column[self._node] = value
+
+    def __delitem__(self, key):
+        self[key]
+        self[key] = None
+
+    def __iter__(self):
+        if self._graph._node_type[self._node] >= 0:
+            yield 'node_type'
+        for key, column in self._graph._columns.items():
+            if column[self._node] is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _make_csr(count, keys, values):
+    """Group edge endpoints by their source using counting sort.
+
+    Duplicate edges are dropped, neighbors keep the insertion order.
+
+    Parameters
+    ----------
+    count : `int`
+        Number of nodes.
+    keys : `array`
+        Nodes the edges are grouped by.
+    values : `array`
+        The other ends of the edges.
+
+    Returns
+    -------
+    ptr : `array`
+        Neighbors of node ``i`` are ``idx[ptr[i]:ptr[i + 1]]``.
+    idx : `array`
+        Neighbors of all nodes.
+    """
+    ptr = array('l', [0]) * (count + 1)
+    for key in keys:
+        ptr[key + 1] += 1
+    for i in range(count):
+        ptr[i + 1] += ptr[i]
+    idx = array('l', [0]) * len(keys)
+    pos = array('l', ptr)
+    for key, value in zip(keys, values):
+        idx[pos[key]] = value
+        pos[key] += 1
+
+    # Drop duplicates the same way networkx.DiGraph ignores repeated edges.
+    unique_ptr = array('l', [0]) * (count + 1)
+    unique_idx = array('l')
+    for i in range(count):
+        begin, end = ptr[i], ptr[i + 1]
+        if end - begin > 1:
+            unique_idx.extend(dict.fromkeys(idx[begin:end]))
+        else:
+            unique_idx.extend(idx[begin:end])
+        unique_ptr[i + 1] = len(unique_idx)
+    return unique_ptr, unique_idx
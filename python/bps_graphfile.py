@@ -0,0 +1,439 @@
+"""Columnar binary file format of workflow graphs.
+
+The file holds node types, CSR adjacency in both directions, one column per
+node attribute, and a table of interned strings, each in a section aligned
+to 8 bytes, followed by a pickled table of contents and a fixed size
+footer::
+
+    MAGIC | section | section | ... | contents | contents offset | MAGIC
+
+Columns are encoded by the type of their values:
+
+- str: index into the string table (-1 if missing),
+- int: 64-bit values and a presence mask,
+- bool: 0 or 1 (-1 if missing),
+- obj: pickled list of values (None if missing).
+
+`MappedGraph` maps the file into memory and reads the arrays in place, so
+opening a graph is cheap and queries touch only the columns they use.
+"""
+
+import mmap
+import pickle
+import struct
+from array import array
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from bps_graph import CompactGraph, NODE_NAME_FORMAT
+
+MAGIC = b"BPSGRF01"
+_FOOTER = struct.Struct("<Q")
+_ALIGNMENT = 8
+
+
+def write_graph(graph, filename):
+    """Save a compact graph in the columnar format.
+
+    Parameters
+    ----------
+    graph : `CompactGraph`
+        Graph to save.
+    filename : `str`
+        Name of the file.
+    """
+    columns = graph.columns()
+    out_ptr, out_idx, in_ptr, in_idx = graph.adjacency()
+    sections = {}
+    kinds = {}
+    strings = {}
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+
+        def add(name, data):
+            padding = -f.tell() % _ALIGNMENT
+            f.write(b"\0" * padding)
+            if isinstance(data, array):
+                sections[name] = (f.tell(), data.typecode, len(data))
+                data.tofile(f)
+            else:
+                sections[name] = (f.tell(), 'B', len(data))
+                f.write(data)
+
+        add('node_type', array('b', [-1 if value is None else value for value in columns.pop('node_type')]))
+        for name, values in (('out_ptr', out_ptr), ('out_idx', out_idx),
+                             ('in_ptr', in_ptr), ('in_idx', in_idx)):
+            add(name, array('q' if name.endswith('ptr') else 'i', values))
+        for key, values in columns.items():
+            kinds[key] = _column_kind(values)
+            for part, data in _encode_column(kinds[key], values, strings).items():
+                add('%s:%s' % (key, part), data)
+
+        blob = bytearray()
+        offsets = array('q', [0])
+        for value in strings:
+            blob += value.encode()
+            offsets.append(len(blob))
+        add('string_offsets', offsets)
+        add('string_data', bytes(blob))
+
+        offset = f.tell()
+        f.write(pickle.dumps({'nodes': len(graph), 'sections': sections, 'columns': kinds},
+                             protocol=pickle.HIGHEST_PROTOCOL))
+        f.write(_FOOTER.pack(offset))
+        f.write(MAGIC)
+
+
+def read_graph(filename):
+    """Load a graph saved in the columnar format.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the file.
+
+    Returns
+    -------
+    graph : `CompactGraph`
+        Fully loaded (modifiable) graph.
+    """
+    with MappedGraph(filename) as mapped:
+        return mapped.to_compact()
+
+
+def _column_kind(values):
+    """Choose encoding of a column.
+    """
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, str) for value in present):
+        return 'str'
+    if all(isinstance(value, bool) for value in present):
+        return 'bool'
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return 'int'
+    return 'obj'
+
+
+def _encode_column(kind, values, strings):
+    """Encode a column.
+
+    Parameters
+    ----------
+    kind : `str`
+        Encoding, see `_column_kind`.
+    values : `list`
+        Values indexed by node id, None if missing.
+    strings : `dict`
+        String table, new strings are added to it.
+
+    Returns
+    -------
+    parts : `dict`
+        Arrays or bytes to save, keyed by part name.
+    """
+    if kind == 'str':
+        ids = array('i')
+        for value in values:
+            if value is None:
+                ids.append(-1)
+            else:
+                ids.append(strings.setdefault(value, len(strings)))
+        return {'ids': ids}
+    if kind == 'bool':
+        return {'values': array('b', [-1 if value is None else int(value) for value in values])}
+    if kind == 'int':
+        return {'values': array('q', [0 if value is None else value for value in values]),
+                'mask': array('b', [value is not None for value in values])}
+    return {'data': pickle.dumps(list(values), protocol=pickle.HIGHEST_PROTOCOL)}
+
+
+class MappedGraph(object):
+    """Read-only graph backed by a memory-mapped file.
+
+    Supports the queries of `CompactGraph` (``node[...]``, ``successors()``,
+    ...).  Attributes of a node are a read-only mapping whose values are read
+    from the columns only when asked for; copy them (e.g., ``dict(...)``) to
+    change them.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of a file written by `write_graph`.
+
+    Raises
+    ------
+    `ValueError`
+        If the file is not in the columnar graph format.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._map)
+        tail = _FOOTER.size + len(MAGIC)
+        if size < len(MAGIC) + tail or self._map[:len(MAGIC)] != MAGIC \
+                or self._map[size - len(MAGIC):] != MAGIC:
+            self._map.close()
+            raise ValueError("'{0}' is not a graph file.".format(filename))
+        offset, = _FOOTER.unpack(self._map[size - tail:size - len(MAGIC)])
+        contents = pickle.loads(self._map[offset:size - tail])
+        self._count = contents['nodes']
+        self._sections = contents['sections']
+        self.kinds = contents['columns']
+        self._view = memoryview(self._map)
+        self._views = []
+        self._parts = {}
+        self._columns = {}
+        self._string_ids = None
+        self._string_list = None
+        self._node_type = self._section('node_type')
+        self._out_ptr = self._section('out_ptr')
+        self._out_idx = self._section('out_idx')
+        self._in_ptr = self._section('in_ptr')
+        self._in_idx = self._section('in_idx')
+        self._string_offsets = self._section('string_offsets')
+        self._string_data = self._section('string_data')
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._parts = {}
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(range(self._count))
+
+    def __contains__(self, node):
+        return isinstance(node, int) and 0 <= node < self._count
+
+    @property
+    def node(self):
+        """Node attributes, ``graph.node[node]`` acts as a dictionary."""
+        return _MappedNodeAccessor(self)
+
+    def node_name(self, node):
+        """Return name of the node (see `CompactGraph.node_name`).
+        """
+        return NODE_NAME_FORMAT % node
+
+    def number_of_nodes(self):
+        return self._count
+
+    def number_of_edges(self):
+        return self._out_ptr[self._count]
+
+    def nodes(self, data=False):
+        """Iterate over nodes, optionally with their attributes.
+        """
+        if data:
+            return ((node, dict(self.node[node])) for node in self)
+        return iter(self)
+
+    def edges(self):
+        """Iterate over edges as (source, target) pairs.
+        """
+        for u in range(self._count):
+            for i in range(self._out_ptr[u], self._out_ptr[u + 1]):
+                yield u, self._out_idx[i]
+
+    def successors(self, node):
+        return iter(self._out_idx[self._out_ptr[node]:self._out_ptr[node + 1]])
+
+    def predecessors(self, node):
+        return iter(self._in_idx[self._in_ptr[node]:self._in_ptr[node + 1]])
+
+    def out_degree(self, node):
+        return self._out_ptr[node + 1] - self._out_ptr[node]
+
+    def in_degree(self, node):
+        return self._in_ptr[node + 1] - self._in_ptr[node]
+
+    def value(self, node, key):
+        """Return value of a node attribute.
+
+        Parameters
+        ----------
+        node : `int`
+            Node id.
+        key : `str`
+            Attribute name.
+
+        Returns
+        -------
+        value
+            Attribute value, None if missing.
+        """
+        if key == 'node_type':
+            value = self._node_type[node]
+            return None if value < 0 else value
+        kind = self.kinds.get(key)
+        if kind is None:
+            return None
+        if kind == 'str':
+            index = self._part(key, 'ids')[node]
+            return None if index < 0 else self._string(index)
+        if kind == 'bool':
+            value = self._part(key, 'values')[node]
+            return None if value < 0 else bool(value)
+        if kind == 'int':
+            return self._part(key, 'values')[node] if self._part(key, 'mask')[node] else None
+        return self._column(key)[node]
+
+    def select(self, **attrs):
+        """Find nodes with given attribute values.
+
+        Only the columns of the given attributes are read, string values are
+        compared by their index in the string table.
+
+        Parameters
+        ----------
+        **attrs
+            Required attribute values.
+
+        Returns
+        -------
+        nodes : `list` of `int`
+            Ids of the matching nodes.
+        """
+        nodes = range(self._count)
+        for key, wanted in attrs.items():
+            kind = self.kinds.get(key)
+            if kind == 'str':
+                index = self._string_index(wanted)
+                ids = self._part(key, 'ids')
+                nodes = [node for node in nodes if index is not None and ids[node] == index]
+            else:
+                nodes = [node for node in nodes if self.value(node, key) == wanted]
+        return list(nodes)
+
+    def to_compact(self):
+        """Load the whole graph.
+
+        Returns
+        -------
+        graph : `CompactGraph`
+            Modifiable copy of the graph.
+        """
+        columns = {'node_type': [None if value < 0 else value for value in self._node_type]}
+        for key in self.kinds:
+            columns[key] = list(self._column(key))
+        src = array('l')
+        for u in range(self._count):
+            src.extend([u] * (self._out_ptr[u + 1] - self._out_ptr[u]))
+        return CompactGraph.from_columns(columns, src, self._out_idx)
+
+    def _section(self, name):
+        offset, typecode, length = self._sections[name]
+        view = self._view[offset:offset + length * struct.calcsize(typecode)]
+        self._views.append(view)
+        if typecode != 'B':
+            view = view.cast(typecode)
+            self._views.append(view)
+        return view
+
+    def _column(self, key):
+        """Decode a whole column.
+        """
+        column = self._columns.get(key)
+        if column is not None:
+            return column
+        kind = self.kinds[key]
+        if kind == 'str':
+            strings = self._strings()
+            column = [strings[index] if index >= 0 else None for index in self._part(key, 'ids')]
+        elif kind == 'bool':
+            column = [None if value < 0 else bool(value) for value in self._part(key, 'values')]
+        elif kind == 'int':
+            column = [value if present else None
+                      for value, present in zip(self._part(key, 'values'), self._part(key, 'mask'))]
+        else:
+            column = pickle.loads(self._part(key, 'data'))
+        # Only pickled columns are kept, others are cheap to read in place.
+        if kind == 'obj':
+            self._columns[key] = column
+        return column
+
+    def _part(self, key, part):
+        name = '%s:%s' % (key, part)
+        view = self._parts.get(name)
+        if view is None:
+            view = self._parts[name] = self._section(name)
+        return view
+
+    def _string(self, index):
+        begin, end = self._string_offsets[index], self._string_offsets[index + 1]
+        return bytes(self._string_data[begin:end]).decode()
+
+    def _strings(self):
+        """Decode the whole string table.
+        """
+        if self._string_list is None:
+            data = bytes(self._string_data)
+            offsets = self._string_offsets
+            self._string_list = [data[offsets[index]:offsets[index + 1]].decode()
+                                 for index in range(len(offsets) - 1)]
+        return self._string_list
+
+    def _string_index(self, value):
+        if self._string_ids is None:
+            self._string_ids = {string: index for index, string in enumerate(self._strings())}
+        return self._string_ids.get(value)
+
+
+class _MappedNodeAccessor(object):
+    """Provides ``graph.node[node]`` access to node attributes.
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        if node not in self._graph:
+            raise KeyError(node)
+        return _MappedNodeAttrs(self._graph, node)
+
+    def __iter__(self):
+        return iter(self._graph)
+
+    def __len__(self):
+        return len(self._graph)
+
+
+class _MappedNodeAttrs(Mapping):
+    """Dictionary-like, read-only view of attributes of a single node.
+    """
+
+    def __init__(self, graph, node):
+        self._graph = graph
+        self._node = node
+
+    def __getitem__(self, key):
+        value = self._graph.value(self._node, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key in ['node_type'] + list(self._graph.kinds):
+            if self._graph.value(self._node, key) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
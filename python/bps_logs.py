@@ -0,0 +1,119 @@
+"""Log bundles holding output of many jobs.
+
+A bundle is a pair of files next to each other:
+
+- ``<bundle>.log``: output (stdout and stderr) of the jobs, one record after
+  another, every record starting with a header line,
+- ``<bundle>.idx``: one tab separated line per record: job id, offset and
+  length of the record in the log, return code, start and end time.
+
+Jobs append to a bundle holding an exclusive lock on the log, so jobs
+running concurrently on a shared file system can share it.  Retried jobs
+have a record per attempt.
+"""
+
+import fcntl
+import os
+import shutil
+import time
+
+LOG_SUFFIX = '.log'
+INDEX_SUFFIX = '.idx'
+
+
+def append_record(bundle, jobId, output, returncode, start, end):
+    """Append output of a job to a bundle
+
+    Parameters
+    ----------
+    bundle : `str`
+        Bundle name (the log file without its suffix), its directory is
+        created if needed
+    jobId : `str`
+        Id of the job
+    output : file object
+        Binary file with job's output, read from the start
+    returncode : `int`
+        Return code of the job
+    start, end : `float`
+        Start and end time of the job (seconds since the epoch)
+
+    Returns
+    -------
+    offset : `int`
+        Offset of the record in the log
+    """
+    directory = os.path.dirname(bundle)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    header = "=== job %s rc=%d start=%s end=%s ===\n" % (jobId, returncode, _timestamp(start), _timestamp(end))
+    with open(bundle + LOG_SUFFIX, 'ab') as log:
+        fcntl.flock(log, fcntl.LOCK_EX)
+        try:
+            offset = log.seek(0, os.SEEK_END)
+            log.write(header.encode())
+            output.seek(0)
+            shutil.copyfileobj(output, log)
+            length = log.tell() - offset
+            log.flush()
+            with open(bundle + INDEX_SUFFIX, 'a') as index:
+                index.write("%s\t%d\t%d\t%d\t%.3f\t%.3f\n" % (jobId, offset, length, returncode, start, end))
+        finally:
+            fcntl.flock(log, fcntl.LOCK_UN)
+    return offset
+
+
+def read_index(bundle):
+    """Read index of a bundle
+
+    Parameters
+    ----------
+    bundle : `str`
+        Bundle name (the log or index file, with or without its suffix)
+
+    Returns
+    -------
+    records : `list` of `dict`
+        Records in the order they were appended, each with 'job', 'offset',
+        'length', 'returncode', 'start', and 'end'
+    """
+    records = []
+    with open(bundle_name(bundle) + INDEX_SUFFIX) as f:
+        for line in f:
+            jobId, offset, length, returncode, start, end = line.rstrip('\n').split('\t')
+            records.append({'job': jobId, 'offset': int(offset), 'length': int(length),
+                            'returncode': int(returncode), 'start': float(start), 'end': float(end)})
+    return records
+
+
+def read_record(bundle, record):
+    """Read output of a job from a bundle
+
+    Parameters
+    ----------
+    bundle : `str`
+        Bundle name (the log or index file, with or without its suffix)
+    record : `dict`
+        Index record of the job (see `read_index`)
+
+    Returns
+    -------
+    output : `bytes`
+        The record, header included
+    """
+    with open(bundle_name(bundle) + LOG_SUFFIX, 'rb') as f:
+        f.seek(record['offset'])
+        return f.read(record['length'])
+
+
+def bundle_name(filename):
+    """Return bundle name of its log or index file.
+    """
+    for suffix in (LOG_SUFFIX, INDEX_SUFFIX):
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def _timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seconds))
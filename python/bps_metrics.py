@@ -0,0 +1,139 @@
+"""Instrumentation of the submission stages.
+
+Every stage records its wall time, CPU time (own and of child processes),
+resident set size, and arbitrary item counts.  The report is saved as
+JSON; a single stage can also be profiled with cProfile.
+
+The peak resident set size the kernel keeps is the high-water mark of the
+whole process lifetime, not of a stage: a stage records the mark after it
+(``max_rss``) and by how much the stage raised it (``max_rss_growth``, zero
+for stages staying below the peak of earlier ones), and the resident set
+size at its start and end (``rss_start``, ``rss_end``, where available).
+"""
+
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+
+def max_rss(children=False):
+    """Return peak resident set size (lifetime high-water mark) in bytes.
+
+    Parameters
+    ----------
+    children : `bool`, optional
+        If True, returns the largest peak of terminated child processes
+        instead of the one of this process.
+    """
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def current_rss():
+    """Return current resident set size of the process in bytes.
+
+    Returns
+    -------
+    rss : `int` or None
+        Resident set size, None if not available (no /proc).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StageMetrics(object):
+    """Collector of per-stage metrics.
+
+    Parameters
+    ----------
+    profileStage : `str`, optional
+        Name of the stage to run under cProfile.
+    profileFilename : `str`, optional
+        File to dump profiling statistics to.
+    """
+
+    def __init__(self, profileStage=None, profileFilename=None):
+        self.stages = []
+        self.profileStage = profileStage
+        self.profileFilename = profileFilename
+        self._start = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure a stage.
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the stage.
+
+        Yields
+        ------
+        record : `dict`
+            Record of the stage, item counts can be added to its 'counts'.
+        """
+        record = {"stage": name, "counts": {}}
+        profiler = None
+        if name == self.profileStage:
+            profiler = cProfile.Profile()
+        rssBefore = max_rss()
+        record["rss_start"] = current_rss()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profileFilename)
+                logging.info("profile of stage %s saved in %s", name, self.profileFilename)
+            childrenAfter = resource.getrusage(resource.RUSAGE_CHILDREN)
+            record["wall_time"] = time.perf_counter() - wall
+            record["cpu_time"] = time.process_time() - cpu
+            record["children_cpu_time"] = (childrenAfter.ru_utime + childrenAfter.ru_stime -
+                                           children.ru_utime - children.ru_stime)
+            record["rss_end"] = current_rss()
+            record["max_rss"] = max_rss()
+            record["max_rss_growth"] = record["max_rss"] - rssBefore
+            record["children_max_rss"] = max_rss(children=True)
+            self.stages.append(record)
+            logging.info("stage %s: wall=%.3fs cpu=%.3fs max_rss=%d (+%d) counts=%s", name,
+                         record["wall_time"], record["cpu_time"], record["max_rss"], record["max_rss_growth"],
+                         record["counts"])
+
+    def write(self, filename):
+        """Save the report as JSON.
+
+        Parameters
+        ----------
+        filename : `str`
+            Name of the report file.
+        """
+        report = {"start": self._start,
+                  "wall_time": time.time() - self._start,
+                  "max_rss": max_rss(),
+                  "children_max_rss": max_rss(children=True),
+                  "stages": self.stages}
+        with open(filename, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+def file_size(filename):
+    """Return size of a file in bytes or 0 if it does not exist.
+    """
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
@@ -0,0 +1,411 @@
+"""Loading of QuantumGraphs, whole or a task node at a time.
+
+Besides pickled QuantumGraphs, the loader reads QuantumGraph streams: quantum
+archives (see `bps_archive`) with one pickled task node per task label and
+the QuantumGraph's own attributes under the empty key.  Task nodes of a
+stream are unpickled one at a time, and the ones not selected by label are
+not unpickled at all.  DatasetRefs are stored once in a table of the stream
+shared by all task nodes, split into chunks unpickled when first needed.
+
+A plain pickle can only be unpickled whole, so selecting tasks and quanta
+of one bounds the memory of what is kept, not of loading.  Loading bounded
+by the selection needs a stream, converted once by `convert_qgraph` (see
+make_qgraph_stream.py), which unpickles the QuantumGraph and releases task
+nodes as they are written.
+"""
+
+import io
+import logging
+import pickle
+
+from lsst.pipe.base.graph import QuantumGraph
+
+try:
+    from lsst.pipe.base.graph import QuantumGraphTaskNodes
+except ImportError:
+    from lsst.pipe.base.graph import QuantumGraphNodes
+
+from bps_archive import QuantumArchive, QuantumArchiveWriter, is_quantum_archive
+
+# Archive key of QuantumGraph attributes in QuantumGraph streams.
+GRAPH_KEY = ''
+
+# Archive key of the contents of QuantumGraph streams: names of the tasks
+# (see `task_names`) and size of chunks of the DatasetRef table.
+CONTENTS_KEY = '\0contents'
+
+# Prefix of archive keys of chunks of the DatasetRef table, other keys
+# starting with NUL are reserved as well.
+REFS_PREFIX = '\0refs:'
+
+# Number of DatasetRefs in a chunk of the table.
+REF_CHUNK_SIZE = 4096
+
+
+def make_single_qgnode(taskDef, quanta):
+    try:
+        qnode = QuantumGraphTaskNodes(taskDef, quanta)
+    except NameError:
+        qnode = QuantumGraphNodes(taskDef, quanta)
+    return qnode
+
+
+def task_label(taskDef):
+    """Return label of a task, the last two components of its name if not set
+
+    Parameters
+    ----------
+    taskDef : `TaskDef`
+        Task definition
+
+    Returns
+    -------
+    label : `str`
+        Task label
+    """
+    label = getattr(taskDef, 'label', None)
+    if not label:
+        label = '.'.join(taskDef.taskName.split('.')[-2:])
+    return label
+
+
+def task_names(taskDef):
+    """Return names a task can be selected by
+
+    Parameters
+    ----------
+    taskDef : `TaskDef`
+        Task definition
+
+    Returns
+    -------
+    names : `tuple` of `str`
+        Task label and the last two components of task's name (the label
+        of task nodes in science graphs)
+    """
+    return task_label(taskDef), '.'.join(taskDef.taskName.split('.')[-2:])
+
+
+def label_matches(taskDef, labels):
+    """Test if a task is selected by label
+
+    Parameters
+    ----------
+    taskDef : `TaskDef`
+        Task definition
+    labels : container of `str`
+        Selected task labels or short task names (see `task_names`)
+
+    Returns
+    -------
+    matches : `bool`
+        True if any name of the task is among the labels
+    """
+    return any(name in labels for name in task_names(taskDef))
+
+
+def dataid_predicate(expression):
+    """Make dataId predicate from a list of key=value pairs
+
+    Parameters
+    ----------
+    expression : `str`
+        Comma separated key=value pairs, e.g., "tract=0,patch=69"
+
+    Returns
+    -------
+    predicate : callable
+        Function returning True for dataIds with all the given values
+        (compared as strings), keys missing in a dataId do not match
+    """
+    wanted = {}
+    for item in expression.split(','):
+        key, value = item.split('=', 1)
+        wanted[key.strip()] = value.strip()
+
+    def predicate(dataId):
+        return all(key in dataId and str(dataId[key]) == value for key, value in wanted.items())
+
+    return predicate
+
+
+def quantum_matches(quantum, dataIdPredicate):
+    """Test if any output (input if no outputs) of a quantum matches predicate
+
+    Parameters
+    ----------
+    quantum : `Quantum`
+        Quantum to test
+    dataIdPredicate : callable
+        Function of a dataId returning True for selected datasets
+
+    Returns
+    -------
+    matches : `bool`
+        True if the dataId of any output (input) matches
+    """
+    refs = quantum.outputs if quantum.outputs else quantum.predictedInputs
+    return any(dataIdPredicate(dsRef.dataId) for dsRefs in refs.values() for dsRef in dsRefs)
+
+
+def select_quanta(nodes, dataIdPredicate):
+    """Keep quanta with any output (input if no outputs) matching predicate
+
+    Parameters
+    ----------
+    nodes : QuantumGraph task nodes
+        Task node to filter
+    dataIdPredicate : callable
+        Function of a dataId returning True for selected datasets
+
+    Returns
+    -------
+    nodes : QuantumGraph task nodes or None
+        The same task node if all quanta are selected, a new one with the
+        selected quanta, or None if no quantum is selected
+    """
+    quanta = [quantum for quantum in nodes.quanta if quantum_matches(quantum, dataIdPredicate)]
+    if len(quanta) == len(nodes.quanta):
+        return nodes
+    if not quanta:
+        return None
+    return make_single_qgnode(nodes.taskDef, quanta)
+
+
+def iter_qgraph(qgraph_filename, labels=None, dataIdPredicate=None):
+    """Iterate over task nodes of a QuantumGraph
+
+    Parameters
+    ----------
+    qgraph_filename : `str`
+        Pickled QuantumGraph or QuantumGraph stream
+    labels : container of `str`, optional
+        Labels of tasks to load (see `label_matches`), all if not given
+    dataIdPredicate : callable, optional
+        Function of a dataId selecting quanta (see `select_quanta`)
+
+    Yields
+    ------
+    nodes : QuantumGraph task nodes
+        Selected task nodes with selected quanta, task nodes without any
+        are skipped
+    """
+    return _select(_iter_task_nodes(qgraph_filename, labels), labels, dataIdPredicate)
+
+
+def _select(taskNodes, labels, dataIdPredicate):
+    for nodes in taskNodes:
+        if labels is not None and not label_matches(nodes.taskDef, labels):
+            continue
+        if dataIdPredicate is not None:
+            nodes = select_quanta(nodes, dataIdPredicate)
+            if nodes is None:
+                continue
+        yield nodes
+
+
+def _iter_task_nodes(qgraph_filename, labels):
+    if is_quantum_archive(qgraph_filename):
+        with QuantumArchive(qgraph_filename) as archive:
+            contents = archive.load(CONTENTS_KEY) if CONTENTS_KEY in archive.keys() else {}
+            names = contents.get('tasks', {})
+            refTable = _RefTable(archive, contents.get('ref_chunk_size'))
+            for key in archive.keys():
+                if key == GRAPH_KEY or key.startswith('\0'):
+                    continue
+                # task nodes of streams without names are checked once loaded
+                if labels is not None and key in names and not any(name in labels for name in names[key]):
+                    continue
+                yield _StreamUnpickler(io.BytesIO(archive.read(key)), refTable).load()
+    else:
+        for nodes in _consume(_load_pickle(qgraph_filename)):
+            yield nodes
+
+
+def _consume(qgraph):
+    # release task nodes as soon as they are consumed
+    for i in range(len(qgraph)):
+        nodes = qgraph[i]
+        qgraph[i] = None
+        yield nodes
+
+
+def _load_pickle(qgraph_filename):
+    with open(qgraph_filename, 'rb') as pickleFile:
+        qgraph = pickle.load(pickleFile)
+    return qgraph
+
+
+def read_qgraph(qgraph_filename, labels=None, dataIdPredicate=None):
+    """Read QuantumGraph, optionally only selected tasks and quanta
+
+    Parameters
+    ----------
+    qgraph_filename : `str`
+        Pickled QuantumGraph or QuantumGraph stream
+    labels : container of `str`, optional
+        Labels of tasks to load (see `label_matches`), all if not given
+    dataIdPredicate : callable, optional
+        Function of a dataId selecting quanta (see `select_quanta`)
+
+    Returns
+    -------
+    qgraph : QuantumGraph
+        QuantumGraph with the selected task nodes
+    """
+    qgraph = QuantumGraph()
+    if is_quantum_archive(qgraph_filename):
+        with QuantumArchive(qgraph_filename) as archive:
+            if GRAPH_KEY in archive.keys():
+                qgraph.__dict__.update(archive.load(GRAPH_KEY))
+        taskNodes = _iter_task_nodes(qgraph_filename, labels)
+    else:
+        original = _load_pickle(qgraph_filename)
+        if labels is None and dataIdPredicate is None:
+            return original
+        qgraph.__dict__.update(getattr(original, '__dict__', {}))
+        taskNodes = _consume(original)
+    qgraph.extend(_select(taskNodes, labels, dataIdPredicate))
+    logging.info("selected task nodes=%d quanta=%d", len(qgraph), sum(len(nodes.quanta) for nodes in qgraph))
+    return qgraph
+
+
+def write_qgraph_stream(qgraph, filename, attributes=None):
+    """Save QuantumGraph as a stream of task nodes
+
+    DatasetRefs used by quanta are pickled once into the ref table of the
+    stream, task nodes refer to them.  The refs are kept in memory until
+    the stream is written.
+
+    Parameters
+    ----------
+    qgraph : QuantumGraph or iterable of task nodes
+        QuantumGraph to save
+    filename : `str`
+        Name of the stream file
+    attributes : `dict`, optional
+        QuantumGraph attributes, defaults to the ones of qgraph
+
+    Returns
+    -------
+    count : `int`
+        Number of task nodes saved
+
+    Raises
+    ------
+    `ValueError`
+        If task labels are not unique
+    """
+    if attributes is None:
+        attributes = dict(getattr(qgraph, '__dict__', {}))
+    refIds = {}
+    # registered refs are kept alive so that their ids stay unique
+    refs = []
+    chunks = 0
+    names = {}
+    with QuantumArchiveWriter(filename) as archive:
+        archive.add(GRAPH_KEY, pickle.dumps(attributes))
+        for nodes in qgraph:
+            for quantum in nodes.quanta:
+                for refMap in (quantum.predictedInputs, quantum.outputs):
+                    for dsRefs in refMap.values():
+                        for dsRef in dsRefs:
+                            if id(dsRef) not in refIds:
+                                refIds[id(dsRef)] = len(refs)
+                                refs.append(dsRef)
+            label = task_label(nodes.taskDef)
+            data = io.BytesIO()
+            _StreamPickler(data, refIds).dump(nodes)
+            archive.add(label, data.getvalue())
+            names[label] = task_names(nodes.taskDef)
+            while len(refs) >= (chunks + 1) * REF_CHUNK_SIZE:
+                chunks = _add_ref_chunk(archive, refs, chunks)
+        while len(refs) > chunks * REF_CHUNK_SIZE:
+            chunks = _add_ref_chunk(archive, refs, chunks)
+        archive.add(CONTENTS_KEY, pickle.dumps({'tasks': names, 'ref_chunk_size': REF_CHUNK_SIZE}))
+    return len(names)
+
+
+def convert_qgraph(qgraph_filename, filename, labels=None, dataIdPredicate=None):
+    """Convert QuantumGraph to a stream, optionally only selected tasks and quanta
+
+    A pickled QuantumGraph is unpickled once and its task nodes are released
+    as they are written, so no second copy of the graph is made.
+
+    Parameters
+    ----------
+    qgraph_filename : `str`
+        Pickled QuantumGraph or QuantumGraph stream
+    filename : `str`
+        Name of the stream file
+    labels : container of `str`, optional
+        Labels of tasks to save (see `label_matches`), all if not given
+    dataIdPredicate : callable, optional
+        Function of a dataId selecting quanta (see `select_quanta`)
+
+    Returns
+    -------
+    count : `int`
+        Number of task nodes saved
+    """
+    if is_quantum_archive(qgraph_filename):
+        with QuantumArchive(qgraph_filename) as archive:
+            attributes = archive.load(GRAPH_KEY) if GRAPH_KEY in archive.keys() else {}
+        taskNodes = _iter_task_nodes(qgraph_filename, labels)
+    else:
+        original = _load_pickle(qgraph_filename)
+        attributes = dict(getattr(original, '__dict__', {}))
+        taskNodes = _consume(original)
+        del original
+    return write_qgraph_stream(_select(taskNodes, labels, dataIdPredicate), filename, attributes)
+
+
+def _add_ref_chunk(archive, refs, chunk):
+    """Save a chunk of the ref table, return number of saved chunks.
+    """
+    archive.add(REFS_PREFIX + str(chunk),
+                pickle.dumps(refs[chunk * REF_CHUNK_SIZE:(chunk + 1) * REF_CHUNK_SIZE]))
+    return chunk + 1
+
+
+class _StreamPickler(pickle.Pickler):
+    """Pickler replacing registered DatasetRefs with their index in the table.
+    """
+
+    def __init__(self, file, refIds):
+        super().__init__(file)
+        self._refIds = refIds
+
+    def persistent_id(self, obj):
+        return self._refIds.get(id(obj))
+
+
+class _RefTable(object):
+    """DatasetRefs of a stream, chunks are unpickled when first needed.
+
+    Refs are shared by all task nodes loaded with the same table.
+    """
+
+    def __init__(self, archive, chunkSize):
+        self._archive = archive
+        self._chunkSize = chunkSize
+        self._chunks = {}
+
+    def get(self, index):
+        chunk, offset = divmod(index, self._chunkSize)
+        refs = self._chunks.get(chunk)
+        if refs is None:
+            refs = self._chunks[chunk] = self._archive.load(REFS_PREFIX + str(chunk))
+        return refs[offset]
+
+
+class _StreamUnpickler(pickle.Unpickler):
+    """Unpickler looking DatasetRefs up in the ref table of a stream.
+    """
+
+    def __init__(self, file, refTable):
+        super().__init__(file)
+        self._refTable = refTable
+
+    def persistent_load(self, pid):
+        return self._refTable.get(pid)
@@ -0,0 +1,154 @@
+"""Bulk lookup of datasets in a butler's SQLite registry.
+
+Looks datasets up directly in the registry database configured in the
+butler yaml file (``registry.db``), many dataIds per query, so checking the
+outputs of a whole QuantumGraph takes a few queries per dataset type instead
+of one per dataset.
+
+The lookup expects the Gen3 registry schema: a ``Dataset`` table with
+``dataset_type_name`` and one column per dimension, and a
+``DatasetCollection`` table associating datasets with collections.
+"""
+
+import logging
+import os
+import sqlite3
+
+import yaml
+
+# Number of dataIds inserted into the temporary table at once
+BATCH_SIZE = 10000
+
+
+class _ConfigLoader(yaml.SafeLoader):
+    """YAML loader keeping names of !include'd files instead of their content.
+    """
+
+
+_ConfigLoader.add_constructor('!include', lambda loader, node: loader.construct_scalar(node))
+
+
+def registry_db_path(butlerConfig):
+    """Return name of the SQLite registry database of a butler
+
+    Parameters
+    ----------
+    butlerConfig : `str`
+        Butler yaml file, <butlerRoot> in it stands for its directory
+
+    Returns
+    -------
+    dbPath : `str`
+        Name of the database file
+
+    Raises
+    ------
+    `ValueError`
+        If the registry is not a SQLite database
+    """
+    with open(butlerConfig) as f:
+        config = yaml.load(f, Loader=_ConfigLoader)
+    butlerRoot = os.path.dirname(os.path.abspath(butlerConfig))
+    db = config['registry']['db'].replace('<butlerRoot>', butlerRoot)
+    if not db.startswith('sqlite:///'):
+        raise ValueError("Registry of %s is not a SQLite database: %s" % (butlerConfig, db))
+    return db[len('sqlite:///'):]
+
+
+class RegistryLookup(object):
+    """Read-only lookup of datasets in a SQLite registry
+
+    Parameters
+    ----------
+    dbPath : `str`
+        Name of the registry database file (see `registry_db_path`)
+    batchSize : `int`, optional
+        Number of dataIds inserted into the temporary table at once
+    """
+
+    def __init__(self, dbPath, batchSize=BATCH_SIZE):
+        self.dbPath = dbPath
+        self.batchSize = batchSize
+        self._conn = sqlite3.connect('file:%s?mode=ro' % dbPath, uri=True)
+        # temporary tables live in memory, the database itself is not modified
+        self._conn.execute("PRAGMA temp_store = MEMORY")
+        tables = {row[0] for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'Dataset' not in tables:
+            self._conn.close()
+            raise ValueError("%s has no Dataset table" % dbPath)
+        self._hasCollections = 'DatasetCollection' in tables
+        self._columns = {row[1] for row in self._conn.execute("PRAGMA table_info(Dataset)")}
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def existing(self, dsKeys, collection=None):
+        """Find which datasets exist in the registry
+
+        Parameters
+        ----------
+        dsKeys : iterable of `tuple`
+            Datasets as (dataset type name, dataId) pairs, dataIds are
+            hashable mappings or iterables of (key, value) pairs (e.g.,
+            frozensets of dataId items, see `bps_funcs.dataset_key`)
+        collection : `str`, optional
+            Look only for datasets in this collection
+
+        Returns
+        -------
+        found : `set`
+            The given dataset keys of the existing datasets
+        """
+        if collection is not None and not self._hasCollections:
+            logging.warning("registry has no DatasetCollection table, collection %s ignored", collection)
+            collection = None
+        groups = {}
+        for dsKey in dsKeys:
+            dataId = dict(dsKey[1])
+            groups.setdefault((dsKey[0], tuple(sorted(dataId))), []).append((dsKey, dataId))
+
+        found = set()
+        for (typeName, dimensions), group in groups.items():
+            missing = [name for name in dimensions if name not in self._columns]
+            if missing:
+                logging.warning("registry has no %s columns, %d %s datasets assumed missing",
+                                ','.join(missing), len(group), typeName)
+                continue
+            for start in range(0, len(group), self.batchSize):
+                batch = group[start:start + self.batchSize]
+                for index in self._find(typeName, dimensions, [dataId for _, dataId in batch], collection):
+                    found.add(batch[index][0])
+        logging.info("datasets=%d existing=%d queried types=%d", sum(len(g) for g in groups.values()),
+                     len(found), len(groups))
+        return found
+
+    def _find(self, typeName, dimensions, dataIds, collection):
+        """Return indexes of the existing datasets of a single type.
+        """
+        names = ['d%d' % i for i in range(len(dimensions))]
+        self._conn.execute("DROP TABLE IF EXISTS temp.wanted")
+        self._conn.execute("CREATE TEMP TABLE wanted (idx INTEGER PRIMARY KEY%s)" %
+                           ''.join(', %s' % name for name in names))
+        self._conn.executemany("INSERT INTO temp.wanted VALUES (?%s)" % (', ?' * len(names)),
+                               ([index] + [_sql_value(dataId[key]) for key in dimensions]
+                                for index, dataId in enumerate(dataIds)))
+        query = "SELECT DISTINCT w.idx FROM temp.wanted w JOIN Dataset d ON d.dataset_type_name = ?"
+        params = [typeName]
+        for key, name in zip(dimensions, names):
+            query += ' AND d."%s" = w.%s' % (key, name)
+        if collection is not None:
+            query += " JOIN DatasetCollection c ON c.dataset_id = d.dataset_id AND c.collection = ?"
+            params.append(collection)
+        return [row[0] for row in self._conn.execute(query, params)]
+
+
+def _sql_value(value):
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
@@ -0,0 +1,212 @@
+"""Resource requirements of quanta.
+
+A resource model gives memory (MB), number of cores, and runtime (seconds)
+of quanta by task label, optionally overridden for quanta with matching
+dataIds.  It is read either from YAML::
+
+    default:
+      memory: 2048
+      cpus: 1
+    tasks:
+      measureCoaddSources:
+        memory: 8192
+        runtime: 1200
+        overrides:
+          - dataId: "tract=0,patch=69"
+            memory: 16384
+
+or from CSV with a row per task label and override (label ``default`` for
+the default values, empty cells for values not given)::
+
+    label,dataId,memory,cpus,runtime
+    default,,2048,1,
+    measureCoaddSources,,8192,,1200
+    measureCoaddSources,"tract=0,patch=69",16384,,
+
+Memory and cores become HTCondor requests of the jobs.  Runtime only guides
+clustering of quanta and job priorities, it is not enforced as a walltime
+limit.
+
+Labels are either task labels or the short task names used as labels of
+the science graph nodes.  Overrides match quanta by their outputs (see
+`bps_qgraph.quantum_matches`), later overrides take precedence.
+"""
+
+import csv
+import math
+
+import yaml
+
+from bps_qgraph import dataid_predicate, quantum_matches, task_names
+
+# Resources of a quantum in the model
+RESOURCES = ('memory', 'cpus', 'runtime')
+
+
+class ResourceModel(object):
+    """Resource requirements of quanta by task label
+
+    Parameters
+    ----------
+    default : `dict`, optional
+        Resources of quanta of tasks not in the model
+    tasks : `dict`, optional
+        Resources keyed by task label, each optionally with a list of
+        overrides under 'overrides', dictionaries of resources with a
+        dataId predicate under 'predicate'
+
+    Raises
+    ------
+    `ValueError`
+        If a resource is unknown or not a number
+    """
+
+    def __init__(self, default=None, tasks=None):
+        self.default = _resources(default or {})
+        self.tasks = {}
+        for label, entry in (tasks or {}).items():
+            overrides = [(override['predicate'], _resources(override))
+                         for override in entry.get('overrides', [])]
+            self.tasks[label] = (_resources(entry), overrides)
+
+    @classmethod
+    def from_file(cls, filename):
+        """Read resource model from YAML or CSV file
+
+        Parameters
+        ----------
+        filename : `str`
+            File with the model, CSV if its extension is .csv
+
+        Returns
+        -------
+        model : `ResourceModel`
+            Resource model
+        """
+        if filename.lower().endswith('.csv'):
+            return cls._from_csv(filename)
+        with open(filename) as f:
+            config = yaml.safe_load(f) or {}
+        tasks = {}
+        for label, entry in (config.get('tasks') or {}).items():
+            entry = dict(entry)
+            entry['overrides'] = [dict(override, predicate=_predicate(override.get('dataId')))
+                                  for override in entry.get('overrides', [])]
+            tasks[label] = entry
+        return cls(config.get('default'), tasks)
+
+    @classmethod
+    def _from_csv(cls, filename):
+        default = {}
+        tasks = {}
+        with open(filename, newline='') as f:
+            for row in csv.DictReader(f):
+                label = row['label'].strip()
+                values = {key: row[key] for key in RESOURCES if row.get(key, '').strip()}
+                dataId = (row.get('dataId') or '').strip()
+                if dataId:
+                    values['predicate'] = dataid_predicate(dataId)
+                    tasks.setdefault(label, {}).setdefault('overrides', []).append(values)
+                elif label == 'default':
+                    default.update(values)
+                else:
+                    tasks.setdefault(label, {}).update(values)
+        return cls(default, tasks)
+
+    def quantum_resources(self, taskDef, quantum):
+        """Return resources of a single quantum
+
+        Parameters
+        ----------
+        taskDef : `TaskDef`
+            Task definition
+        quantum : `Quantum`
+            Quantum of the task
+
+        Returns
+        -------
+        resources : `dict`
+            Resources given by the model, keyed by name (see `RESOURCES`)
+        """
+        resources = dict(self.default)
+        entry = next((self.tasks[name] for name in task_names(taskDef) if name in self.tasks), None)
+        if entry is not None:
+            values, overrides = entry
+            resources.update(values)
+            for predicate, values in overrides:
+                if quantum_matches(quantum, predicate):
+                    resources.update(values)
+        return resources
+
+    def cluster_resources(self, taskDef, quanta):
+        """Return resources of a job executing quanta one after another
+
+        Parameters
+        ----------
+        taskDef : `TaskDef`
+            Task definition
+        quanta : `list`
+            Quanta of the task
+
+        Returns
+        -------
+        resources : `dict`
+            Largest memory and number of cores, and total runtime (rounded
+            up to whole seconds) of the quanta, for resources given by
+            the model
+        """
+        cluster = {}
+        for quantum in quanta:
+            for key, value in self.quantum_resources(taskDef, quantum).items():
+                if key == 'runtime':
+                    cluster[key] = cluster.get(key, 0) + value
+                else:
+                    cluster[key] = max(cluster.get(key, value), value)
+        if 'runtime' in cluster:
+            cluster['runtime'] = int(math.ceil(cluster['runtime']))
+        return cluster
+
+    def runtime_estimate(self, default=None):
+        """Make runtime estimate for clustering quanta by runtime
+
+        Parameters
+        ----------
+        default : `float`, optional
+            Runtime of quanta the model gives no runtime for
+
+        Returns
+        -------
+        estimate : callable
+            Function taking taskDef and quantum and returning estimated
+            runtime of the quantum in seconds
+        """
+        def estimate(taskDef, quantum):
+            return self.quantum_resources(taskDef, quantum).get('runtime', default)
+
+        return estimate
+
+
+def _resources(values):
+    """Check and convert values of resources.
+    """
+    resources = {}
+    for key, value in values.items():
+        if key in ('overrides', 'predicate', 'dataId'):
+            continue
+        if key not in RESOURCES:
+            raise ValueError("Unknown resource '%s'" % key)
+        try:
+            resources[key] = float(value) if key == 'runtime' else int(value)
+        except (TypeError, ValueError):
+            raise ValueError("Resource %s is not a number: %r" % (key, value))
+    return resources
+
+
+def _predicate(dataId):
+    """Make dataId predicate of an override given as a string or mapping.
+    """
+    if not dataId:
+        raise ValueError("Resource override without dataId")
+    if not isinstance(dataId, str):
+        dataId = ','.join('%s=%s' % item for item in dataId.items())
+    return dataid_predicate(dataId)
@@ -0,0 +1,229 @@
+"""Synthetic QuantumGraphs made of lightweight stand-ins for LSST objects.
+
+The stand-ins provide only the attributes the submission side uses
+(`taskDef`, `quanta`, `predictedInputs`, `outputs`, and
+`DatasetRef.datasetType/dataId`), so graphs shaped like the HSC pipeline
+can be generated and pushed through `create_science_graph`,
+`create_workflow_graph`, and `Daxgen` without the LSST stack or a butler.
+
+The generated pipeline follows the data flow of `run_demo.sh`::
+
+    isr -> characterizeImage -> calibrate -> makeWarp -> assembleCoadd ->
+    detectCoaddSources -> mergeDetections -> deblend -> measure ->
+    mergeMeasurements -> forcedPhotCoadd
+
+with per-detector tasks fanning into per-patch warps and coadds and
+per-filter patch tasks fanning into per-patch merges.
+"""
+
+import math
+
+
+class SynthConfig(object):
+    """Stand-in for a task config.
+    """
+
+    def __init__(self, label):
+        self.label = label
+
+    def saveToStream(self, outfile, root="config"):
+        outfile.write("%s.label = %r\n" % (root, self.label))
+
+
+class SynthTaskDef(object):
+    """Stand-in for `lsst.pipe.base.TaskDef`.
+    """
+
+    def __init__(self, label, taskName):
+        self.label = label
+        self.taskName = taskName
+        self.taskClass = None
+        self.config = SynthConfig(label)
+
+
+class SynthDatasetType(object):
+    """Stand-in for `lsst.daf.butler.DatasetType`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+class SynthDatasetRef(object):
+    """Stand-in for `lsst.daf.butler.DatasetRef`.
+    """
+
+    def __init__(self, datasetType, dataId):
+        self.datasetType = datasetType
+        self.dataId = dataId
+
+
+class SynthQuantum(object):
+    """Stand-in for `lsst.daf.butler.Quantum`.
+    """
+
+    def __init__(self, predictedInputs, outputs):
+        self.predictedInputs = predictedInputs
+        self.outputs = outputs
+        self.actualInputs = {}
+        self.id = None
+        self.run = None
+        self.task = None
+
+
+class SynthTaskNodes(object):
+    """Stand-in for `lsst.pipe.base.graph.QuantumGraphTaskNodes`.
+    """
+
+    def __init__(self, taskDef, quanta):
+        self.taskDef = taskDef
+        self.quanta = quanta
+
+
+class SynthQuantumGraph(list):
+    """Stand-in for `lsst.pipe.base.graph.QuantumGraph`.
+    """
+    pass
+
+
+class _Pipeline(object):
+    """Helper creating quanta of the synthetic pipeline.
+    """
+
+    def __init__(self):
+        self.datasetTypes = {}
+        self.tasks = []
+
+    def ref(self, name, **dataId):
+        datasetType = self.datasetTypes.get(name)
+        if datasetType is None:
+            datasetType = self.datasetTypes[name] = SynthDatasetType(name)
+        return SynthDatasetRef(datasetType, dataId)
+
+    def task(self, label, taskName):
+        nodes = SynthTaskNodes(SynthTaskDef(label, taskName), [])
+        self.tasks.append(nodes)
+        return nodes.quanta
+
+    @staticmethod
+    def quantum(inputs, outputs):
+        predictedInputs = {}
+        for ref in inputs:
+            predictedInputs.setdefault(ref.datasetType.name, []).append(ref)
+        outs = {}
+        for ref in outputs:
+            outs.setdefault(ref.datasetType.name, []).append(ref)
+        return SynthQuantum(predictedInputs, outs)
+
+
+def generate_qgraph(nquanta=None, visits=None, detectors=16, filters=3, depth=15):
+    """Generate synthetic QuantumGraph shaped like the HSC pipeline.
+
+    Parameters
+    ----------
+    nquanta : `int`, optional
+        Approximate number of quanta, used to derive the number of visits
+        if visits is not given.
+    visits : `int`, optional
+        Number of visits.
+    detectors : `int`, optional
+        Number of detectors per visit (fan-in of warps is detectors // 4).
+    filters : `int`, optional
+        Number of filters, visits are assigned to filters round-robin.
+    depth : `int`, optional
+        Average number of visits covering a patch (fan-in of coadds times
+        number of filters).
+
+    Returns
+    -------
+    qgraph : `SynthQuantumGraph`
+        List of task nodes in pipeline order.
+    """
+    patchesPerVisit = max(1, detectors // 4)
+    if visits is None:
+        if nquanta is None:
+            raise ValueError("Either nquanta or visits is required")
+        # quanta per visit: isr, characterize, and calibrate per detector,
+        # warps per patch, and patch level tasks spread over the visits
+        perVisit = 3 * detectors + patchesPerVisit + patchesPerVisit * (4 * filters + 2) / depth
+        visits = max(filters, int(math.ceil(nquanta / perVisit)))
+    patches = max(1, int(round(visits * patchesPerVisit / depth)))
+
+    p = _Pipeline()
+    isr = p.task("isr", "lsst.ip.isr.isrTask.IsrTask")
+    cit = p.task("cit", "lsst.pipe.tasks.characterizeImage.CharacterizeImageTask")
+    ct = p.task("ct", "lsst.pipe.tasks.calibrate.CalibrateTask")
+    mwt = p.task("mwt", "lsst.pipe.tasks.makeCoaddTempExp.MakeWarpTask")
+    cwact = p.task("cwact", "lsst.pipe.tasks.assembleCoadd.CompareWarpAssembleCoaddTask")
+    dcst = p.task("dcst", "lsst.pipe.tasks.multiBand.DetectCoaddSourcesTask")
+    mdt = p.task("mdt", "lsst.pipe.tasks.mergeDetections.MergeDetectionsTask")
+    dbt = p.task("dbt", "lsst.pipe.tasks.deblendCoaddSourcesPipeline.DeblendCoaddSourcesSingleTask")
+    mmcst = p.task("mmcst", "lsst.pipe.tasks.multiBand.MeasureMergedCoaddSourcesTask")
+    mmt = p.task("mmt", "lsst.pipe.tasks.mergeMeasurements.MergeMeasurementsTask")
+    fpct = p.task("fpct", "lsst.meas.base.forcedPhotCoadd.ForcedPhotCoaddTask")
+
+    # visit level processing, every visit covers a window of patches
+    warpsByPatch = {}
+    for visit in range(visits):
+        band = "f%d" % (visit % filters)
+        first = (visit * 7) % patches
+        calexps = {}
+        for det in range(detectors):
+            isr.append(p.quantum(
+                [p.ref("raw", visit=visit, detector=det), p.ref("bias", detector=det),
+                 p.ref("flat", detector=det, abstract_filter=band)],
+                [p.ref("postISRCCD", visit=visit, detector=det)]))
+            cit.append(p.quantum(
+                [p.ref("postISRCCD", visit=visit, detector=det)],
+                [p.ref("icExp", visit=visit, detector=det), p.ref("icSrc", visit=visit, detector=det)]))
+            ct.append(p.quantum(
+                [p.ref("icExp", visit=visit, detector=det), p.ref("icSrc", visit=visit, detector=det),
+                 p.ref("ref_cat", htm7=(visit * detectors + det) % 97)],
+                [p.ref("calexp", visit=visit, detector=det), p.ref("src", visit=visit, detector=det)]))
+            patch = (first + det * patchesPerVisit // detectors) % patches
+            calexps.setdefault(patch, []).append(det)
+        for patch, dets in sorted(calexps.items()):
+            mwt.append(p.quantum(
+                [p.ref("calexp", visit=visit, detector=det) for det in dets] +
+                [p.ref("skyMap", skymap="hsc")],
+                [p.ref("deepCoadd_directWarp", visit=visit, patch=patch, skymap="hsc")]))
+            warpsByPatch.setdefault((patch, band), []).append(visit)
+
+    # patch level processing
+    bands = ["f%d" % i for i in range(filters)]
+    for patch in range(patches):
+        covered = [band for band in bands if (patch, band) in warpsByPatch]
+        if not covered:
+            continue
+        for band in covered:
+            cwact.append(p.quantum(
+                [p.ref("deepCoadd_directWarp", visit=visit, patch=patch, skymap="hsc")
+                 for visit in warpsByPatch[(patch, band)]] + [p.ref("skyMap", skymap="hsc")],
+                [p.ref("deepCoadd", patch=patch, abstract_filter=band, skymap="hsc")]))
+            dcst.append(p.quantum(
+                [p.ref("deepCoadd", patch=patch, abstract_filter=band, skymap="hsc")],
+                [p.ref("deepCoadd_det", patch=patch, abstract_filter=band, skymap="hsc"),
+                 p.ref("deepCoadd_calexp", patch=patch, abstract_filter=band, skymap="hsc")]))
+        mdt.append(p.quantum(
+            [p.ref("deepCoadd_det", patch=patch, abstract_filter=band, skymap="hsc") for band in covered],
+            [p.ref("deepCoadd_mergeDet", patch=patch, skymap="hsc")]))
+        for band in covered:
+            dbt.append(p.quantum(
+                [p.ref("deepCoadd_mergeDet", patch=patch, skymap="hsc"),
+                 p.ref("deepCoadd_calexp", patch=patch, abstract_filter=band, skymap="hsc")],
+                [p.ref("deepCoadd_deblendedFlux", patch=patch, abstract_filter=band, skymap="hsc")]))
+            mmcst.append(p.quantum(
+                [p.ref("deepCoadd_deblendedFlux", patch=patch, abstract_filter=band, skymap="hsc"),
+                 p.ref("deepCoadd_calexp", patch=patch, abstract_filter=band, skymap="hsc"),
+                 p.ref("skyMap", skymap="hsc")],
+                [p.ref("deepCoadd_meas", patch=patch, abstract_filter=band, skymap="hsc")]))
+        mmt.append(p.quantum(
+            [p.ref("deepCoadd_meas", patch=patch, abstract_filter=band, skymap="hsc") for band in covered],
+            [p.ref("deepCoadd_ref", patch=patch, skymap="hsc")]))
+        for band in covered:
+            fpct.append(p.quantum(
+                [p.ref("deepCoadd_ref", patch=patch, skymap="hsc"),
+                 p.ref("deepCoadd_calexp", patch=patch, abstract_filter=band, skymap="hsc")],
+                [p.ref("deepCoadd_forced_src", patch=patch, abstract_filter=band, skymap="hsc")]))
+
+    return SynthQuantumGraph(nodes for nodes in p.tasks if nodes.quanta)
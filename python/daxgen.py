@@ -1,6 +1,37 @@
+import collections
+import datetime
+import getpass
+import json
+import math
+import os
 import pickle
+import re
+from xml.sax.saxutils import escape as xml_escape, quoteattr
 import networkx as nx
-from Pegasus.DAX3 import ADAG, File, Job, Link, PFN
+from Pegasus.DAX3 import ADAG, DAX, File, Job, Link, PFN, Profile
+
+# DAX schema written by the streaming writer, the same one Pegasus.DAX3 uses.
+DAX_NAMESPACE = 'http://pegasus.isi.edu/schema/DAX'
+DAX_VERSION = '3.6'
+DAX_LOCATION = 'http://pegasus.isi.edu/schema/dax-3.6.xsd'
+
+# Job profiles set from task node attributes: attribute, namespace, key.
+# The pegasus runtime profile only guides Pegasus' runtime clustering, it is
+# not a walltime limit and jobs running longer are not removed.
+JOB_PROFILES = [
+    ('request_memory', 'condor', 'request_memory'),
+    ('request_cpus', 'condor', 'request_cpus'),
+    ('runtime', 'pegasus', 'runtime'),
+]
+
+# Profile holding job priorities (see Daxgen.prioritize).
+PRIORITY_PROFILE = ('dagman', 'PRIORITY')
+
+# Where output of jobs goes (see Daxgen.set_log_mode).
+LOG_MODES = ('files', 'kickstart', 'bundle')
+
+# Executable appending output of a job to a log bundle (bin/log_bundle.py).
+LOG_WRAPPER = 'log_bundle.py'
 
 
 class Daxgen(object):
@@ -8,19 +39,49 @@ class Daxgen(object):
 
     Parameters
     ----------
-    graph : `networkx.DiGraph`, optional
+    graph : `networkx.DiGraph` or `CompactGraph`, optional
         Graph representation of the workflow, defaults to an empty graph.
+    trusted : `bool`, optional
+        If True, the generator takes ownership of the graph instead of
+        copying it, and the existing node types (0 for files, 1 for tasks,
+        as set by `create_workflow_graph`) are used as they are instead of
+        being recomputed by bipartite coloring.  Untrusted compact graphs
+        are converted to `networkx.DiGraph` (see `CompactGraph.to_networkx`)
+        for the coloring.
+    validate : `bool`, optional
+        If True, a trusted graph is checked in a single pass over its edges
+        (see :meth:`validate`).
+
+    Raises
+    ------
+    `TypeError`
+        If an untrusted graph is neither a `networkx.DiGraph` nor can be
+        converted to one.
     """
 
-    def __init__(self, graph=None):
-        self.graph = graph.copy() if graph is not None else nx.DiGraph()
-        if self.graph:
-            self._label()
-            self.files = set([node_id for node_id in self.graph
-                              if self.graph.node[node_id]['node_type'] == 0])
-            self.tasks = set([node_id for node_id in self.graph
-                              if self.graph.node[node_id]['node_type'] == 1])
+    def __init__(self, graph=None, trusted=False, validate=False):
+        self.files = set()
+        self.tasks = set()
+        if graph is None:
+            self.graph = nx.DiGraph()
+        elif trusted:
+            self.graph = graph
+            if validate:
+                self.validate()
+        elif isinstance(graph, nx.DiGraph):
+            self.graph = graph.copy()
+            if self.graph:
+                self._label()
+        elif hasattr(graph, 'to_networkx'):
+            self.graph = graph.to_networkx()
+            if self.graph:
+                self._label()
+        else:
+            raise TypeError("Untrusted graph must be a networkx.DiGraph, not {0}.".format(
+                type(graph).__name__))
+        self._split()
         self.catalog = {}
+        self._opened = None
 
     def read(self, filename):
         """Read a persisted workflow.
@@ -30,7 +91,9 @@ class Daxgen(object):
         - GraphML,
         - JSON node-link,
         - GEXF,
-        - Python pickle.
+        - Python pickle,
+        - columnar graph file (see `bps_graphfile`), memory-mapped until
+          `close` is called.
 
         Parameters
         ----------
@@ -47,23 +110,69 @@ class Daxgen(object):
             'json': read_json,
             'gexf': nx.read_gexf,
             'gxf': nx.read_gexf,
-            'gml': nx.read_graphml,
-            'graphml': nx.read_graphml,
-            'pickle': read_pickle
+            'gml': read_graphml,
+            'graphml': read_graphml,
+            'pickle': read_pickle,
+            'bpsg': read_bpsg
         }
         ext = filename.split('.')[-1]
         try:
-            self.graph = methods[ext.lower()](filename)
+            method = methods[ext.lower()]
         except KeyError:
             raise ValueError("Format '{0}' is not supported yet.".format(ext))
+        self.close()
+        self.graph = method(filename)
+        if hasattr(self.graph, 'close'):
+            self._opened = self.graph
         if self.graph:
-            self._label()
-            self.files = set([v for v in self.graph
-                              if self.graph.node[v]['node_type'] == 0])
-            self.tasks = set([v for v in self.graph
-                              if self.graph.node[v]['node_type'] == 1])
+            # Compact graphs come from create_workflow_graph with node
+            # types already set.
+            if isinstance(self.graph, nx.DiGraph):
+                self._label()
+            else:
+                self.validate()
+        self._split()
+
+    def close(self):
+        """Release the file of a workflow read memory-mapped, if any.
 
-    def write_dax(self, filename='workflow.dax', name='workflow'):
+        The workflow graph can no longer be used afterwards.
+        """
+        if self._opened is not None:
+            self._opened.close()
+            self._opened = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def validate(self):
+        """Check that node types are set and files alternate with tasks.
+
+        Unlike bipartite coloring, the check relies on the existing node
+        types and visits every node and edge once.
+
+        Raises
+        ------
+        `ValueError`
+            If a node has no valid type or an edge connects two nodes of
+            the same type.
+        """
+        node_types = {}
+        for node_id in self.graph:
+            node_type = self.graph.node[node_id].get('node_type')
+            if node_type not in (0, 1):
+                raise ValueError("Node {0} has invalid type {1}.".format(node_id, node_type))
+            node_types[node_id] = node_type
+        for node_id, node_type in node_types.items():
+            for succ_id in self.graph.successors(node_id):
+                if node_types[succ_id] == node_type:
+                    raise ValueError("Graph is not bipartite, edge {0} -> {1} connects two {2}.".format(
+                        node_id, succ_id, 'files' if node_type == 0 else 'tasks'))
+
+    def write_dax(self, filename='workflow.dax', name='workflow', reduce=False):
         """Generate Pegasus abstract workflow (DAX).
 
         Parameters
@@ -72,6 +181,9 @@ class Daxgen(object):
             File to write the DAX to.
         name : `str`, optional
             Name of the DAX.
+        reduce : `bool`, optional
+            If True, dependencies implied by other ones are omitted (see
+            :meth:`dependencies`).
 
         Returns
         -------
@@ -88,99 +200,380 @@ class Daxgen(object):
         # Process file nodes.
         for file_id in self.files:
             attrs = self.graph.node[file_id]
-            try:
-                name = attrs['lfn']
-            except KeyError:
-                msg = 'Mandatory attribute "%s" is missing.'
-                raise AttributeError(msg.format('lfn'))
-            file_ = File(name)
-
-            # Add physical file names, if any.
-            urls = attrs.get('pfn')
-            if urls is not None:
-                urls = urls.split(',')
-                sites = attrs.get('sites')
-                if sites is None:
-                    sites = len(urls) * ['condorpool']
-                for url, site in zip(urls, sites):
-                    file_.addPFN(PFN(url, site))
-
-            self.catalog[attrs['lfn']] = file_
+            file_ = self._make_file(attrs)
+            self.catalog[file_.name] = file_
 
         # Add jobs to the DAX.
+        jobs = {}
         for task_id in self.tasks:
-            attrs = self.graph.node[task_id]
-            try:
-                name = attrs['exec_name']
-            except KeyError:
-                msg = 'Mandatory attribute "%s" is missing.'
-                raise AttributeError(msg.format('exec_name'))
-            label = '{name}_{id}'.format(name=name, id=task_id)
-            job = Job(name, id=task_id, node_label=label)
+            desc = self._describe_job(task_id, self.catalog)
+            job = Job(desc['name'], id=desc['id'], node_label=desc['label'])
 
             # Add job command line arguments replacing any file name with
             # respective Pegasus file object.
-            args = attrs.get('exec_args', [])
-            if args:
-                args = args.split()
-                lfns = list(set(self.catalog) & set(args))
-                if lfns:
-                    indices = [args.index(lfn) for lfn in lfns]
-                    for idx, lfn in zip(indices, lfns):
-                        args[idx] = self.catalog[lfn]
+            if desc['args']:
+                args = [self.catalog[arg] if is_file else arg
+                        for arg, is_file in desc['args']]
                 job.addArguments(*args)
 
-            # Specify job's inputs.
-            inputs = [file_id for file_id in self.graph.predecessors(task_id)]
-            for file_id in inputs:
-                attrs = self.graph.node[file_id]
-                is_ignored = attrs.get('ignore', False)
-                if not is_ignored:
-                    file_ = self.catalog[attrs['lfn']]
-                    job.uses(file_, link=Link.INPUT)
-
-            # Specify job's outputs
-            outputs = [file_id for file_id in self.graph.successors(task_id)]
-            for file_id in outputs:
-                attrs = self.graph.node[file_id]
-                is_ignored = attrs.get('ignore', False)
-                if not is_ignored:
-                    file_ = self.catalog[attrs['lfn']]
-                    job.uses(file_, link=Link.OUTPUT)
-
-                    streams = attrs.get('streams')
-                    if streams is not None:
-                        if streams & 1 != 0:
-                            job.setStdout(file_)
-                        if streams & 2 != 0:
-                            job.setStderr(file_)
-
-            # Provide default files to store stderr and stdout, if not
-            # specified explicitly.
-            if job.stderr is None:
-                file_ = File('{name}.out'.format(name=label))
-                job.uses(file_, link=Link.OUTPUT)
-                job.setStderr(file_)
-            if job.stdout is None:
-                file_ = File('{name}.err'.format(name=label))
-                job.uses(file_, link=Link.OUTPUT)
-                job.setStdout(file_)
+            for namespace, key, value in desc['profiles']:
+                job.addProfile(Profile(namespace, key, value))
+
+            # Specify job's inputs and outputs.
+            for lfn, link in desc['uses']:
+                file_ = self.catalog.get(lfn)
+                if file_ is None:
+                    file_ = File(lfn)
+                job.uses(file_, link=Link.INPUT if link == 'input' else Link.OUTPUT)
+                if lfn == desc['stdout']:
+                    job.setStdout(file_)
+                if lfn == desc['stderr']:
+                    job.setStderr(file_)
 
             dax.addJob(job)
+            jobs[task_id] = job
 
         # Add job dependencies to the DAX.
-        for task_id in self.tasks:
-            parents = set()
-            for file_id in self.graph.predecessors(task_id):
-                parents.update(self.graph.predecessors(file_id))
+        for task_id, parents in self.dependencies(reduce).items():
             for parent_id in parents:
-                dax.depends(parent=dax.getJob(parent_id),
-                            child=dax.getJob(task_id))
+                dax.depends(parent=jobs[parent_id], child=jobs[task_id])
 
         # Finally, write down the workflow in DAX format.
         with open(filename, 'w') as f:
             dax.writeXML(f)
 
+    def write_dax_stream(self, filename='workflow.dax', name='workflow', tasks=None, reduce=False):
+        """Generate Pegasus abstract workflow (DAX) without building it first.
+
+        Unlike :meth:`write_dax`, XML elements are written as the graph is
+        walked, so no `Pegasus.DAX3.ADAG` holding every file, job, and
+        dependency is kept in memory.  The only bookkeeping is the set of
+        logical file names and the (small) catalog of files with physical
+        file names needed by :meth:`write_rc`.  The output is equivalent to
+        the one of :meth:`write_dax`.
+
+        Parameters
+        ----------
+        filename : `str`
+            File to write the DAX to.
+        name : `str`, optional
+            Name of the DAX.
+        tasks : iterable of node ids, optional
+            Task nodes to include, defaults to all of them.  Dependencies
+            on jobs which are not included are omitted.
+        reduce : `bool`, optional
+            If True, dependencies implied by other ones are omitted (see
+            :meth:`dependencies`).
+
+        Raises
+        ------
+        `ValueError`
+            If either task or file node is missing mandatory attribute.
+        """
+        lfns = self._collect_files()
+        tasks = sorted(self.tasks) if tasks is None else sorted(tasks)
+        self._write_dax_stream(filename, name, tasks, lfns, self.dependencies(reduce))
+
+    def write_dax_hierarchy(self, filename='workflow.dax', name='workflow', partition='label', reduce=False):
+        """Generate hierarchical workflow made of sub-workflows.
+
+        Jobs are split into partitions (see :meth:`partition`), every
+        partition is written to its own DAX next to ``filename``.  The
+        top-level DAX at ``filename`` contains a DAX job per partition and
+        the dependencies between partitions, so Pegasus plans every
+        sub-workflow separately when it becomes ready to run.  Sub-workflow
+        DAXes are listed in the top-level DAX along with their physical
+        file names.
+
+        Parameters
+        ----------
+        filename : `str`
+            File to write the top-level DAX to.
+        name : `str`, optional
+            Name of the top-level DAX.
+        partition : `str` or `int`, optional
+            Partitioning scheme, see :meth:`partition`.
+        reduce : `bool`, optional
+            If True, dependencies implied by other ones are omitted from
+            the sub-workflows (see :meth:`dependencies`).
+
+        Returns
+        -------
+        filenames : `list` of `str`
+            Names of the sub-workflow DAXes.
+
+        Raises
+        ------
+        `ValueError`
+            If dependencies between the partitions are cyclic or either
+            task or file node is missing mandatory attribute.
+        """
+        parts = self.partition(partition)
+        owner = {}
+        for index, tasks in enumerate(parts.values()):
+            for task_id in tasks:
+                owner[task_id] = index
+        depends = [set() for _ in parts]
+        for task_id, parents in self.dependencies().items():
+            index = owner[task_id]
+            for parent_id in parents:
+                if owner[parent_id] != index:
+                    depends[index].add(owner[parent_id])
+        order = _topological_sort(range(len(parts)), lambda index: depends[index])
+        if order is None:
+            raise ValueError("Dependencies between partitions are cyclic.")
+
+        lfns = self._collect_files()
+        dependencies = self.dependencies(reduce)
+        root, ext = os.path.splitext(filename)
+        dax = ADAG(name)
+        filenames = []
+        labels = list(parts)
+        for index in order:
+            subname = '{0}_{1}{2}'.format(root, re.sub(r'[^\w.-]', '_', labels[index]), ext or '.dax')
+            self._write_dax_stream(subname, '{0}_{1}'.format(name, labels[index]),
+                                   sorted(parts[labels[index]]), lfns, dependencies)
+            filenames.append(subname)
+
+            file_ = File(os.path.basename(subname))
+            file_.addPFN(PFN('file://' + os.path.abspath(subname), 'local'))
+            dax.addFile(file_)
+            job = DAX(file_, id=_partition_id(index), node_label=labels[index])
+            if self.priorities:
+                priority = max(self.priorities[task_id] for task_id in parts[labels[index]])
+                job.addProfile(Profile(*(PRIORITY_PROFILE + (str(priority),))))
+            dax.addDAX(job)
+        for index in order:
+            for parent in sorted(depends[index]):
+                dax.depends(parent=dax.getJob(_partition_id(parent)),
+                            child=dax.getJob(_partition_id(index)))
+        with open(filename, 'w') as f:
+            dax.writeXML(f)
+        return filenames
+
+    def partition(self, how='label'):
+        """Split jobs into partitions.
+
+        Parameters
+        ----------
+        how : `str` or `int`, optional
+            Either 'label' to make a partition per task label (task nodes
+            without one are grouped by node label, or executable name),
+            so that tasks of the same class with different labels (which
+            may depend on each other) stay apart, or number of
+            partitions of (approximately) equal size.  Balanced partitions
+            are consecutive chunks of a depth-first topological order of
+            the jobs, so dependencies between them are acyclic and chains
+            of jobs tend to stay in the same partition.
+
+        Returns
+        -------
+        parts : `dict`
+            Task nodes keyed by partition name.
+
+        Raises
+        ------
+        `ValueError`
+            If the partitioning scheme is unknown or dependencies between
+            jobs are cyclic.
+        """
+        parts = {}
+        if how == 'label':
+            for task_id in sorted(self.tasks):
+                attrs = self.graph.node[task_id]
+                label = attrs.get('task_label') or attrs.get('label', attrs.get('exec_name'))
+                parts.setdefault(str(label), []).append(task_id)
+            return parts
+        try:
+            count = int(how)
+        except ValueError:
+            raise ValueError("Unknown partitioning scheme '{0}'.".format(how))
+        if count < 1:
+            raise ValueError("Number of partitions must be positive.")
+        dependencies = self.dependencies()
+        order = _topological_sort(sorted(self.tasks), lambda task_id: dependencies.get(task_id, ()),
+                                  depth_first=True)
+        if order is None:
+            raise ValueError("Dependencies between jobs are cyclic.")
+        size, extra = divmod(len(order), count)
+        start = 0
+        for index in range(min(count, len(order))):
+            end = start + size + (1 if index < extra else 0)
+            parts['part{0:04d}'.format(index)] = order[start:end]
+            start = end
+        return parts
+
+    def set_log_mode(self, mode='files', bundle='label', directory='logs'):
+        """Choose where output of jobs goes.
+
+        Modes are:
+
+        - 'files': stdout and stderr of every job are redirected to its own
+          ``<job label>.out`` and ``<job label>.err`` files which Pegasus
+          stages back, two files per job,
+        - 'kickstart': jobs write no files of their own, their output is
+          captured by Pegasus' kickstart in the job records of the submit
+          directory,
+        - 'bundle': jobs are run by the log wrapper (see `LOG_WRAPPER`)
+          appending their output to a log bundle shared by many jobs, with
+          an index of the jobs (see `bps_logs`).
+
+        In the 'bundle' mode the job's executable becomes the log wrapper,
+        which runs the original executable by its name, so the latter has
+        to be on the ``PATH`` of the worker nodes (it is no longer looked
+        up in the transformation catalog).
+
+        Parameters
+        ----------
+        mode : `str`, optional
+            One of `LOG_MODES`.
+        bundle : `str` or `int`, optional
+            Grouping of jobs into bundles, a bundle per partition (see
+            :meth:`partition`), i.e., either per task label or a number of
+            bundles.
+        directory : `str`, optional
+            Directory with the bundles, as seen by the jobs.
+
+        Raises
+        ------
+        `ValueError`
+            If the mode or the grouping is unknown.
+        """
+        if mode not in LOG_MODES:
+            raise ValueError("Unknown log mode '{0}'.".format(mode))
+        self._bundles = {}
+        if mode == 'bundle':
+            for name, tasks in self.partition(bundle).items():
+                path = os.path.join(directory, re.sub(r'[^\w.-]', '_', name))
+                for task_id in tasks:
+                    self._bundles[task_id] = path
+        self.log_mode = mode
+
+    def prioritize(self, weight='runtime', default=1):
+        """Prioritize jobs on the critical path.
+
+        Priority of a job is the length of the longest path from it to
+        the end of the workflow, the sum of weights of the jobs on the
+        path, so the scheduler prefers jobs starting long chains.  Once
+        set, priorities are written as a DAGMan priority profile of the
+        jobs (and of sub-workflows, see :meth:`write_dax_hierarchy`).
+
+        Parameters
+        ----------
+        weight : `str`, optional
+            Task node attribute holding job's weight (e.g., its estimated
+            runtime), all jobs weigh the same if None.
+        default : `float`, optional
+            Weight of jobs without the attribute, in the units of the
+            attribute, i.e., seconds for the runtime estimates set by
+            `assign_resources`.
+
+        Returns
+        -------
+        priorities : `dict`
+            Integer priorities keyed by task nodes.
+
+        Raises
+        ------
+        `ValueError`
+            If dependencies between jobs are cyclic.
+        """
+        dependencies = self.dependencies()
+        order = _topological_sort(sorted(self.tasks), lambda task_id: dependencies.get(task_id, ()))
+        if order is None:
+            raise ValueError("Dependencies between jobs are cyclic.")
+        lengths = {}
+        for task_id in reversed(order):
+            value = self.graph.node[task_id].get(weight) if weight is not None else None
+            lengths[task_id] = lengths.get(task_id, 0) + (default if value is None else value)
+            # Children are done, propagate the path to the parents.
+            for parent_id in dependencies.get(task_id, ()):
+                lengths[parent_id] = max(lengths.get(parent_id, 0), lengths[task_id])
+        self.priorities = {task_id: int(math.ceil(length)) for task_id, length in lengths.items()}
+        return self.priorities
+
+    def _collect_files(self):
+        """Catalog files with physical file names.
+
+        Returns
+        -------
+        lfns : `set` of `str`
+            Logical names of all files in the workflow.
+        """
+        lfns = set()
+        for file_id in self.files:
+            attrs = self.graph.node[file_id]
+            if attrs.get('pfn') is not None:
+                file_ = self._make_file(attrs)
+                self.catalog[file_.name] = file_
+            else:
+                try:
+                    lfns.add(attrs['lfn'])
+                except KeyError:
+                    msg = 'Mandatory attribute "%s" is missing.'
+                    raise AttributeError(msg.format('lfn'))
+        lfns.update(self.catalog)
+        return lfns
+
+    def _write_dax_stream(self, filename, name, tasks, lfns, dependencies):
+        """Write jobs and dependencies between them in DAX format.
+
+        Parameters
+        ----------
+        filename : `str`
+            File to write the DAX to.
+        name : `str`
+            Name of the DAX.
+        tasks : `list`
+            Task nodes to write, in order.
+        lfns : container
+            Logical file names known to the workflow.
+        dependencies : `dict`
+            Parents of every job with any (see :meth:`dependencies`).
+        """
+        included = set(tasks)
+        with open(filename, 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<!-- generated: %s -->\n' % datetime.datetime.now())
+            f.write('<!-- generated by: %s -->\n' % getpass.getuser())
+            f.write('<!-- generator: python -->\n')
+            f.write('<adag%s>\n' % _xml_attrs([
+                ('xmlns', DAX_NAMESPACE),
+                ('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance'),
+                ('xsi:schemaLocation', DAX_NAMESPACE + ' ' + DAX_LOCATION),
+                ('version', DAX_VERSION),
+                ('name', name)]))
+
+            for task_id in tasks:
+                desc = self._describe_job(task_id, lfns)
+                f.write('\t<job%s>\n' % _xml_attrs([
+                    ('id', desc['id']),
+                    ('name', desc['name']),
+                    ('node-label', desc['label'])]))
+                if desc['args']:
+                    args = [('<file%s/>' % _xml_attrs([('name', arg)])) if is_file
+                            else xml_escape(arg) for arg, is_file in desc['args']]
+                    f.write('\t\t<argument>%s</argument>\n' % ' '.join(args))
+                for namespace, key, value in desc['profiles']:
+                    f.write('\t\t<profile%s>%s</profile>\n' % (_xml_attrs([
+                        ('namespace', namespace), ('key', key)]), xml_escape(value)))
+                for stream in ('stdout', 'stderr'):
+                    if desc[stream] is not None:
+                        f.write('\t\t<%s%s/>\n' % (stream, _xml_attrs([
+                            ('name', desc[stream]), ('link', 'output')])))
+                for lfn, link in sorted(desc['uses']):
+                    f.write('\t\t<uses%s/>\n' % _xml_attrs([('name', lfn), ('link', link)]))
+                f.write('\t</job>\n')
+
+            for task_id in tasks:
+                parents = sorted(dependencies.get(task_id, set()) & included)
+                if parents:
+                    f.write('\t<child%s>\n' % _xml_attrs([('ref', self._job_id(task_id))]))
+                    for parent_id in parents:
+                        f.write('\t\t<parent%s/>\n' % _xml_attrs([('ref', self._job_id(parent_id))]))
+                    f.write('\t</child>\n')
+            f.write('</adag>\n')
+
     def write_rc(self, name='rc.txt'):
         """Write replica catalog.
 
@@ -196,6 +589,171 @@ class Daxgen(object):
                 for pfn in file_.pfns:
                     f.write(' '.join([lfn, pfn.url, pfn.site]) + '\n')
 
+    def _make_file(self, attrs):
+        """Create Pegasus file object from file node's attributes.
+
+        Parameters
+        ----------
+        attrs : `dict`
+            Attributes of the file node.
+
+        Returns
+        -------
+        `Pegasus.DAX3.File`
+            File with its physical file names, if any.
+        """
+        try:
+            name = attrs['lfn']
+        except KeyError:
+            msg = 'Mandatory attribute "%s" is missing.'
+            raise AttributeError(msg.format('lfn'))
+        file_ = File(name)
+
+        # Add physical file names, if any.
+        urls = attrs.get('pfn')
+        if urls is not None:
+            urls = urls.split(',')
+            sites = attrs.get('sites')
+            if sites is None:
+                sites = len(urls) * ['condorpool']
+            for url, site in zip(urls, sites):
+                file_.addPFN(PFN(url, site))
+        return file_
+
+    def _describe_job(self, task_id, lfns):
+        """Collect everything needed to write a job.
+
+        Parameters
+        ----------
+        task_id : node id
+            Task node representing the job.
+        lfns : container
+            Logical file names known to the workflow, used to recognize
+            file names among job's arguments.
+
+        Returns
+        -------
+        `dict`
+            Job's id, executable name, node label, arguments (as pairs of
+            an argument and a flag telling if it is a file name), files
+            it uses (as pairs of a logical file name and a link type),
+            files its stdout and stderr are redirected to, and profiles
+            (as namespace, key, value triples, see `JOB_PROFILES`).
+        """
+        attrs = self.graph.node[task_id]
+        try:
+            name = attrs['exec_name']
+        except KeyError:
+            msg = 'Mandatory attribute "%s" is missing.'
+            raise AttributeError(msg.format('exec_name'))
+        job_id = self._job_id(task_id)
+        label = '{name}_{id}'.format(name=name, id=job_id)
+        desc = {'id': job_id, 'name': name, 'label': label,
+                'args': [], 'uses': [], 'stdout': None, 'stderr': None,
+                'profiles': [(namespace, key, str(attrs[attr])) for attr, namespace, key in JOB_PROFILES
+                             if attrs.get(attr) is not None]}
+        if task_id in self.priorities:
+            desc['profiles'].append(PRIORITY_PROFILE + (str(self.priorities[task_id]),))
+
+        # Single pass over job's own arguments, marking file names.
+        args = attrs.get('exec_args', [])
+        if args:
+            desc['args'] = [(arg, arg in lfns) for arg in args.split()]
+
+        # Specify job's inputs.
+        for file_id in self.graph.predecessors(task_id):
+            attrs = self.graph.node[file_id]
+            if not attrs.get('ignore', False):
+                desc['uses'].append((attrs['lfn'], 'input'))
+
+        # Specify job's outputs.
+        for file_id in self.graph.successors(task_id):
+            attrs = self.graph.node[file_id]
+            if not attrs.get('ignore', False):
+                desc['uses'].append((attrs['lfn'], 'output'))
+                streams = attrs.get('streams')
+                if streams is not None:
+                    if streams & 1 != 0:
+                        desc['stdout'] = attrs['lfn']
+                    if streams & 2 != 0:
+                        desc['stderr'] = attrs['lfn']
+
+        # Provide default files to store stdout and stderr, if not
+        # specified explicitly, or let the log wrapper collect them.
+        if self.log_mode == 'files':
+            if desc['stdout'] is None:
+                desc['stdout'] = '{name}.out'.format(name=label)
+                desc['uses'].append((desc['stdout'], 'output'))
+            if desc['stderr'] is None:
+                desc['stderr'] = '{name}.err'.format(name=label)
+                desc['uses'].append((desc['stderr'], 'output'))
+        elif self.log_mode == 'bundle':
+            desc['name'] = LOG_WRAPPER
+            desc['args'] = [(self._bundles[task_id], False), (job_id, False), (name, False)] + desc['args']
+        return desc
+
+    def _job_id(self, node_id):
+        """Return job id corresponding to a task node.
+        """
+        # Integer ids of compact graphs are formatted as in networkx exports.
+        node_name = getattr(self.graph, 'node_name', None)
+        return node_name(node_id) if node_name is not None else str(node_id)
+
+    def _split(self):
+        """Collect file and task nodes based on node types.
+        """
+        self.files = set()
+        self.tasks = set()
+        self._dependencies = {}
+        self.priorities = {}
+        self.log_mode = 'files'
+        self._bundles = {}
+        for node_id in self.graph:
+            if self.graph.node[node_id]['node_type'] == 0:
+                self.files.add(node_id)
+            else:
+                self.tasks.add(node_id)
+
+    def dependencies(self, reduce=False):
+        """Find jobs every job depends on.
+
+        Dependencies are collected in a single pass over the file nodes,
+        every job producing a file is a parent of every job using it.
+
+        Parameters
+        ----------
+        reduce : `bool`, optional
+            If True, dependencies implied by other ones (e.g., a coadd
+            depending on a calexp and on the warp made of it) are removed,
+            i.e., the transitive reduction of the job graph is returned.
+
+        Returns
+        -------
+        dependencies : `dict`
+            Sets of parents keyed by task nodes, jobs without parents are
+            omitted.
+
+        Raises
+        ------
+        `ValueError`
+            If dependencies between jobs are cyclic and reduction was
+            requested.
+        """
+        cached = self._dependencies.get(reduce)
+        if cached is not None:
+            return cached
+        if reduce:
+            dependencies = _transitive_reduction(self.tasks, self.dependencies())
+        else:
+            dependencies = {}
+            for file_id in self.files:
+                producers = list(self.graph.predecessors(file_id))
+                if producers:
+                    for task_id in self.graph.successors(file_id):
+                        dependencies.setdefault(task_id, set()).update(producers)
+        self._dependencies[reduce] = dependencies
+        return dependencies
+
     def _label(self):
         """Differentiate files from tasks.
 
@@ -233,25 +791,333 @@ class Daxgen(object):
             self.graph.node[v]['node_type'] = 0 if v in files else 1
 
 
-def read_json(filename):
+def _partition_id(index):
+    """Return id of the DAX job running a partition.
+    """
+    return 'dax{0:04d}'.format(index)
+
+
+def _topological_sort(nodes, parents, depth_first=False):
+    """Order nodes so that every node follows all its parents.
+
+    Parameters
+    ----------
+    nodes : iterable
+        Nodes to sort.
+    parents : callable
+        Function returning parents of a node, only parents among the
+        ``nodes`` are taken into account.
+    depth_first : `bool`, optional
+        If True, a node ready to go is preferably taken from the
+        descendants of the last one instead of in the order of ``nodes``.
+
+    Returns
+    -------
+    order : `list` or None
+        Sorted nodes, None if the dependencies are cyclic.
+    """
+    nodes = list(nodes)
+    known = set(nodes)
+    pending = {}
+    children = {}
+    for node in nodes:
+        found = [parent for parent in parents(node) if parent in known]
+        pending[node] = len(found)
+        for parent in found:
+            children.setdefault(parent, []).append(node)
+    ready = collections.deque(node for node in nodes if pending[node] == 0)
+    if depth_first:
+        ready.reverse()
+    order = []
+    while ready:
+        node = ready.pop() if depth_first else ready.popleft()
+        order.append(node)
+        newly_ready = []
+        for child in children.get(node, ()):
+            pending[child] -= 1
+            if pending[child] == 0:
+                newly_ready.append(child)
+        ready.extend(reversed(newly_ready) if depth_first else newly_ready)
+    return order if len(order) == len(nodes) else None
+
+
+def _transitive_reduction(nodes, parents):
+    """Remove dependencies implied by other ones.
+
+    Nodes are visited in topological order tracking ancestors of every node
+    as a bit set (bits are positions in the order).  A parent is redundant
+    if it is an ancestor of another parent, and ancestors of a node are
+    released once all its children have been visited.
+
+    Parameters
+    ----------
+    nodes : iterable
+        Nodes of the graph.
+    parents : `dict`
+        Sets of parents keyed by nodes, nodes without parents may be
+        omitted.
+
+    Returns
+    -------
+    reduced : `dict`
+        Sets of parents keyed by nodes, nodes without parents are omitted.
+
+    Raises
+    ------
+    `ValueError`
+        If dependencies are cyclic.
+    """
+    order = _topological_sort(sorted(nodes), lambda node: parents.get(node, ()))
+    if order is None:
+        raise ValueError("Dependencies between jobs are cyclic.")
+    position = {node: index for index, node in enumerate(order)}
+    pending = dict.fromkeys(order, 0)
+    for node_parents in parents.values():
+        for parent in node_parents:
+            pending[parent] += 1
+
+    ancestors = {}
+    reduced = {}
+    for node in order:
+        node_parents = sorted(parents.get(node, ()), key=position.get, reverse=True)
+        covered = 0
+        kept = set()
+        for parent in node_parents:
+            bit = 1 << position[parent]
+            if covered & bit:
+                continue
+            kept.add(parent)
+            covered |= ancestors[parent]
+        for parent in kept:
+            covered |= 1 << position[parent]
+        for parent in node_parents:
+            pending[parent] -= 1
+            if pending[parent] == 0:
+                del ancestors[parent]
+        if kept:
+            reduced[node] = kept
+        if pending[node] > 0:
+            ancestors[node] = covered
+    return reduced
+
+
+def _xml_attrs(attrs):
+    """Format XML attributes skipping the ones without a value.
+    """
+    return ''.join(' {0}={1}'.format(key, quoteattr(str(val)))
+                   for key, val in attrs if val is not None)
+
+
+def read_json(filename, chunk_size=1 << 20):
     """Read a workflow specified in JSON node-link format.
 
+    The document is decoded incrementally, a node or a link at a time, so
+    only the graph being built and a chunk of the file are kept in memory.
+
     Parameters
     ----------
     filename : `str`
         File with the persisted workflow.
+    chunk_size : `int`, optional
+        Number of characters read from the file at once.
 
     Returns
     -------
     `networkx.DiGraph`
         Graph representing the workflow.
-    """
-    import json
-    from networkx.readwrite import json_graph
 
+    Raises
+    ------
+    `ValueError`
+        If the file is not a valid JSON node-link document.
+    """
+    graph = nx.DiGraph()
     with open(filename, 'r') as f:
-        data = json.load(f)
-    return json_graph.node_link_graph(data, directed=True)
+        stream = _JsonStream(f, chunk_size)
+        stream.expect('{')
+        while not stream.accept('}'):
+            stream.accept(',')
+            key = stream.value()
+            stream.expect(':')
+            if key == 'nodes':
+                for attrs in stream.items():
+                    graph.add_node(attrs.pop('id'), **attrs)
+            elif key in ('links', 'edges'):
+                for attrs in stream.items():
+                    graph.add_edge(attrs.pop('source'), attrs.pop('target'), **attrs)
+            elif key == 'graph':
+                graph.graph.update(stream.value())
+            else:
+                stream.value()
+    return graph
+
+
+class _JsonStream(object):
+    """Incremental decoder of a JSON document.
+
+    Parameters
+    ----------
+    f : file object
+        File opened in text mode.
+    chunk_size : `int`
+        Number of characters read at once.
+    """
+
+    def __init__(self, f, chunk_size):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Read next chunk, return False at the end of the file.
+        """
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Return next non-whitespace character (empty at the end).
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return self._buffer[self._pos:self._pos + 1]
+
+    def accept(self, char):
+        """Consume the character if it is the next one.
+        """
+        if self._peek() == char:
+            self._pos += 1
+            return True
+        return False
+
+    def expect(self, char):
+        """Consume the character, which must be the next one.
+        """
+        if not self.accept(char):
+            raise ValueError("Expected '{0}' at character {1}.".format(char, self._pos))
+
+    def value(self):
+        """Decode next value.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A value ending with the buffer (e.g., a number) may continue
+            # in the next chunk.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self):
+        """Iterate over elements of the next array.
+        """
+        self.expect('[')
+        if self.accept(']'):
+            return
+        while True:
+            yield self.value()
+            if self.accept(']'):
+                return
+            self.expect(',')
+
+
+# Converters of GraphML attribute values by their declared type.
+_GRAPHML_TYPES = {
+    'boolean': lambda value: value.strip().lower() in ('true', '1'),
+    'int': int,
+    'long': int,
+    'float': float,
+    'double': float,
+    'string': str,
+}
+
+
+def read_graphml(filename):
+    """Read a workflow specified in GraphML format.
+
+    Elements are processed as the parser reaches their end and dropped
+    right after, so only the graph being built is kept in memory.
+
+    Parameters
+    ----------
+    filename : `str`
+        File with the persisted workflow.
+
+    Returns
+    -------
+    `networkx.DiGraph`
+        Graph representing the workflow.
+    """
+    from xml.etree import ElementTree
+
+    graph = nx.DiGraph()
+    keys = {}
+    defaults = {'node': {}, 'edge': {}, 'graph': {}}
+    stack = []
+    for event, elem in ElementTree.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        tag = _local_name(elem.tag)
+        if tag == 'key':
+            name = elem.get('attr.name', elem.get('id'))
+            convert = _GRAPHML_TYPES.get(elem.get('attr.type', 'string'), str)
+            keys[elem.get('id')] = (name, convert)
+            for child in elem:
+                if _local_name(child.tag) == 'default':
+                    domain = elem.get('for', 'all')
+                    for target in (defaults if domain == 'all' else [domain]):
+                        defaults.setdefault(target, {})[name] = convert(child.text or '')
+        elif tag in ('node', 'edge'):
+            attrs = dict(defaults[tag])
+            attrs.update(_graphml_data(elem, keys))
+            if tag == 'node':
+                graph.add_node(elem.get('id'), **attrs)
+            else:
+                graph.add_edge(elem.get('source'), elem.get('target'), **attrs)
+        elif tag == 'graph':
+            graph.graph.update(_graphml_data(elem, keys))
+        else:
+            continue
+        # Drop the processed element, it is (almost) always the first child.
+        if stack:
+            stack[-1].remove(elem)
+    return graph
+
+
+def _local_name(tag):
+    """Strip XML namespace from a tag.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _graphml_data(elem, keys):
+    """Collect attribute values of a GraphML element.
+    """
+    attrs = {}
+    for child in elem:
+        if _local_name(child.tag) == 'data':
+            name, convert = keys.get(child.get('key'), (child.get('key'), str))
+            attrs[name] = convert(child.text or '')
+    return attrs
 
 
 def read_pickle(filename):
@@ -264,7 +1130,7 @@ def read_pickle(filename):
 
     Returns
     -------
-    `networkx.DiGraph`
+    `networkx.DiGraph` or `CompactGraph`
         Graph representing the workflow.
     """
     import pickle
@@ -272,3 +1138,21 @@ def read_pickle(filename):
     with open(filename, 'rb') as f:
         data = pickle.load(f)
     return data
+
+
+def read_bpsg(filename):
+    """Read a workflow saved in the columnar graph format.
+
+    Parameters
+    ----------
+    filename : `str`
+        File with the persisted workflow.
+
+    Returns
+    -------
+    `MappedGraph`
+        Graph representing the workflow, read from the file on demand.
+    """
+    from bps_graphfile import MappedGraph
+
+    return MappedGraph(filename)
@@ -104,10 +104,8 @@ fi
 # make pngs of .dot files and quantum graphs 
 echo ""
 echo "Make pngs"
-draw_qgraph_html.py --qgraph ${outdir}/demo_qgraph.pickle -o $outdir/draw/demo_qgraph.dot
-for f in `cd $outdir/input/; ls *.pickle`; do
-    draw_qgraph_html.py --qgraph $outdir/input/$f -o $outdir/draw/$f.dot
-done
+draw_qgraph_html.py --qgraph ${outdir}/demo_qgraph.pickle -o $outdir/draw/demo_qgraph.dot --max_columns 50
+draw_qgraph_html.py --qgraph $outdir/input --outdir $outdir/draw -j 4
 pushd $outdir/draw > /dev/null
 for f in `ls *.dot`; do
     dot -Tpng -o $f.png $f
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules and scripts are not installed, tests import them from the tree.
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(_ROOT, 'python'), os.path.join(_ROOT, 'bin')]
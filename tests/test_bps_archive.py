@@ -0,0 +1,55 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from bps_archive import QuantumArchive, QuantumArchiveWriter, is_quantum_archive
+
+
+class QuantumArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'quanta.qar')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRoundTrip(self):
+        payloads = {'000002': pickle.dumps({'visit': 2}), '000000': b'', '000001': b'x' * 1000}
+        with QuantumArchiveWriter(self.filename) as archive:
+            for key, data in payloads.items():
+                archive.add(key, data)
+        self.assertTrue(is_quantum_archive(self.filename))
+        with QuantumArchive(self.filename) as archive:
+            self.assertEqual(list(archive.keys()), list(payloads))
+            for key, data in payloads.items():
+                self.assertEqual(archive.read(key), data)
+            self.assertEqual(archive.load('000002'), {'visit': 2})
+            self.assertRaises(KeyError, archive.read, '000003')
+
+    def testDuplicateKey(self):
+        with QuantumArchiveWriter(self.filename) as archive:
+            archive.add('000000', b'a')
+            self.assertRaises(ValueError, archive.add, '000000', b'b')
+        with QuantumArchive(self.filename) as archive:
+            self.assertEqual(archive.read('000000'), b'a')
+
+    def testNotArchive(self):
+        with open(self.filename, 'wb') as f:
+            pickle.dump([1, 2, 3], f)
+        self.assertFalse(is_quantum_archive(self.filename))
+        self.assertRaises(ValueError, QuantumArchive, self.filename)
+
+    def testTruncated(self):
+        with QuantumArchiveWriter(self.filename) as archive:
+            archive.add('000000', b'a' * 100)
+        with open(self.filename, 'r+b') as f:
+            f.truncate(50)
+        self.assertTrue(is_quantum_archive(self.filename))
+        self.assertRaises(ValueError, QuantumArchive, self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
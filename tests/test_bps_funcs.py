@@ -0,0 +1,200 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+import bps_synth
+from bps_archive import QuantumArchive, QuantumArchiveWriter
+
+try:
+    import bps_funcs
+    from bps_qgraph import dataid_predicate
+except ImportError:
+    # LSST stack is not available
+    bps_funcs = None
+
+
+def graph_contents(sciGraph, qgnodes):
+    """Return everything describing a science graph in comparable form.
+    """
+    return (sciGraph.columns(), list(sciGraph.edges()),
+            {nodename: (qgnode.taskDef.label, [id(quantum) for quantum in qgnode.quanta])
+             for nodename, qgnode in qgnodes.items()})
+
+
+@unittest.skipIf(bps_funcs is None, "LSST stack is not available")
+class ScienceGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.qgraph = bps_synth.generate_qgraph(visits=6, detectors=8, filters=2, depth=4)
+
+    def testParallelIdentical(self):
+        for clusterSize in (None, 3):
+            serial = bps_funcs.create_science_graph(self.qgraph, cluster_size=clusterSize, jobs=1)
+            parallel = bps_funcs.create_science_graph(self.qgraph, cluster_size=clusterSize, jobs=3)
+            self.assertEqual(graph_contents(*parallel), graph_contents(*serial), clusterSize)
+
+    def testClustered(self):
+        sciGraph, qgnodes = bps_funcs.create_science_graph(self.qgraph, cluster_size=3)
+        nquanta = sum(len(nodes.quanta) for nodes in self.qgraph)
+        self.assertEqual(sum(len(qgnode.quanta) for qgnode in qgnodes.values()), nquanta)
+        self.assertTrue(all(len(qgnode.quanta) <= 3 for qgnode in qgnodes.values()))
+        for nodename, qgnode in qgnodes.items():
+            self.assertEqual(sciGraph.node[nodename]['quanta_count'], len(qgnode.quanta))
+            self.assertEqual(sciGraph.node[nodename]['task_label'], qgnode.taskDef.label)
+
+
+def label_counts(qgnodes):
+    """Count task nodes by task label.
+    """
+    return collections.Counter(qgnode.taskDef.label for qgnode in qgnodes.values())
+
+
+def producers(sciGraph, nodename):
+    """Return task nodes producing inputs of a task node.
+    """
+    return {parent for fnodeName in sciGraph.predecessors(nodename)
+            for parent in sciGraph.predecessors(fnodeName)}
+
+
+@unittest.skipIf(bps_funcs is None, "LSST stack is not available")
+class SelectPruneTestCase(unittest.TestCase):
+
+    def setUp(self):
+        qgraph = bps_synth.generate_qgraph(visits=3, detectors=4, filters=1, depth=4)
+        self.sciGraph, self.qgnodes = bps_funcs.create_science_graph(qgraph)
+        self.counts = label_counts(self.qgnodes)
+
+    def testPruneExisting(self):
+        calls = []
+
+        def existing(dsKeys):
+            calls.append(dsKeys)
+            # all of isr, but only one of the two outputs of cit exist
+            return {dsKey for dsKey in dsKeys if dsKey[0] in ('postISRCCD', 'icExp')}
+
+        sciGraph, qgnodes = bps_funcs.prune_existing(self.sciGraph, self.qgnodes, existing)
+        self.assertEqual(len(calls), 1)
+        expected = self.counts.copy()
+        del expected['isr']
+        self.assertEqual(label_counts(qgnodes), expected)
+        self.assertEqual(len([node for node in sciGraph if sciGraph.node[node]['node_type'] == 1]),
+                         len(qgnodes))
+        for nodename, qgnode in qgnodes.items():
+            # existing outputs of isr stay as inputs without a producer
+            if qgnode.taskDef.label == 'cit':
+                self.assertEqual(producers(sciGraph, nodename), set())
+                self.assertEqual([sciGraph.node[fnodeName]['dataset_key'][0]
+                                  for fnodeName in sciGraph.predecessors(nodename)], ['postISRCCD'])
+            else:
+                self.assertTrue(producers(sciGraph, nodename))
+
+    def testPruneDownstream(self):
+        # outputs of the first visit exist up to the warps
+        def existing(dsKeys):
+            return {dsKey for dsKey in dsKeys if dict(dsKey[1]).get('visit') == 0}
+
+        def firstVisit(qgnode):
+            return all(dsRef.dataId.get('visit') == 0
+                       for dsRefs in qgnode.quanta[0].outputs.values() for dsRef in dsRefs)
+
+        sciGraph, qgnodes = bps_funcs.prune_existing(self.sciGraph, self.qgnodes, existing)
+        removed = label_counts({nodename: qgnode for nodename, qgnode in self.qgnodes.items()
+                                if firstVisit(qgnode)})
+        self.assertEqual(set(removed), {'isr', 'cit', 'ct', 'mwt'})
+        self.assertEqual(label_counts(qgnodes), self.counts - removed)
+        # coadds of the existing warps stay
+        self.assertEqual(label_counts(qgnodes)['cwact'], self.counts['cwact'])
+        # nothing exists, nothing is pruned
+        self.assertIs(bps_funcs.prune_existing(self.sciGraph, self.qgnodes, lambda dsKeys: set())[1],
+                      self.qgnodes)
+
+    def testSelectDataId(self):
+        predicate = dataid_predicate('visit=1')
+        sciGraph, qgnodes = bps_funcs.select_subgraph(self.sciGraph, self.qgnodes,
+                                                      dataIdPredicate=predicate, ancestors=False)
+        self.assertEqual(set(label_counts(qgnodes)), {'isr', 'cit', 'ct', 'mwt'})
+        self.assertEqual(label_counts(qgnodes)['isr'], 4)
+        for qgnode in qgnodes.values():
+            outputs = [dsRef for dsRefs in qgnode.quanta[0].outputs.values() for dsRef in dsRefs]
+            self.assertTrue(all(dsRef.dataId['visit'] == 1 for dsRef in outputs))
+
+    def testSelectWithAncestors(self):
+        sciGraph, qgnodes = bps_funcs.select_subgraph(self.sciGraph, self.qgnodes, labels=['mwt'],
+                                                      dataIdPredicate=dataid_predicate('visit=2'))
+        counts = label_counts(qgnodes)
+        self.assertEqual(set(counts), {'isr', 'cit', 'ct', 'mwt'})
+        self.assertEqual((counts['isr'], counts['cit'], counts['ct']), (4, 4, 4))
+        # the same without ancestors keeps the warps only
+        sciGraph, qgnodes = bps_funcs.select_subgraph(self.sciGraph, self.qgnodes, labels=['mwt'],
+                                                      dataIdPredicate=dataid_predicate('visit=2'),
+                                                      ancestors=False)
+        self.assertEqual(set(label_counts(qgnodes)), {'mwt'})
+        self.assertTrue(all(producers(sciGraph, nodename) == set() for nodename in qgnodes))
+
+
+@unittest.skipIf(bps_funcs is None, "LSST stack is not available")
+class SaveQuantaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        qgraph = bps_synth.generate_qgraph(visits=4, detectors=8, filters=2, depth=4)
+        sciGraph, self.qgnodes = bps_funcs.create_science_graph(qgraph, cluster_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def save(self, name, jobs):
+        directory = os.path.join(self.tmpdir, name)
+        os.mkdir(directory)
+        saves = [(nodename, os.path.join(directory, "quantum%06d.pickle" % nodename))
+                 for nodename in sorted(self.qgnodes)]
+        digests = {}
+        counts = bps_funcs.save_qgnodes(self.qgnodes, saves, jobs, digests=digests)
+        contents = {}
+        for nodename, filename in saves:
+            with open(filename, 'rb') as f:
+                contents[os.path.basename(filename)] = f.read()
+        return counts, contents, {os.path.basename(name): digest for name, digest in digests.items()}
+
+    def saveArchive(self, name, jobs):
+        filename = os.path.join(self.tmpdir, name)
+        digests = {}
+        saves = [(nodename, "%06d" % nodename) for nodename in sorted(self.qgnodes)]
+        with QuantumArchiveWriter(filename) as archive:
+            bps_funcs.save_qgnodes(self.qgnodes, saves, jobs, archive, digests)
+        with open(filename, 'rb') as f:
+            return f.read(), digests[filename]
+
+    def testParallelIdentical(self):
+        serial = self.save('serial', 1)
+        parallel = self.save('parallel', 3)
+        self.assertEqual(parallel[0], serial[0])
+        self.assertEqual(parallel[1], serial[1])
+        self.assertEqual(parallel[2], serial[2])
+        self.assertEqual(len(serial[1]), len(self.qgnodes))
+
+    def testArchiveParallelIdentical(self):
+        self.assertEqual(self.saveArchive('parallel.qar', 3), self.saveArchive('serial.qar', 1))
+        with QuantumArchive(os.path.join(self.tmpdir, 'serial.qar')) as archive:
+            self.assertEqual(len(archive.keys()), len(self.qgnodes))
+
+    def testUnchangedSkipped(self):
+        counts, contents, digests = self.save('first', 2)
+        directory = os.path.join(self.tmpdir, 'first')
+        oldDigests = {os.path.join(directory, name): digest for name, digest in digests.items()}
+        # a file with a stale digest is rewritten, others are left in place
+        changed = sorted(oldDigests)[0]
+        oldDigests[changed] = 'stale'
+        saves = [(nodename, os.path.join(directory, "quantum%06d.pickle" % nodename))
+                 for nodename in sorted(self.qgnodes)]
+        nfiles, nbytes = bps_funcs.save_qgnodes(self.qgnodes, saves, 2, digests=oldDigests)
+        self.assertEqual(nfiles, 1)
+        self.assertEqual(nbytes, len(contents[os.path.basename(changed)]))
+        self.assertEqual(oldDigests[changed], digests[os.path.basename(changed)])
+        self.assertFalse([name for name in os.listdir(directory) if name.endswith('.tmp')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from bps_graph import CompactGraph
+
+
+def make_graph():
+    """Make graph 0 -> 1 -> 2, 0 -> 2 with the 1 -> 2 edge added twice.
+    """
+    graph = CompactGraph()
+    graph.add_node(0, node_type=0, lfn='a')
+    graph.add_node(1, node_type=1, label='task')
+    graph.add_node(2, node_type=0, lfn='b')
+    for u, v in [(0, 1), (1, 2), (0, 2), (1, 2)]:
+        graph.add_edge(u, v)
+    return graph
+
+
+class CompactGraphTestCase(unittest.TestCase):
+
+    def testAdjacency(self):
+        graph = make_graph()
+        out_ptr, out_idx, in_ptr, in_idx = graph.adjacency()
+        self.assertEqual(list(out_ptr), [0, 2, 3, 3])
+        self.assertEqual(list(out_idx), [1, 2, 2])
+        self.assertEqual(list(in_ptr), [0, 0, 1, 3])
+        self.assertEqual(list(in_idx), [0, 1, 0])
+
+    def testDuplicateEdges(self):
+        graph = make_graph()
+        self.assertEqual(graph.number_of_edges(), 3)
+        self.assertEqual(list(graph.edges()), [(0, 1), (0, 2), (1, 2)])
+        self.assertEqual(list(graph.successors(1)), [2])
+        self.assertEqual(list(graph.predecessors(2)), [1, 0])
+        self.assertEqual(graph.in_degree(2), 2)
+
+    def testAdjacencyRebuilt(self):
+        graph = make_graph()
+        self.assertEqual(graph.out_degree(2), 0)
+        graph.add_node(3, node_type=1)
+        graph.add_edge(2, 3)
+        self.assertEqual(list(graph.successors(2)), [3])
+        self.assertEqual(graph.number_of_edges(), 4)
+
+    def testAttributes(self):
+        graph = make_graph()
+        self.assertEqual(dict(graph.node[1]), {'node_type': 1, 'label': 'task'})
+        graph.node[1]['label'] = None
+        self.assertNotIn('label', graph.node[1])
+        self.assertRaises(KeyError, graph.node.__getitem__, 3)
+        self.assertRaises(ValueError, graph.add_node, 5)
+        self.assertRaises(KeyError, graph.add_edge, 0, 5)
+
+    def testColumns(self):
+        graph = make_graph()
+        columns = graph.columns()
+        self.assertEqual(columns['node_type'], [0, 1, 0])
+        self.assertEqual(columns['lfn'], ['a', None, 'b'])
+        copy = CompactGraph.from_columns(columns, graph._src, graph._dst)
+        self.assertEqual(list(copy.edges()), list(graph.edges()))
+        self.assertEqual(dict(copy.node[2]), dict(graph.node[2]))
+
+    def testSubgraph(self):
+        graph = make_graph()
+        subgraph, mapping = graph.subgraph([2, 1])
+        self.assertEqual(mapping, {1: 0, 2: 1})
+        self.assertEqual(list(subgraph.edges()), [(0, 1)])
+        self.assertEqual(subgraph.node[1]['lfn'], 'b')
+
+
+if __name__ == '__main__':
+    unittest.main()
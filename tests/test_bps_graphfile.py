@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bps_graph import CompactGraph
+from bps_graphfile import MappedGraph, read_graph, write_graph
+from dump_wfgraph import parse_where
+
+
+def make_graph():
+    """Make workflow-like graph with a column of every kind.
+    """
+    graph = CompactGraph()
+    graph.add_node(0, node_type=0, lfn='raw', ignore=True,
+                   dataset_key=('raw', frozenset({'visit': 1}.items())))
+    graph.add_node(1, node_type=1, exec_name='pipetask', quanta_count=3)
+    graph.add_node(2, node_type=0, lfn='quantum000001.pickle', ignore=False)
+    graph.add_node(3, node_type=0, lfn='calexp', ignore=True)
+    graph.add_node(4)
+    for u, v in [(0, 1), (2, 1), (1, 3)]:
+        graph.add_edge(u, v)
+    return graph
+
+
+class GraphFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'wf.bpsg')
+        self.graph = make_graph()
+        write_graph(self.graph, self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRoundTrip(self):
+        graph = read_graph(self.filename)
+        self.assertEqual(graph.columns(), self.graph.columns())
+        self.assertEqual(list(graph.edges()), list(self.graph.edges()))
+
+    def testMapped(self):
+        with MappedGraph(self.filename) as graph:
+            self.assertEqual(graph.kinds, {'lfn': 'str', 'ignore': 'bool', 'dataset_key': 'obj',
+                                           'exec_name': 'str', 'quanta_count': 'int'})
+            self.assertEqual(len(graph), 5)
+            self.assertEqual(graph.number_of_edges(), 3)
+            self.assertEqual(sorted(graph.predecessors(1)), [0, 2])
+            self.assertEqual(list(graph.successors(1)), [3])
+            self.assertEqual(dict(graph.node[1]), dict(self.graph.node[1]))
+            self.assertEqual(dict(graph.node[0]), dict(self.graph.node[0]))
+            self.assertEqual(dict(graph.node[4]), {})
+            self.assertEqual(graph.node_name(1), '000001')
+            with self.assertRaises(TypeError):
+                graph.node[1]['lfn'] = 'other'
+
+    def testSelect(self):
+        with MappedGraph(self.filename) as graph:
+            self.assertEqual(graph.select(ignore=True), [0, 3])
+            self.assertEqual(graph.select(lfn='calexp'), [3])
+            self.assertEqual(graph.select(lfn='missing'), [])
+            self.assertEqual(graph.select(node_type=0, ignore=False), [2])
+            self.assertEqual(graph.select(quanta_count=3), [1])
+
+    def testParseWhere(self):
+        with MappedGraph(self.filename) as graph:
+            attrs = parse_where(['ignore=True', 'quanta_count=3', 'lfn=123', 'node_type=1'], graph.kinds)
+            self.assertEqual(attrs, {'ignore': True, 'quanta_count': 3, 'lfn': '123', 'node_type': 1})
+            self.assertRaises(ValueError, parse_where, ['ignore=yes'], graph.kinds)
+            self.assertRaises(ValueError, parse_where, ['quanta_count=x'], graph.kinds)
+        self.assertEqual(parse_where(['ignore=False', 'lfn=raw']), {'ignore': False, 'lfn': 'raw'})
+
+
+if __name__ == '__main__':
+    unittest.main()
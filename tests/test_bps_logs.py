@@ -0,0 +1,92 @@
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from bps_logs import append_record, bundle_name, read_index, read_record
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def append_many(bundle, worker, count):
+    for attempt in range(count):
+        output = io.BytesIO(("worker %d attempt %d\n" % (worker, attempt)).encode() * 100)
+        append_record(bundle, "%d.%d" % (worker, attempt), output, 0, 0.0, 1.0)
+
+
+class LogBundleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.tmpdir, 'logs', 'isr')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testAppendRead(self):
+        append_record(self.bundle, '000001', io.BytesIO(b'first\n'), 0, 100.0, 102.5)
+        append_record(self.bundle, '000002', io.BytesIO(b''), 1, 103.0, 103.0)
+        append_record(self.bundle, '000001', io.BytesIO(b'retry\nlast line'), 0, 104.0, 105.0)
+        records = read_index(self.bundle + '.log')
+        self.assertEqual([(record['job'], record['returncode']) for record in records],
+                         [('000001', 0), ('000002', 1), ('000001', 0)])
+        self.assertEqual((records[0]['start'], records[0]['end']), (100.0, 102.5))
+        self.assertEqual(records[1]['offset'], records[0]['offset'] + records[0]['length'])
+        outputs = [read_record(self.bundle + '.idx', record) for record in records]
+        for record, output in zip(records, outputs):
+            header = "=== job %s rc=%d " % (record['job'], record['returncode'])
+            self.assertTrue(output.startswith(header.encode()))
+        self.assertTrue(outputs[0].endswith(b'===\nfirst\n'))
+        self.assertTrue(outputs[1].endswith(b'===\n'))
+        self.assertTrue(outputs[2].endswith(b'===\nretry\nlast line'))
+
+    def testConcurrent(self):
+        workers = [multiprocessing.Process(target=append_many, args=(self.bundle, worker, 10))
+                   for worker in range(4)]
+        os.makedirs(os.path.dirname(self.bundle))
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        records = read_index(self.bundle)
+        self.assertEqual(len(records), 40)
+        for record in records:
+            worker, attempt = record['job'].split('.')
+            output = read_record(self.bundle, record)
+            self.assertEqual(output.split(b'\n', 1)[1],
+                             ("worker %s attempt %s\n" % (worker, attempt)).encode() * 100)
+
+    def testWrapperConcurrent(self):
+        # two jobs run by the log wrapper at once append to the same bundle
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [os.path.join(_ROOT, 'python'), os.environ.get('PYTHONPATH', '')]))
+        script = ("import sys, time\n"
+                  "for line in range(200):\n"
+                  "    print(sys.argv[1], line, flush=True)\n"
+                  "    time.sleep(0.001)\n")
+        os.makedirs(os.path.dirname(self.bundle))
+        jobs = [subprocess.Popen([sys.executable, os.path.join(_ROOT, 'bin', 'log_bundle.py'),
+                                  self.bundle, job, sys.executable, '-c', script, job],
+                                 stdout=subprocess.PIPE, env=env)
+                for job in ('000001', '000002')]
+        for job in jobs:
+            job.communicate()
+            self.assertEqual(job.returncode, 0)
+        records = read_index(self.bundle)
+        self.assertEqual(sorted(record['job'] for record in records), ['000001', '000002'])
+        for record in records:
+            output = read_record(self.bundle, record)
+            expected = "".join("%s %d\n" % (record['job'], line) for line in range(200))
+            self.assertEqual(output.split(b'\n', 1)[1], expected.encode())
+
+    def testBundleName(self):
+        self.assertEqual(bundle_name('logs/isr.log'), 'logs/isr')
+        self.assertEqual(bundle_name('logs/isr.idx'), 'logs/isr')
+        self.assertEqual(bundle_name('logs/isr'), 'logs/isr')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+try:
+    import bps_qgraph
+except ImportError:
+    # LSST stack is not available
+    bps_qgraph = None
+
+
+def make_qgraph(nvisits=5):
+    """Make QuantumGraph-like list of task nodes sharing DatasetRefs.
+    """
+    calexps = [SimpleNamespace(dataId={'visit': visit}) for visit in range(nvisits)]
+    calibrate = SimpleNamespace(
+        taskDef=SimpleNamespace(label='calibrate', taskName='lsst.pipe.tasks.CalibrateTask'),
+        quanta=[SimpleNamespace(predictedInputs={'raw': [SimpleNamespace(dataId={'visit': visit})]},
+                                outputs={'calexp': [calexps[visit]]})
+                for visit in range(nvisits)])
+    coadd = SimpleNamespace(
+        taskDef=SimpleNamespace(label='coadd', taskName='lsst.pipe.tasks.CoaddTask'),
+        quanta=[SimpleNamespace(predictedInputs={'calexp': calexps},
+                                outputs={'deepCoadd': [SimpleNamespace(dataId={'patch': 69})]})])
+    return [calibrate, coadd]
+
+
+@unittest.skipIf(bps_qgraph is None, "LSST stack is not available")
+class QuantumGraphStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.pickleFile = os.path.join(self.tmpdir, 'qgraph.pickle')
+        self.streamFile = os.path.join(self.tmpdir, 'qgraph.qgs')
+        with open(self.pickleFile, 'wb') as f:
+            pickle.dump(make_qgraph(), f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testSharedRefs(self):
+        # refs split into several chunks of the table
+        chunkSize = bps_qgraph.REF_CHUNK_SIZE
+        bps_qgraph.REF_CHUNK_SIZE = 3
+        try:
+            self.assertEqual(bps_qgraph.convert_qgraph(self.pickleFile, self.streamFile), 2)
+        finally:
+            bps_qgraph.REF_CHUNK_SIZE = chunkSize
+        calibrate, coadd = bps_qgraph.iter_qgraph(self.streamFile)
+        self.assertEqual([quantum.outputs['calexp'][0].dataId for quantum in calibrate.quanta],
+                         [{'visit': visit} for visit in range(5)])
+        for quantum, calexp in zip(calibrate.quanta, coadd.quanta[0].predictedInputs['calexp']):
+            self.assertIs(quantum.outputs['calexp'][0], calexp)
+
+    def testLabels(self):
+        bps_qgraph.convert_qgraph(self.pickleFile, self.streamFile)
+        for filename in (self.pickleFile, self.streamFile):
+            for labels in (['coadd'], ['tasks.CoaddTask']):
+                nodes = list(bps_qgraph.iter_qgraph(filename, labels))
+                self.assertEqual([node.taskDef.label for node in nodes], ['coadd'], (filename, labels))
+            self.assertEqual(list(bps_qgraph.iter_qgraph(filename, ['CoaddTask'])), [])
+
+    def testConvertSelected(self):
+        predicate = bps_qgraph.dataid_predicate('visit=2')
+        self.assertEqual(bps_qgraph.convert_qgraph(self.pickleFile, self.streamFile, ['calibrate'], predicate), 1)
+        nodes, = bps_qgraph.iter_qgraph(self.streamFile)
+        self.assertEqual([quantum.outputs['calexp'][0].dataId for quantum in nodes.quanta], [{'visit': 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
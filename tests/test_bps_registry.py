@@ -0,0 +1,79 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from bps_registry import RegistryLookup, registry_db_path
+
+BUTLER_YAML = """\
+datastore:
+  root: <butlerRoot>
+  templates: !include data_templates.yaml
+registry:
+  db: sqlite:///<butlerRoot>/gen3.sqlite3
+"""
+
+
+class RegistryLookupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbPath = os.path.join(self.tmpdir, 'gen3.sqlite3')
+        conn = sqlite3.connect(self.dbPath)
+        conn.execute("CREATE TABLE Dataset (dataset_id INTEGER PRIMARY KEY, dataset_type_name TEXT, "
+                     "visit INT, detector INT, patch INT)")
+        conn.execute("CREATE TABLE DatasetCollection (dataset_id INT, collection TEXT)")
+        datasets = [(1, 'calexp', 1, 0, None), (2, 'calexp', 1, 1, None), (3, 'calexp', 2, 0, None),
+                    (4, 'deepCoadd', None, None, 69)]
+        conn.executemany("INSERT INTO Dataset VALUES (?, ?, ?, ?, ?)", datasets)
+        conn.executemany("INSERT INTO DatasetCollection VALUES (?, ?)",
+                         [(1, 'out'), (2, 'out'), (3, 'other'), (4, 'out')])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testDbPath(self):
+        butlerConfig = os.path.join(self.tmpdir, 'butler.yaml')
+        with open(butlerConfig, 'w') as f:
+            f.write(BUTLER_YAML)
+        self.assertEqual(registry_db_path(butlerConfig), self.dbPath)
+        with open(butlerConfig, 'w') as f:
+            f.write(BUTLER_YAML.replace('sqlite:///<butlerRoot>', 'postgresql://host'))
+        self.assertRaises(ValueError, registry_db_path, butlerConfig)
+
+    def testExisting(self):
+        keys = [('calexp', frozenset({'visit': 1, 'detector': 0}.items())),
+                ('calexp', frozenset({'visit': 1, 'detector': 1}.items())),
+                ('calexp', (('detector', 0), ('visit', 2))),
+                ('calexp', frozenset({'visit': 3, 'detector': 0}.items())),
+                ('deepCoadd', (('patch', 69),)),
+                ('deepCoadd', (('patch', 70),))]
+        # batches smaller than the number of dataIds of a type
+        with RegistryLookup(self.dbPath, batchSize=2) as lookup:
+            self.assertEqual(lookup.existing(keys), {keys[0], keys[1], keys[2], keys[4]})
+            self.assertEqual(lookup.existing(keys, 'out'), {keys[0], keys[1], keys[4]})
+            self.assertEqual(lookup.existing(keys, 'missing'), set())
+
+    def testUnknownDimension(self):
+        with RegistryLookup(self.dbPath) as lookup:
+            self.assertEqual(lookup.existing([('calexp', (('visit', 1), ('exposure', 1)))]), set())
+
+    def testReadOnly(self):
+        with RegistryLookup(self.dbPath) as lookup:
+            lookup.existing([('calexp', (('visit', 1), ('detector', 0)))])
+        conn = sqlite3.connect(self.dbPath)
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        conn.close()
+        self.assertEqual(sorted(tables), ['Dataset', 'DatasetCollection'])
+
+    def testNotRegistry(self):
+        dbPath = os.path.join(self.tmpdir, 'empty.sqlite3')
+        sqlite3.connect(dbPath).close()
+        self.assertRaises(ValueError, RegistryLookup, dbPath)
+
+
+if __name__ == '__main__':
+    unittest.main()
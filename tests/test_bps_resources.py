@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+try:
+    from bps_resources import ResourceModel
+except ImportError:
+    # LSST stack is not available
+    ResourceModel = None
+
+MODEL_YAML = """\
+default:
+  memory: 2048
+  cpus: 1
+tasks:
+  measure:
+    memory: 8192
+    runtime: 1200
+    overrides:
+      - dataId: "tract=0,patch=69"
+        memory: 16384
+      - dataId:
+          patch: 70
+        cpus: 4
+  tasks.Coadd:
+    runtime: 30.5
+"""
+
+MODEL_CSV = """\
+label,dataId,memory,cpus,runtime
+default,,2048,1,
+measure,,8192,,1200
+measure,"tract=0,patch=69",16384,,
+measure,patch=70,,4,
+tasks.Coadd,,,,30.5
+"""
+
+
+def make_quantum(**dataId):
+    ref = types.SimpleNamespace(dataId=dataId)
+    return types.SimpleNamespace(predictedInputs={}, outputs={'out': [ref]})
+
+
+@unittest.skipIf(ResourceModel is None, "LSST stack is not available")
+class ResourceModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.measure = types.SimpleNamespace(label='measure', taskName='lsst.pipe.tasks.Measure')
+        self.coadd = types.SimpleNamespace(label='coadd', taskName='lsst.pipe.tasks.Coadd')
+        self.other = types.SimpleNamespace(label='isr', taskName='lsst.ip.isr.IsrTask')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, name, text):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        return ResourceModel.from_file(filename)
+
+    def checkModel(self, model):
+        self.assertEqual(model.quantum_resources(self.measure, make_quantum(tract=0, patch=1)),
+                         {'memory': 8192, 'cpus': 1, 'runtime': 1200.0})
+        self.assertEqual(model.quantum_resources(self.measure, make_quantum(tract=0, patch=69)),
+                         {'memory': 16384, 'cpus': 1, 'runtime': 1200.0})
+        self.assertEqual(model.quantum_resources(self.measure, make_quantum(tract=1, patch=70)),
+                         {'memory': 8192, 'cpus': 4, 'runtime': 1200.0})
+        # selected by the short task name
+        self.assertEqual(model.quantum_resources(self.coadd, make_quantum()),
+                         {'memory': 2048, 'cpus': 1, 'runtime': 30.5})
+        self.assertEqual(model.quantum_resources(self.other, make_quantum()), {'memory': 2048, 'cpus': 1})
+
+    def testYaml(self):
+        self.checkModel(self.read('model.yaml', MODEL_YAML))
+
+    def testCsv(self):
+        self.checkModel(self.read('model.csv', MODEL_CSV))
+
+    def testCluster(self):
+        model = self.read('model.csv', MODEL_CSV)
+        quanta = [make_quantum(tract=0, patch=69), make_quantum(tract=0, patch=70)]
+        self.assertEqual(model.cluster_resources(self.measure, quanta),
+                         {'memory': 16384, 'cpus': 4, 'runtime': 2400})
+        self.assertEqual(model.cluster_resources(self.coadd, [make_quantum()] * 3)['runtime'], 92)
+        estimate = model.runtime_estimate(60.0)
+        self.assertEqual(estimate(self.coadd, make_quantum()), 30.5)
+        self.assertEqual(estimate(self.other, make_quantum()), 60.0)
+
+    def testInvalid(self):
+        self.assertRaises(ValueError, self.read, 'bad.yaml', "default:\n  disk: 10\n")
+        self.assertRaises(ValueError, self.read, 'bad.csv', "label,dataId,memory\ndefault,,lots\n")
+        self.assertRaises(ValueError, self.read, 'bad2.yaml',
+                          "tasks:\n  measure:\n    overrides:\n      - memory: 10\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,331 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from bps_graph import CompactGraph
+
+try:
+    import daxgen
+except ImportError:
+    # Pegasus is not available
+    daxgen = None
+
+
+@unittest.skipIf(daxgen is None, "Pegasus is not available")
+class TransitiveReductionTestCase(unittest.TestCase):
+
+    def testChain(self):
+        # a -> b -> c with the implied a -> c
+        parents = {'b': {'a'}, 'c': {'a', 'b'}}
+        self.assertEqual(daxgen._transitive_reduction('abc', parents), {'b': {'a'}, 'c': {'b'}})
+
+    def testDiamond(self):
+        # a -> b, a -> c, b -> d, c -> d, a -> d is implied
+        parents = {'b': {'a'}, 'c': {'a'}, 'd': {'a', 'b', 'c'}}
+        self.assertEqual(daxgen._transitive_reduction('abcd', parents),
+                         {'b': {'a'}, 'c': {'a'}, 'd': {'b', 'c'}})
+
+    def testLongPath(self):
+        # 0 -> 1 -> ... -> 9, every node also depends on all its ancestors
+        parents = {node: set(range(node)) for node in range(1, 10)}
+        self.assertEqual(daxgen._transitive_reduction(range(10), parents),
+                         {node: {node - 1} for node in range(1, 10)})
+
+    def testIndependent(self):
+        parents = {'c': {'a', 'b'}}
+        self.assertEqual(daxgen._transitive_reduction('abc', parents), {'c': {'a', 'b'}})
+        self.assertEqual(daxgen._transitive_reduction('ab', {}), {})
+
+    def testCycle(self):
+        self.assertRaises(ValueError, daxgen._transitive_reduction, 'ab', {'a': {'b'}, 'b': {'a'}})
+
+
+def make_workflow(edges, types):
+    """Make compact workflow graph with given edges and node types.
+    """
+    graph = CompactGraph()
+    for node, node_type in enumerate(types):
+        if node_type == 0:
+            graph.add_node(node, node_type=0, lfn='file%d' % node)
+        else:
+            graph.add_node(node, node_type=node_type, exec_name='pipetask', exec_args='run')
+    for u, v in edges:
+        graph.add_edge(u, v)
+    return graph
+
+
+def parse_dax(filename):
+    """Parse jobs and dependencies of a DAX.
+
+    Returns
+    -------
+    jobs : `dict`
+        Job's name, node label, arguments, profiles, stdout, stderr, and
+        uses keyed by job ids.
+    dependencies : `dict`
+        Sets of parent ids keyed by child ids.
+    """
+    ns = '{http://pegasus.isi.edu/schema/DAX}'
+    root = ET.parse(filename).getroot()
+    jobs = {}
+    for job in root.iter(ns + 'job'):
+        args = []
+        argument = job.find(ns + 'argument')
+        if argument is not None:
+            args.extend((argument.text or '').split())
+            for file_ in argument.findall(ns + 'file'):
+                args.append(file_.get('name'))
+                args.extend((file_.tail or '').split())
+        jobs[job.get('id')] = {
+            'name': job.get('name'),
+            'label': job.get('node-label'),
+            'args': args,
+            'profiles': sorted((profile.get('namespace'), profile.get('key'), profile.text)
+                               for profile in job.findall(ns + 'profile')),
+            'stdout': [(elem.get('name'), elem.get('link')) for elem in job.findall(ns + 'stdout')],
+            'stderr': [(elem.get('name'), elem.get('link')) for elem in job.findall(ns + 'stderr')],
+            'uses': sorted((uses.get('name'), uses.get('link')) for uses in job.findall(ns + 'uses')),
+        }
+    dependencies = {}
+    for child in root.iter(ns + 'child'):
+        dependencies[child.get('ref')] = {parent.get('ref') for parent in child.findall(ns + 'parent')}
+    return jobs, dependencies
+
+
+def make_pipeline():
+    """Make compact workflow of two visits going through isr and calib
+    into a coadd.
+
+    Tasks are nodes 1 and 3 (isr), 5 and 7 (calib), and 9 (coadd), the
+    rest are files.  The first visit is the critical path.
+    """
+    tasks = {1: ('isr', 10), 3: ('isr', 2), 5: ('calib', 30), 7: ('calib', None), 9: ('coadd', 5)}
+    graph = CompactGraph()
+    for node in range(12):
+        if node in tasks:
+            label, runtime = tasks[node]
+            graph.add_node(node, node_type=1, exec_name='pipetask', exec_args='run',
+                           task_label=label, runtime=runtime)
+        else:
+            graph.add_node(node, node_type=0, lfn='file%d' % node)
+    for u, v in [(0, 1), (1, 2), (2, 5), (5, 6), (6, 9), (9, 10),
+                 (11, 3), (3, 4), (4, 7), (7, 8), (8, 9)]:
+        graph.add_edge(u, v)
+    return graph
+
+
+@unittest.skipIf(daxgen is None, "Pegasus is not available")
+class DaxgenGraphTestCase(unittest.TestCase):
+
+    def testUntrustedCompact(self):
+        # file 0 -> task 1 -> file 2 -> task 3
+        graph = make_workflow([(0, 1), (1, 2), (2, 3)], [0, 1, 0, 1])
+        trusted = daxgen.Daxgen(graph=graph, trusted=True, validate=True)
+        untrusted = daxgen.Daxgen(graph=graph)
+        self.assertEqual(sorted(trusted._job_id(task) for task in trusted.tasks), ['000001', '000003'])
+        self.assertEqual(sorted(untrusted._job_id(task) for task in untrusted.tasks), ['000001', '000003'])
+        self.assertEqual(sorted(untrusted.files), ['000000', '000002'])
+
+    def testUntrustedUnknown(self):
+        self.assertRaises(TypeError, daxgen.Daxgen, graph=[(0, 1)])
+
+    def testValidate(self):
+        graph = make_workflow([(0, 1), (1, 2)], [0, 1, 0])
+        daxgen.Daxgen(graph=graph, trusted=True, validate=True)
+        # file -> file
+        graph = make_workflow([(0, 1), (1, 2), (2, 3)], [0, 1, 0, 0])
+        with self.assertRaisesRegex(ValueError, "connects two files"):
+            daxgen.Daxgen(graph=graph, trusted=True, validate=True)
+        # task -> task
+        graph = make_workflow([(0, 1), (1, 2)], [0, 1, 1])
+        with self.assertRaisesRegex(ValueError, "connects two tasks"):
+            daxgen.Daxgen(graph=graph, trusted=True, validate=True)
+        # missing type
+        graph = make_workflow([(0, 1)], [0, 1])
+        graph.add_node(2)
+        with self.assertRaisesRegex(ValueError, "invalid type"):
+            daxgen.Daxgen(graph=graph, trusted=True, validate=True)
+
+
+@unittest.skipIf(daxgen is None, "Pegasus is not available")
+class JsonStreamTestCase(unittest.TestCase):
+
+    document = {'directed': True, 'graph': {'name': 'wf'},
+                'nodes': [{'id': '000000', 'lfn': 'a' * 50}, {'id': '000001', 'runtime': 12345}],
+                'links': [{'source': '000000', 'target': '000001'}]}
+
+    def testChunks(self):
+        text = json.dumps(self.document, indent=1)
+        # values and numbers split across chunks of every size
+        for chunk_size in (1, 2, 3, 7, 64, len(text) + 1):
+            stream = daxgen._JsonStream(io.StringIO(text), chunk_size)
+            decoded = {}
+            stream.expect('{')
+            while not stream.accept('}'):
+                stream.accept(',')
+                key = stream.value()
+                stream.expect(':')
+                if key in ('nodes', 'links'):
+                    decoded[key] = list(stream.items())
+                else:
+                    decoded[key] = stream.value()
+            self.assertEqual(decoded, self.document, chunk_size)
+
+    def testEmptyArray(self):
+        stream = daxgen._JsonStream(io.StringIO(' [ ] '), 1)
+        self.assertEqual(list(stream.items()), [])
+
+    def testNumberAtEnd(self):
+        stream = daxgen._JsonStream(io.StringIO('123456'), 2)
+        self.assertEqual(stream.value(), 123456)
+
+    def testInvalid(self):
+        stream = daxgen._JsonStream(io.StringIO('[1, 2'), 2)
+        self.assertRaises(ValueError, list, stream.items())
+        stream = daxgen._JsonStream(io.StringIO('{"a" 1}'), 4)
+        stream.expect('{')
+        stream.value()
+        self.assertRaises(ValueError, stream.expect, ':')
+
+
+@unittest.skipIf(daxgen is None, "Pegasus is not available")
+class DaxStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def makeGraph(self):
+        # quantum 0 and input 1 -> task 2 -> file 3 -> task 5 -> file 6
+        #                            \-> file 4 ---------/
+        # quantum 7 -> task 8 <- file 3, with 8 writing stdout to file 9
+        graph = CompactGraph()
+        graph.add_node(0, node_type=0, lfn='quantum0.pickle', pfn='file:///in/quantum0.pickle')
+        graph.add_node(1, node_type=0, lfn='calexp.fits', ignore=True)
+        graph.add_node(2, node_type=1, exec_name='pipetask', exec_args='run -g quantum0.pickle',
+                       request_memory=2048, runtime=60.0, task_label='isr')
+        graph.add_node(3, node_type=0, lfn='warp.fits')
+        graph.add_node(4, node_type=0, lfn='calexp_out.fits')
+        graph.add_node(5, node_type=1, exec_name='pipetask', exec_args='run --x "a<b"',
+                       request_cpus=2, task_label='coadd')
+        graph.add_node(6, node_type=0, lfn='coadd.fits')
+        graph.add_node(7, node_type=0, lfn='quantum7.pickle', pfn='file:///in/quantum7.pickle')
+        graph.add_node(8, node_type=1, exec_name='pipetask', exec_args='run -g quantum7.pickle',
+                       runtime=5, task_label='coadd')
+        graph.add_node(9, node_type=0, lfn='task8.log', streams=1)
+        for u, v in [(0, 2), (1, 2), (2, 3), (2, 4), (3, 5), (4, 5), (5, 6), (7, 8), (3, 8), (8, 9)]:
+            graph.add_edge(u, v)
+        return graph
+
+    def compare(self, configure=None, reduce=False):
+        paths = [os.path.join(self.tmpdir.name, name) for name in ('dax.xml', 'stream.xml')]
+        results = []
+        for path, method in zip(paths, ('write_dax', 'write_dax_stream')):
+            gen = daxgen.Daxgen(graph=self.makeGraph(), trusted=True)
+            if configure is not None:
+                configure(gen)
+            getattr(gen, method)(path, reduce=reduce)
+            results.append(parse_dax(path))
+        self.assertEqual(results[0], results[1])
+        return results[1]
+
+    def testDefault(self):
+        jobs, dependencies = self.compare()
+        self.assertEqual(sorted(jobs), ['000002', '000005', '000008'])
+        self.assertEqual(jobs['000002']['args'], ['run', '-g', 'quantum0.pickle'])
+        self.assertEqual(jobs['000005']['args'], ['run', '--x', '"a<b"'])
+        self.assertIn(('condor', 'request_memory', '2048'), jobs['000002']['profiles'])
+        self.assertEqual(jobs['000008']['stdout'], [('task8.log', 'output')])
+        self.assertNotIn(('calexp.fits', 'input'), jobs['000002']['uses'])
+        self.assertEqual(dependencies, {'000005': {'000002'}, '000008': {'000002'}})
+
+    def testPriorities(self):
+        jobs, _ = self.compare(lambda gen: gen.prioritize())
+        self.assertIn(('dagman', 'PRIORITY', '65'), jobs['000002']['profiles'])
+
+    def testBundle(self):
+        jobs, _ = self.compare(lambda gen: gen.set_log_mode('bundle', directory='logs'))
+        self.assertEqual(jobs['000005']['name'], daxgen.LOG_WRAPPER)
+        self.assertEqual(jobs['000005']['args'][:3], ['logs/coadd', '000005', 'pipetask'])
+
+    def testReduce(self):
+        self.compare(reduce=True)
+
+
+@unittest.skipIf(daxgen is None, "Pegasus is not available")
+class DaxHierarchyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def checkHierarchy(self, partition):
+        gen = daxgen.Daxgen(graph=make_pipeline(), trusted=True)
+        parts = gen.partition(partition)
+        owner = {gen._job_id(task): label for label, tasks in parts.items() for task in tasks}
+        expected = {(owner[gen._job_id(child)], owner[gen._job_id(parent)])
+                    for child, parents in gen.dependencies().items() for parent in parents}
+        expected = {pair for pair in expected if pair[0] != pair[1]}
+
+        filename = os.path.join(self.tmpdir.name, 'workflow.dax')
+        subnames = gen.write_dax_hierarchy(filename, partition=partition)
+
+        # Dependencies between sub-workflows follow the cross-partition edges.
+        ns = '{http://pegasus.isi.edu/schema/DAX}'
+        root = ET.parse(filename).getroot()
+        labels = {dax.get('id'): dax.get('node-label') for dax in root.iter(ns + 'dax')}
+        self.assertEqual(sorted(labels.values()), sorted(parts))
+        depends = {(labels[child.get('ref')], labels[parent.get('ref')])
+                   for child in root.iter(ns + 'child') for parent in child.findall(ns + 'parent')}
+        self.assertEqual(depends, expected)
+
+        # Every job is in the sub-workflow of its partition, which keeps
+        # only the dependencies within the partition.
+        self.assertEqual(len(subnames), len(parts))
+        seen = set()
+        for subname in subnames:
+            jobs, dependencies = parse_dax(subname)
+            self.assertEqual(len({owner[job] for job in jobs}), 1, subname)
+            for child, parents in dependencies.items():
+                self.assertTrue(all(owner[parent] == owner[child] for parent in parents))
+            seen.update(jobs)
+        self.assertEqual(seen, set(owner))
+        return parts, depends
+
+    def testLabel(self):
+        parts, depends = self.checkHierarchy('label')
+        self.assertEqual(sorted(parts), ['calib', 'coadd', 'isr'])
+        self.assertEqual(depends, {('calib', 'isr'), ('coadd', 'calib')})
+
+    def testCount(self):
+        for count in (1, 2, 3, 5):
+            parts, _ = self.checkHierarchy(count)
+            self.assertEqual(len(parts), count)
+
+
+@unittest.skipIf(daxgen is None, "Pegasus is not available")
+class PrioritizeTestCase(unittest.TestCase):
+
+    def testCriticalPath(self):
+        gen = daxgen.Daxgen(graph=make_pipeline(), trusted=True)
+        # Longest runtime from a job to the end, calib 7 has no estimate.
+        self.assertEqual(gen.prioritize(), {9: 5, 5: 35, 7: 6, 1: 45, 3: 8})
+        self.assertEqual(gen.prioritize(default=60), {9: 5, 5: 35, 7: 65, 1: 45, 3: 67})
+        # The critical path is the one starting with the top priority.
+        self.assertEqual(max(gen.priorities, key=gen.priorities.get), 3)
+
+    def testUnweighted(self):
+        gen = daxgen.Daxgen(graph=make_pipeline(), trusted=True)
+        self.assertEqual(gen.prioritize(weight=None), {9: 1, 5: 2, 7: 2, 1: 3, 3: 3})
+
+    def testFractional(self):
+        graph = make_workflow([(0, 1), (1, 2), (2, 3)], [0, 1, 0, 1])
+        gen = daxgen.Daxgen(graph=graph, trusted=True)
+        self.assertEqual(gen.prioritize(weight=None, default=0.4), {1: 1, 3: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()